@@ -1,5 +1,4 @@
 import functools
-import json
 import os
 import os.path as osp
 import pickle
@@ -18,19 +17,26 @@ from qtpy import QtWidgets
 from labelme import __appname__
 from labelme import PY2
 from labelme import QT5
-from labelme.network import post, URL
+from labelme.network import NetworkError, post, URL
 
 from . import utils
+from labelme.cache import disk_cache
+from labelme.cache import frame_cache
 from labelme.config import get_config
 from labelme.label_file import LabelFile
 from labelme.label_file import LabelFileError
+from labelme.loader import ImageLoader
 from labelme.logger import logger
+from labelme.prefetch import Prefetcher
+from labelme.save_queue import SaveQueue
 from labelme.shape import DEFAULT_FILL_COLOR
 from labelme.shape import DEFAULT_LINE_COLOR
 from labelme.shape import Shape
+from labelme.undo import RelabelCommand
 from labelme.widgets import Canvas
 from labelme.widgets import ColorDialog
 from labelme.widgets import EscapableQListWidget
+from labelme.widgets import FileListModel
 from labelme.widgets import LabelDialog
 from labelme.widgets import LabelQListWidget
 from labelme.widgets import ToolBar
@@ -47,6 +53,11 @@ from labelme.widgets import ZoomWidget
 # - [low,maybe] Preview images on file dialogs.
 # - Zoom is too "steppy".
 
+# 放大镜的边长(像素)
+MAGNIFIER_SIZE = 200
+# 搜索框停止输入这么久(毫秒)后才向服务器查询文件列表
+FILE_SEARCH_DELAY = 300
+
 
 class MainWindow(QtWidgets.QMainWindow):
     FIT_WINDOW, FIT_WIDTH, MANUAL_ZOOM = 0, 1, 2
@@ -76,6 +87,10 @@ class MainWindow(QtWidgets.QMainWindow):
 
         # Whether we need to save or not.
         self.dirty = False
+        # 已加入写回队列、还没提交到服务器的标签: {filename: (imagePath, labeled)}
+        self._queuedLabels = {}
+        # 当前图片的标签提交失败而被标记为未保存
+        self._submitFailed = False
 
         self._noSelectionSlot = False
 
@@ -92,14 +107,67 @@ class MainWindow(QtWidgets.QMainWindow):
         self.labelList = LabelQListWidget()
         self.lastOpenDir = None
 
+        frame_cache.max_bytes = self._config['cache']['memory_mb'] * 1024 * 1024
+        disk_cache.max_bytes = self._config['cache']['disk_mb'] * 1024 * 1024
+        if self._config['cache']['disk_dir']:
+            disk_cache.root = self._config['cache']['disk_dir']
+        if self._config['save_queue']['enabled']:
+            journal = self._config['save_queue']['journal'] or osp.join(
+                osp.expanduser('~'), '.labelme', 'save_journal.jsonl')
+            LabelFile.save_queue = SaveQueue(
+                journal,
+                delay=self._config['save_queue']['delay'],
+                batch_size=self._config['save_queue']['batch_size'],
+                close_timeout=self._config['save_queue']['close_timeout'],
+            )
+            # 信号在后台线程发出, 连接到 MainWindow 的方法以便在 GUI 线程中执行
+            LabelFile.save_queue.saved.connect(self.labelsSubmitted)
+            LabelFile.save_queue.failed.connect(self.labelsSubmitFailed)
+            LabelFile.save_queue.rejected.connect(self.labelsRejected)
+        if self._config['preview']['enabled'] and \
+                not self._config['store_data']:
+            LabelFile.preview_max_side = self._config['preview']['max_side']
+        self.prefetcher = Prefetcher(
+            lambda filename: LabelFile([filename, None]),
+            is_cached=LabelFile.is_cached,
+            ahead=self._config['prefetch']['ahead'],
+            behind=self._config['prefetch']['behind'],
+            max_workers=self._config['prefetch']['workers'],
+        )
+        # 当前图片在单独的线程中加载, 不排在预取后面, 只显示最后一次请求的图片
+        self.imageLoader = ImageLoader(self.loadWebFrame)
+        self.imageLoader.loaded.connect(self.webFrameLoaded)
+        self.imageLoader.failed.connect(self.webFrameFailed)
+        # 放大超过预览图分辨率时在后台获取原图, 记录已请求原图的文件名, 避免每次缩放都重新请求
+        self.fullImageLoader = ImageLoader(LabelFile.fetch_full_image)
+        self.fullImageLoader.loaded.connect(self.fullImageLoaded)
+        self.fullImageLoader.failed.connect(self.fullImageFailed)
+        self._fullImageRequest = None
+
         self.expand_widget = QtWidgets.QLabel(self)
         self.expand_widget.setText("图片局部放大")
-        self.expand_widget.setFixedSize(200, 200)
+        self.expand_widget.setFixedSize(MAGNIFIER_SIZE, MAGNIFIER_SIZE)
         self.expand_widget.move(160, 160)
 
         self.expand_dock = QtWidgets.QDockWidget('放大镜', self)
         self.expand_dock.setObjectName('Flags')
         self.expand_dock.setWidget(self.expand_widget)
+        # 放大镜的显示缓冲区, QImage 直接引用这块内存, 每次更新只复制鼠标附近的区域
+        self._magnifierBuffer = np.zeros(
+            (MAGNIFIER_SIZE, MAGNIFIER_SIZE, 4), dtype=np.uint8)
+        self._magnifierBuffer[..., 3] = 255
+        self._magnifierImage = QtGui.QImage(
+            self._magnifierBuffer.data, MAGNIFIER_SIZE, MAGNIFIER_SIZE,
+            MAGNIFIER_SIZE * 4, QtGui.QImage.Format_RGB32)
+        self._magnifierArgs = None
+        self.image_bak = None
+        # 鼠标移动很快时合并为每帧更新一次
+        self._magnifierTimer = QtCore.QTimer(self)
+        self._magnifierTimer.setSingleShot(True)
+        screen = QtWidgets.QApplication.primaryScreen()
+        refresh_rate = screen.refreshRate() if screen else 60
+        self._magnifierTimer.setInterval(int(1000 / (refresh_rate or 60)))
+        self._magnifierTimer.timeout.connect(self.updateMagnifier)
 
         self.flag_dock = self.flag_widget = None
         self.flag_dock = QtWidgets.QDockWidget('标记', self)
@@ -136,16 +204,34 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.fileSearch = QtWidgets.QLineEdit()
         self.fileSearch.setPlaceholderText('搜索文件名')
-        self.fileSearch.textChanged.connect(self.fileSearchChanged)
-        self.fileListWidget = QtWidgets.QListWidget()
-        self.fileListWidget.itemSelectionChanged.connect(
+        # 每次按键都重新计时, 输入停止后只查询一次
+        self._fileSearchTimer = QtCore.QTimer(self)
+        self._fileSearchTimer.setSingleShot(True)
+        self._fileSearchTimer.setInterval(FILE_SEARCH_DELAY)
+        self._fileSearchTimer.timeout.connect(self.fileSearchChanged)
+        self.fileSearch.textChanged.connect(self._fileSearchTimer.start)
+        self.fileFilter = QtWidgets.QComboBox()
+        self.fileFilter.addItem('全部', {})
+        self.fileFilter.addItem('已标注', {'labeled': True})
+        self.fileFilter.addItem('未标注', {'labeled': False})
+        self.fileFilter.addItem('模糊', {'fuzzy': 1})
+        self.fileFilter.currentIndexChanged.connect(self.fileSearchChanged)
+        # 文件列表按页从服务器获取, 滚动到底部时加载下一页
+        self.fileListQuery = {}
+        self.fileListNextId = None
+        self.fileListModel = FileListModel(fetch_page=self.fetchFileListPage)
+        self.fileListView = QtWidgets.QListView()
+        self.fileListView.setUniformItemSizes(True)
+        self.fileListView.setModel(self.fileListModel)
+        self.fileListView.selectionModel().selectionChanged.connect(
             self.fileSelectionChanged
         )
         fileListLayout = QtWidgets.QVBoxLayout()
         fileListLayout.setContentsMargins(0, 0, 0, 0)
         fileListLayout.setSpacing(0)
         fileListLayout.addWidget(self.fileSearch)
-        fileListLayout.addWidget(self.fileListWidget)
+        fileListLayout.addWidget(self.fileFilter)
+        fileListLayout.addWidget(self.fileListView)
         self.file_dock = QtWidgets.QDockWidget(u'文件列表', self)
         self.file_dock.setObjectName(u'Files')
         fileListWidget = QtWidgets.QWidget()
@@ -155,7 +241,9 @@ class MainWindow(QtWidgets.QMainWindow):
         self.zoomWidget = ZoomWidget()
         self.colorDialog = ColorDialog(parent=self)
 
-        self.canvas = self.labelList.canvas = Canvas(callback=self.mouseMoveEvent, epsilon=self._config['epsilon'])
+        self.canvas = self.labelList.canvas = Canvas(
+            callback=self.mouseMoveEvent, epsilon=self._config['epsilon'],
+            undo_max_bytes=int(self._config['undo']['memory_mb'] * 1024 * 1024))
         self.canvas.zoomRequest.connect(self.zoomRequest)
 
         scrollArea = QtWidgets.QScrollArea()
@@ -351,6 +439,8 @@ class MainWindow(QtWidgets.QMainWindow):
 
         undo = action('撤销', self.undoShapeEdit, shortcuts['undo'], 'undo',
                       '撤消上次添加和编辑形状', enabled=False)
+        redo = action('重做', self.redoShapeEdit, shortcuts['redo'], 'undo',
+                      '重做上次撤消的修改', enabled=False)
 
         hideAll = action('&隐藏\n标记',
                          functools.partial(self.togglePolygons, False),
@@ -445,7 +535,7 @@ class MainWindow(QtWidgets.QMainWindow):
             lineColor=color1, fillColor=color2,
             toggleKeepPrevMode=toggle_keep_prev_mode,
             delete=delete, edit=edit, copy=copy,
-            undoLastPoint=undoLastPoint, undo=undo,
+            undoLastPoint=undoLastPoint, undo=undo, redo=redo,
             deletePoint=deletePoint,
             addDisVisiblePoint=addDisVisiblePoint,
             addVisiblePoint=addVisiblePoint,
@@ -462,7 +552,7 @@ class MainWindow(QtWidgets.QMainWindow):
             openNextImg=openNextImg, openPrevImg=openPrevImg,
             fileMenuActions=(save, close, quit),
             tool=(),
-            editMenu=(edit, copy, delete, None, undo, undoLastPoint,
+            editMenu=(edit, copy, delete, None, undo, redo, undoLastPoint,
                       None, color1, color2, None, toggle_keep_prev_mode),
             # menu shown at right click
             menu=(
@@ -479,6 +569,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 shapeLineColor,
                 shapeFillColor,
                 undo,
+                redo,
                 undoLastPoint,
                 deletePoint,
                 addDisVisiblePoint,
@@ -500,6 +591,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.canvas.edgeSelected.connect(self.actions.addDisVisiblePoint.setEnabled)
         self.canvas.edgeSelected.connect(self.actions.addVisiblePoint.setEnabled)
         self.canvas.edgeSelected.connect(self.actions.deletePoint.setEnabled)
+        self.canvas.undoStackChanged.connect(self.undoStackChanged)
 
         self.menus = utils.struct(
             file=self.menu('&文件'),
@@ -629,11 +721,11 @@ class MainWindow(QtWidgets.QMainWindow):
         self.restoreState(
             self.settings.value('window/state', QtCore.QByteArray()))
         self.lineColor = QtGui.QColor(
-            self.settings.value('line/color', Shape.line_color))
+            self.settings.value('line/color', Shape.default_line_color))
         self.fillColor = QtGui.QColor(
-            self.settings.value('fill/color', Shape.fill_color))
-        Shape.line_color = self.lineColor
-        Shape.fill_color = self.fillColor
+            self.settings.value('fill/color', Shape.default_fill_color))
+        Shape.default_line_color = self.lineColor
+        Shape.default_fill_color = self.fillColor
 
         # Populate the File menu dynamically.
         self.updateFileMenu()
@@ -672,7 +764,7 @@ class MainWindow(QtWidgets.QMainWindow):
     # Support Functions
 
     def noShapes(self):
-        return not self.labelList.itemsToShapes
+        return not self.labelList.count()
 
     def populateModeActions(self):
         tool, menu = self.actions.tool, self.actions.menu
@@ -696,15 +788,20 @@ class MainWindow(QtWidgets.QMainWindow):
         if self._config['auto_save'] or self.actions.saveAuto.isChecked():
             self.saveLabels(self.imagePath)
             return
+        self.markDirty()
+
+    def markDirty(self):
+        """标记为未保存, 不触发自动保存"""
+        self._submitFailed = False
         self.dirty = True
         self.actions.save.setEnabled(True)
-        self.actions.undo.setEnabled(self.canvas.isShapeRestorable)
         title = __appname__
         if self.filename is not None:
             title = '{} - {}*'.format(title, self.filename)
         self.setWindowTitle(title)
 
     def setClean(self):
+        self._submitFailed = False
         self.dirty = False
         self.actions.save.setEnabled(False)
         self.actions.createMode.setEnabled(True)
@@ -767,10 +864,28 @@ class MainWindow(QtWidgets.QMainWindow):
     # Callbacks
 
     def undoShapeEdit(self):
-        self.canvas.restoreShape()
+        if self.canvas.undo() is not None:
+            self.reloadLabelList()
+            self.setDirty()
+
+    def redoShapeEdit(self):
+        if self.canvas.redo() is not None:
+            self.reloadLabelList()
+            self.setDirty()
+
+    def reloadLabelList(self):
+        """撤销/重做后按画布上的形状重建标签列表"""
         self.labelList.clear()
-        self.loadShapes(self.canvas.shapes)
-        self.actions.undo.setEnabled(self.canvas.isShapeRestorable)
+        for shape in self.canvas.shapes:
+            self.addLabel(shape)
+        if self.noShapes():
+            for action in self.actions.onShapesPresent:
+                action.setEnabled(False)
+
+    def undoStackChanged(self):
+        drawing = self.canvas.drawing() and self.canvas.current is not None
+        self.actions.undo.setEnabled(not drawing and self.canvas.canUndo())
+        self.actions.redo.setEnabled(not drawing and self.canvas.canRedo())
 
     def tutorial(self):
         # url = 'https://github.com/wkentaro/labelme/tree/master/examples/tutorial'  # NOQA
@@ -788,7 +903,8 @@ class MainWindow(QtWidgets.QMainWindow):
         """
         self.actions.editMode.setEnabled(not drawing)
         self.actions.undoLastPoint.setEnabled(drawing)
-        self.actions.undo.setEnabled(not drawing)
+        self.actions.undo.setEnabled(not drawing and self.canvas.canUndo())
+        self.actions.redo.setEnabled(not drawing and self.canvas.canRedo())
         self.actions.delete.setEnabled(not drawing)
 
     def toggleDrawMode(self, edit=True, createMode='polygon'):
@@ -905,27 +1021,24 @@ class MainWindow(QtWidgets.QMainWindow):
             self.uniqLabelList.sortItems()
 
     def fileSearchChanged(self):
-        self.importDirImages(
-            self.imageList,
+        self._fileSearchTimer.stop()
+        self.importWebImages(
             pattern=self.fileSearch.text(),
             load=False,
         )
 
     def fileSelectionChanged(self):
-        items = self.fileListWidget.selectedItems()
-        if not items:
+        indexes = self.fileListView.selectedIndexes()
+        if not indexes:
             return
-        item = items[0]
 
         if not self.mayContinue():
             return
 
-        currIndex = self.imageList.index(str(item.text()))
-        if currIndex < len(self.imageList):
-            filename = self.imageList[currIndex]
-            if filename:
-                self.loadFileByWeb(filename)
-                # self.loadFile(filename)
+        filename = self.fileListModel.path(indexes[0].row())
+        if filename:
+            self.loadFileByWeb(filename)
+            # self.loadFile(filename)
 
     # React to canvas signals.
     def shapeSelectionChanged(self, selected=False):
@@ -948,8 +1061,7 @@ class MainWindow(QtWidgets.QMainWindow):
         item = QtWidgets.QListWidgetItem(shape.label)
         item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
         item.setCheckState(Qt.Checked)
-        self.labelList.itemsToShapes.append((item, shape))
-        self.labelList.addItem(item)
+        self.labelList.addShapeItem(item, shape)
         if not self.uniqLabelList.findItems(shape.label, Qt.MatchExactly):
             self.uniqLabelList.addItem(shape.label)
             self.uniqLabelList.sortItems()
@@ -958,8 +1070,7 @@ class MainWindow(QtWidgets.QMainWindow):
             action.setEnabled(True)
 
     def remLabel(self, shape):
-        item = self.labelList.get_item_from_shape(shape)
-        self.labelList.takeItem(self.labelList.row(item))
+        self.labelList.removeShapeItem(shape)
 
     def loadShapes(self, shapes):
         for shape in shapes:
@@ -971,8 +1082,7 @@ class MainWindow(QtWidgets.QMainWindow):
         for label, points, visibles, line_color, fill_color, shape_type in shapes:
             shape = Shape(label=label, shape_type=shape_type)
             shape.visibles = visibles
-            for x, y in points:
-                shape.addPoint(QtCore.QPoint(x, y))
+            shape.points = points
             shape.close()
             s.append(shape)
             if line_color:
@@ -999,8 +1109,8 @@ class MainWindow(QtWidgets.QMainWindow):
                 if s.line_color != self.lineColor else None,
                 fill_color=s.fill_color.getRgb()
                 if s.fill_color != self.fillColor else None,
-                points=[(p.x(), p.y()) for p in s.points],
-                visible=s.visibles,
+                points=s.pointsArray().tolist(),
+                visible=list(s.visibles),
                 shape_type=s.shape_type,
             )
 
@@ -1017,13 +1127,13 @@ class MainWindow(QtWidgets.QMainWindow):
             imageData = self.imageData if self._config['store_data'] else None
             # if osp.dirname(filename) and not osp.exists(osp.dirname(filename)):
             #     os.makedirs(osp.dirname(filename))
-            lf.save_to_web(
+            saved = lf.save_to_web(
                 filename=filename,
                 shapes=shapes,
                 imagePath=imagePath,
                 imageData=imageData,
-                imageHeight=self.image.height(),
-                imageWidth=self.image.width(),
+                imageHeight=self.canvas.imageSize.height(),
+                imageWidth=self.canvas.imageSize.width(),
                 lineColor=self.lineColor.getRgb(),
                 fillColor=self.fillColor.getRgb(),
                 otherData=self.otherData,
@@ -1031,16 +1141,13 @@ class MainWindow(QtWidgets.QMainWindow):
                 callback=[self.errorMessage, self.status]
             )
             # self.labelFile = lf
-            items = self.fileListWidget.findItems(
-                self.imagePath, Qt.MatchExactly
-            )
-            if len(items) > 0:
-                if len(items) != 1:
-                    raise RuntimeError('There are duplicate files.')
-                if len(shapes) <= 0:
-                    items[0].setCheckState(Qt.Unchecked)
-                else:
-                    items[0].setCheckState(Qt.Checked)
+            if not saved:
+                return False
+            if LabelFile.save_queue is not None:
+                # 提交到服务器后再更新勾选状态, 见 labelsSubmitted
+                self._queuedLabels[filename] = (self.imagePath, len(shapes) > 0)
+            else:
+                self.fileListModel.setLabeled(self.imagePath, len(shapes) > 0)
             # disable allows next and previous image to proceed
             # self.filename = filename
             return True
@@ -1048,6 +1155,39 @@ class MainWindow(QtWidgets.QMainWindow):
             self.errorMessage('Error saving label data', '<b>%s</b>' % e)
             return False
 
+    def labelsSubmitted(self, paths):
+        """写回队列把标签提交到服务器后更新勾选状态"""
+        for path in paths:
+            # 提交期间又保存过的, 等最新的标签提交后再更新
+            if path in self._queuedLabels and \
+                    LabelFile.save_queue.pending(path) is None:
+                imagePath, labeled = self._queuedLabels.pop(path)
+                self.fileListModel.setLabeled(imagePath, labeled)
+        if self._submitFailed and \
+                LabelFile.save_queue.pending(self.imagePath) is None:
+            self.setClean()
+        self.status("标签保存成功！ ({})".format(len(paths)))
+
+    def labelsSubmitFailed(self, message):
+        """提交失败时写回队列会稍后重试, 在此之前当前图片标记为未保存"""
+        self.status(message)
+        if self.imagePath and \
+                LabelFile.save_queue.pending(self.imagePath) is not None:
+            self.markDirty()
+            self._submitFailed = True
+
+    def labelsRejected(self, paths):
+        """服务器上没有这些图片, 写回队列不会再重试"""
+        for path in paths:
+            if path in self._queuedLabels:
+                imagePath, _ = self._queuedLabels.pop(path)
+                self.fileListModel.setLabeled(imagePath, False)
+        if self.imagePath in paths:
+            self.markDirty()
+        self.errorMessage(
+            '标签保存失败',
+            '服务器上没有这些图片: <br/>{}'.format('<br/>'.join(paths)))
+
     def copySelectedShape(self):
         self.addLabel(self.canvas.copySelectedShape())
         # fix copy and delete
@@ -1064,7 +1204,8 @@ class MainWindow(QtWidgets.QMainWindow):
         shape = self.labelList.get_shape_from_item(item)
         label = str(item.text())
         if label != shape.label:
-            shape.label = str(item.text())
+            self.canvas.pushUndo(RelabelCommand(shape, shape.label, label))
+            shape.label = label
             self.setDirty()
         else:  # User probably changed item visibility
             self.canvas.setShapeVisible(shape, item.checkState() == Qt.Checked)
@@ -1089,12 +1230,10 @@ class MainWindow(QtWidgets.QMainWindow):
             text = None
         if text is None:
             self.canvas.undoLastLine()
-            self.canvas.shapesBackups.pop()
         else:
             self.addLabel(self.canvas.setLastLabel(text))
             self.actions.editMode.setEnabled(True)
             self.actions.undoLastPoint.setEnabled(False)
-            self.actions.undo.setEnabled(True)
             self.setDirty()
 
     def scrollRequest(self, delta, orientation):
@@ -1147,12 +1286,10 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def loadFile(self, filename=None):
         """Load the specified file, or the last opened file if None."""
-        # changing fileListWidget loads file
-        if (filename in self.imageList and
-                self.fileListWidget.currentRow() !=
-                self.imageList.index(filename)):
-            self.fileListWidget.setCurrentRow(self.imageList.index(filename))
-            self.fileListWidget.repaint()
+        # changing fileListView loads file
+        row = self.fileListModel.row(filename)
+        if row >= 0 and self.fileListView.currentIndex().row() != row:
+            self.setFileListRow(row)
             return
 
         self.resetState()
@@ -1239,6 +1376,10 @@ class MainWindow(QtWidgets.QMainWindow):
     def paintCanvas(self):
         assert not self.image.isNull(), "cannot paint null image"
         self.canvas.scale = 0.01 * self.zoomWidget.value()
+        if self.labelFile and self.labelFile.isPreview and \
+                self.canvas.scale > self.canvas.previewScale():
+            # 放大到超过预览图的分辨率, 换成原图
+            self.loadFullImage()
         self.canvas.adjustSize()
         self.canvas.update()
 
@@ -1253,19 +1394,26 @@ class MainWindow(QtWidgets.QMainWindow):
         h1 = self.centralWidget().height() - e
         a1 = w1 / h1
         # Calculate a new scale value based on the pixmap's aspect ratio.
-        w2 = self.canvas.pixmap.width() - 0.0
-        h2 = self.canvas.pixmap.height() - 0.0
+        w2 = self.canvas.imageSize.width() - 0.0
+        h2 = self.canvas.imageSize.height() - 0.0
         a2 = w2 / h2
         return w1 / w2 if a2 >= a1 else h1 / h2
 
     def scaleFitWidth(self):
         # The epsilon does not seem to work too well here.
         w = self.centralWidget().width() - 2.0
-        return w / self.canvas.pixmap.width()
+        return w / self.canvas.imageSize.width()
 
     def closeEvent(self, event):
         if not self.mayContinue():
             event.ignore()
+        else:
+            self.imageLoader.shutdown()
+            self.fullImageLoader.shutdown()
+            self.prefetcher.shutdown()
+            disk_cache.flush()
+            if LabelFile.save_queue is not None:
+                LabelFile.save_queue.close()
         self.settings.setValue(
             'filename', self.filename if self.filename else '')
         self.settings.setValue('window/size', self.size())
@@ -1298,7 +1446,7 @@ class MainWindow(QtWidgets.QMainWindow):
         if self.filename is None:
             return
 
-        currIndex = self.imageList.index(self.filename)
+        currIndex = self.fileListModel.row(self.filename)
         if currIndex - 1 >= 0:
             filename = self.imageList[currIndex - 1]
             if filename:
@@ -1323,7 +1471,7 @@ class MainWindow(QtWidgets.QMainWindow):
         if self.filename is None:
             filename = self.imageList[0]
         else:
-            currIndex = self.imageList.index(self.filename)
+            currIndex = self.fileListModel.row(self.filename)
             if currIndex + 1 < len(self.imageList):
                 filename = self.imageList[currIndex + 1]
             else:
@@ -1380,11 +1528,9 @@ class MainWindow(QtWidgets.QMainWindow):
         current_filename = self.filename
         self.importDirImages(self.lastOpenDir, load=False)
 
-        if current_filename in self.imageList:
+        if current_filename in self.fileListModel:
             # retain currently selected file
-            self.fileListWidget.setCurrentRow(
-                self.imageList.index(current_filename))
-            self.fileListWidget.repaint()
+            self.setFileListRow(self.fileListModel.row(current_filename))
 
     def saveFile(self, _value=False):
         assert not self.image.isNull(), "无法保存空图片"
@@ -1470,14 +1616,13 @@ class MainWindow(QtWidgets.QMainWindow):
             os.remove(label_file)
             logger.info('删除标签文件: {}'.format(label_file))
 
-            item = self.fileListWidget.currentItem()
-            item.setCheckState(Qt.Unchecked)
+            self.fileListModel.setLabeled(self.filename, False)
 
             self.resetState()
 
     # Message Dialogs. #
     def hasLabels(self):
-        if not self.labelList.itemsToShapes:
+        if not self.labelList.count():
             self.errorMessage(
                 '没有标记对象',
                 '你必须标记至少一个对象才能保存文件.')
@@ -1523,7 +1668,7 @@ class MainWindow(QtWidgets.QMainWindow):
         if color:
             self.lineColor = color
             # Change the color for all shape lines:
-            Shape.line_color = self.lineColor
+            Shape.default_line_color = self.lineColor
             self.canvas.update()
             self.setDirty()
 
@@ -1532,7 +1677,7 @@ class MainWindow(QtWidgets.QMainWindow):
             self.fillColor, '选择填充颜色', default=DEFAULT_FILL_COLOR)
         if color:
             self.fillColor = color
-            Shape.fill_color = self.fillColor
+            Shape.default_fill_color = self.fillColor
             self.canvas.update()
             self.setDirty()
 
@@ -1595,40 +1740,18 @@ class MainWindow(QtWidgets.QMainWindow):
 
     @property
     def imageList(self):
-        lst = []
-        for i in range(self.fileListWidget.count()):
-            item = self.fileListWidget.item(i)
-            lst.append(item.text())
-        return lst
+        return self.fileListModel.paths
 
-    def importDirImages(self, fileNames, pattern=None, load=True):
-        self.actions.openNextImg.setEnabled(True)
-        self.actions.openPrevImg.setEnabled(True)
-        fileNames = [info[1] for info in self.images_data["image_list"]]
-        if not self.mayContinue() or not fileNames:
-            return
+    def setFileListRow(self, row):
+        """选中文件列表的第 row 行, 会触发 fileSelectionChanged 加载图片"""
+        index = self.fileListModel.index(row)
+        self.fileListView.setCurrentIndex(index)
+        self.fileListView.scrollTo(index)
 
+    def importDirImages(self, fileNames, pattern=None, load=True):
+        # 图片列表来自服务器, 本地目录参数被忽略
         self.lastOpenDir = fileNames
-        self.filename = None
-        self.fileListWidget.clear()
-
-        # for filename in self.scanAllImages(fileNames):
-        for filename in fileNames:
-            if pattern and pattern not in filename:
-                continue
-            item = QtWidgets.QListWidgetItem(filename)
-            item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
-            label = self.dict_filename_label_web[filename]
-            if label:
-                label = json.loads(label)
-                if len(label["shapes"]) != 0:
-                    item.setCheckState(Qt.Checked)  # 如果有标签文件，则勾选
-                else:
-                    item.setCheckState(Qt.Unchecked)
-            else:
-                item.setCheckState(Qt.Unchecked)
-            self.fileListWidget.addItem(item)
-        self.openNextImgByWeb(load=load)
+        self.importWebImages(pattern=pattern, load=load)
 
     def scanAllImages(self, fileNames):
         s = time.time()
@@ -1645,12 +1768,10 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def loadFileByWeb(self, filename=None):
         """Load the specified file, or the last opened file if None."""
-        # changing fileListWidget loads file
-        if (filename in self.imageList and
-                self.fileListWidget.currentRow() !=
-                self.imageList.index(filename)):
-            self.fileListWidget.setCurrentRow(self.imageList.index(filename))
-            self.fileListWidget.repaint()
+        # changing fileListView loads file
+        row = self.fileListModel.row(filename)
+        if row >= 0 and self.fileListView.currentIndex().row() != row:
+            self.setFileListRow(row)
             return
 
         self.resetState()
@@ -1658,31 +1779,51 @@ class MainWindow(QtWidgets.QMainWindow):
         if filename is None:
             filename = self.settings.value('filename', '')
         filename = str(filename)
-        if not filename in self.imageList:
+        if filename not in self.fileListModel:
             self.errorMessage(
                 '服务器没有这张图片', '文件名: <b>%s</b>' % filename)
             return False
-        # assumes same name, but json extension
+        # 加载完成前就记下文件名, 连续翻页时以此为准
+        self.filename = filename
         self.status("加载 %s..." % osp.basename(str(filename)))
-        label_tag = self.dict_filename_label_web[filename]
-        if not label_tag is None:
-            label_tag = json.loads(label_tag)
-        else:
-            label_tag = []
-        try:
-            self.labelFile = LabelFile([filename, label_tag])
-        except LabelFileError as e:
-            self.errorMessage(
-                '网络繁忙',
-                "<p><i>%s</i> "
-                % ("服务器忙！请重试！"))
-            # self.errorMessage(
-            #     'Error opening file',
-            #     "<p><b>%s</b></p>"
-            #     "<p>Make sure <i>%s</i> is a valid label file."
-            #     % (e, label_tag))
-            self.status("Error reading %s" % label_tag)
-            return False
+        self.imageLoader.request(filename)
+        self.prefetcher.schedule(self.imageList,
+                                 self.fileListModel.row(filename))
+        return True
+
+    def loadWebFrame(self, filename):
+        """
+        在工作线程中下载并解码图片和标签
+        :param filename:
+        :return: (LabelFile, 显示用的 QImage)
+        """
+        labelFile = self.prefetcher.take(filename)
+        if labelFile is None:
+            labelFile = LabelFile([filename, None])
+        return labelFile, self.webFrameImage(labelFile)
+
+    def webFrameFailed(self, seq, filename, error):
+        if not self.imageLoader.isCurrent(seq):
+            return
+        self.errorMessage(
+            '网络繁忙',
+            "<p><i>%s</i> "
+            % ("服务器忙！请重试！"))
+        # self.errorMessage(
+        #     'Error opening file',
+        #     "<p><b>%s</b></p>"
+        #     "<p>Make sure <i>%s</i> is a valid label file."
+        #     % (e, filename))
+        self.status("Error reading %s" % filename)
+
+    def webFrameLoaded(self, seq, filename, result):
+        """后台加载完成, 在 GUI 线程中显示图片和标注"""
+        # 用户已经翻到别的图片
+        if not self.imageLoader.isCurrent(seq):
+            return
+        self.labelFile, image = result
+        self.fullImageLoader.cancel()
+        self._fullImageRequest = None
         self.imageData = self.labelFile.imageData
         self.imagePath = filename
         if self.labelFile.lineColor is not None:
@@ -1693,15 +1834,8 @@ class MainWindow(QtWidgets.QMainWindow):
 
         if self.labelFile.fuzzy:
             self.actions.ignoreImageButton.setIconText("恢复")
-            image = self.labelFile.image_numpy
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-            image = cv2.imencode('.jpg', image)
-            image = image[1].tobytes()
         else:
             self.actions.ignoreImageButton.setIconText("忽略")
-            image = self.imageData
-
-        image = QtGui.QImage.fromData(image)
 
         if image.isNull():
             formats = ['*.{}'.format(fmt.data().decode())
@@ -1717,7 +1851,8 @@ class MainWindow(QtWidgets.QMainWindow):
         self.filename = filename
         if self._config['keep_prev']:
             prev_shapes = self.canvas.shapes
-        self.canvas.loadPixmap(QtGui.QPixmap.fromImage(image))
+        self.canvas.loadPixmap(QtGui.QPixmap.fromImage(image),
+                               QtCore.QSize(*self.labelFile.imageSize))
         if self._config['flags']:
             self.loadFlags({k: False for k in self._config['flags']})
 
@@ -1735,7 +1870,48 @@ class MainWindow(QtWidgets.QMainWindow):
         self.addRecentFile(self.filename)
         self.toggleActions(True)
         self.status("Loaded %s" % osp.basename(str(filename)))
+        logger.debug(frame_cache.stats())
         return True
+
+    def webFrameImage(self, labelFile=None):
+        """当前图片(或 labelFile)的 QImage, 被标记为模糊的图片显示为灰度图"""
+        if labelFile is None:
+            labelFile = self.labelFile
+        if not labelFile.fuzzy:
+            return labelFile.qimage
+        image = labelFile.image_numpy
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        image = cv2.imencode('.jpg', image)
+        return QtGui.QImage.fromData(image[1].tobytes())
+
+    def loadFullImage(self):
+        """在后台获取当前图片的原图, 完成后由 fullImageLoaded 替换预览图"""
+        if self._fullImageRequest == self.labelFile.filename:
+            return
+        self._fullImageRequest = self.labelFile.filename
+        self.status("加载原图 %s..." % osp.basename(str(self.labelFile.filename)))
+        self.fullImageLoader.request(self.labelFile.filename)
+
+    def fullImageLoaded(self, seq, filename, image):
+        """把当前显示的预览图换成原图, 保留标注"""
+        # 用户已经翻到别的图片
+        if not self.fullImageLoader.isCurrent(seq) or not self.labelFile or \
+                self.labelFile.filename != filename or \
+                not self.labelFile.isPreview:
+            return
+        self.labelFile.set_full_image(image)
+        self.imageData = self.labelFile.imageData
+        self.image = self.webFrameImage()
+        self.canvas.replacePixmap(QtGui.QPixmap.fromImage(self.image))
+        self.status("Loaded %s" % osp.basename(str(filename)))
+
+    def fullImageFailed(self, seq, filename, error):
+        if not self.fullImageLoader.isCurrent(seq):
+            return
+        # 下次放大时重试
+        self._fullImageRequest = None
+        self.status("原图加载失败: %s" % error)
+
 # https://kyfw.12306.cn/passport/captcha/captcha-check?answer=245%2C105&rand=sjrand&login_site=E
 
 # https://kyfw.12306.cn/passport/captcha/captcha-check?callback=jQuery19106513270212890739_1554170758410&answer=258,37,108,105&rand=sjrand&login_site=E&_=1554170758412
@@ -1758,7 +1934,10 @@ class MainWindow(QtWidgets.QMainWindow):
         if self.filename is None:
             filename = self.imageList[0]
         else:
-            currIndex = self.imageList.index(self.filename)
+            currIndex = self.fileListModel.row(self.filename)
+            if currIndex + 1 >= len(self.imageList):
+                # 已到当前页末尾, 先加载下一页
+                self.fetchFileListPage()
             if currIndex + 1 < len(self.imageList):
                 filename = self.imageList[currIndex + 1]
             else:
@@ -1771,27 +1950,6 @@ class MainWindow(QtWidgets.QMainWindow):
         self._config['keep_prev'] = keep_prev
 
     def importWebImages(self, pattern=None, load=True):
-        while 1:
-            self.images_data = post("get_file_list")
-            if self.images_data is None:
-                print("服务器报错！正在在重试！")
-                continue
-            if "state" in self.images_data:
-                print("服务器报错！正在在重试！")
-                continue
-            elif "image_list" in self.images_data:
-                print("获取图片列表成功 正在加载！")
-                break
-            else:
-                print("未知错误！正在在重试！")
-                continue
-
-        # with open('images_data.pkl', 'wb') as f:
-        #     pickle.dump(self.images_data, f)
-        #
-        # with open('images_data.pkl', 'rb') as f:
-        #     self.images_data = pickle.load(f)
-
         self.actions.openNextImg.setEnabled(True)
         self.actions.openPrevImg.setEnabled(True)
 
@@ -1799,115 +1957,94 @@ class MainWindow(QtWidgets.QMainWindow):
             return
 
         self.filename = None
-        self.fileListWidget.clear()
-        self.dict_filename_label_web = dict()
-        for id, filename, label in self.images_data["image_list"]:
-            self.dict_filename_label_web[filename] = label
-            if pattern and pattern not in filename:
-                continue
-
-            item = QtWidgets.QListWidgetItem(filename)
-            item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
-            if label:
-                label = json.loads(label)
-                if len(label["shapes"]) != 0:
-                    item.setCheckState(Qt.Checked)  # 如果有标签文件，则勾选
-                else:
-                    item.setCheckState(Qt.Unchecked)
-            else:
-                item.setCheckState(Qt.Unchecked)
-            self.fileListWidget.addItem(item)
+        self.fileListModel.clear()
+        self.fileListQuery = dict(self.fileFilter.currentData() or {})
+        if pattern:
+            self.fileListQuery['search'] = pattern
+        self.fileListNextId = 0
+        # post 已经按退避重试到超时, 这里不再重试
+        if not self.fetchFileListPage():
+            self.errorMessage('获取文件列表失败', '服务器没有响应或返回错误, 请稍后重试')
+            return
+        print("获取图片列表成功 正在加载！")
         self.openNextImgByWeb(load=load)
 
-    def img2pixmap(self, image):
-        Y, X = image.shape[:2]
-        self._bgra = np.zeros((Y, X, 4), dtype=np.uint8, order='C')
-        self._bgra[..., 0] = image[..., 2]
-        self._bgra[..., 1] = image[..., 1]
-        self._bgra[..., 2] = image[..., 0]
-        qimage = QtGui.QImage(self._bgra.data, X, Y, QtGui.QImage.Format_RGB32)
-        pixmap = QtGui.QPixmap.fromImage(qimage)
-        return pixmap
+    def fetchFileListPage(self):
+        """
+        从服务器获取下一页文件列表, 追加到文件列表末尾
+        :return: 是否成功, 已没有更多数据时也返回 True
+        """
+        if self.fileListNextId is None:
+            return True
+        data = dict(self.fileListQuery)
+        data['after_id'] = self.fileListNextId
+        data['limit'] = self._config['file_list_page_size']
+        try:
+            result = post("get_file_page", data=data)
+        except NetworkError as e:
+            logger.warning(e)
+            return False
+        if "image_list" not in result:
+            return False
+        self.fileListModel.append([
+            (filename, shape_count)
+            for id, filename, shape_count, fuzzy in result["image_list"]])
+        self.fileListNextId = result["next_id"]
+        self.fileListModel.hasMore = self.fileListNextId is not None
+        return True
 
     def mouseMoveEvent(self, event, adsorb, press, focus_x, focus_y):
         """
-        Canvas 类的鼠标移动事件回调
+        Canvas 类的鼠标移动事件回调, 只记录位置, 放大镜按屏幕刷新率更新
         :param event:
         :return:
         """
-        image = self.labelFile.image_numpy
+        self._magnifierArgs = (adsorb, press, focus_x, focus_y)
+        if not self._magnifierTimer.isActive():
+            self._magnifierTimer.start()
+
+    def updateMagnifier(self):
+        """把鼠标附近 200x200 的区域复制到放大镜的缓冲区并显示"""
+        if self._magnifierArgs is None:
+            return
+        adsorb, press, focus_x, focus_y = self._magnifierArgs
+        self._magnifierArgs = None
+        image = self.labelFile.image_numpy if self.labelFile else None
         if image is not None:
             self.image_bak = image
         elif self.image_bak is not None:
             image = self.image_bak
-        if not image is None:
-            # image = image[:, :, ::-1]
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            h, w = image.shape[:2]
-            offsetsX = self.canvas.offsets[0].x()
-            offsetsY = self.canvas.offsets[1].y()
-            if adsorb or press:
-                x = min(max(self.canvas.prevMovePoint.x(), 0), w)
-                y = min(max(self.canvas.prevMovePoint.y(), 0), h)
-            else:
-                x = focus_x
-                y = focus_y
-
-            color = (255, 255, 0)
-            r, g, b = image[max(min(y, h - 1), 1), max(min(x, w - 1), 1), :]
-            Y = ((r * 299) + (g * 587) + (b * 114)) / 1000
-            # if 0 < Y < 255:
-            #     h, s, v = cv2.cvtColor(np.array([r, g, b], np.uint8).reshape((1, 1, 3)), cv2.COLOR_RGB2HSV)[0, 0, :]
-            #     h = h + 384
-            #     if h > 864:
-            #         h = h - 864
-            #     v = 256 - v
-            #     r, g, b = cv2.cvtColor(np.array([h, s, v], np.uint8).reshape((1, 1, 3)), cv2.COLOR_HSV2RGB)[0, 0, :]
-            #     color = (int(255 - r), int(255 - g), int(255 - b))
-            # else:
-            #     if Y > 127:
-            #         color = (0, 0, 0)
-            #     else:
-            #         color = (255, 255, 255)
-            #
-            # print(color)
-            if Y > 125:
-                color = (0, 0, 0)
-            else:
-                color = (255, 255, 255)
-
-            side = 100
-            paddingXL = 0
-            paddingXR = side * 2
-            paddingYT = 0
-            paddingYB = side * 2
-            if (w - side) >= x >= side and (h - side) >= y >= side:
-                image = image[y - side:y + side, x - side:x + side, :]
-                cv2.circle(image, (side, side), 15, color, 1)
-                cv2.circle(image, (side, side), 3, color, 1)
-
-            else:
-                image_zero = np.zeros((side * 2, side * 2, 3), np.uint8)
-                image = image[max(y - side, 0):min(y + side, h), max(x - side, 0):min(x + side, w), :]
-                if x < side:
-                    paddingXL = side - x
-                    paddingXR = side * 2
-                if x > w - side:
-                    paddingXL = 0
-                    paddingXR = side * 2 - (x - (w - side))
-                if y < side:
-                    paddingYT = side - y
-                    paddingYB = side * 2
-                if y > h - side:
-                    paddingYT = 0
-                    paddingYB = side * 2 - (y - (h - side))
-                image_zero[paddingYT:paddingYB, paddingXL:paddingXR, :] = image
-                cv2.circle(image_zero, (side, side), 15, color, 1)
-                cv2.circle(image_zero, (side, side), 3, color, 1)
-                image = image_zero
-
-            # image = image[max(min(y-100, h), 0):max(min(y+100, h), 0), max(min(x-100, w), 0):max(min(x+100, w), 0), :]
-            self.expand_widget.setPixmap(self.img2pixmap(image))
+        if image is None:
+            return
+        # image_numpy 是 BGR 格式, 只复制需要的区域, 不转换整张图
+        h, w = image.shape[:2]
+        # 显示预览图时, 原图坐标换算到预览图上
+        previewScale = self.canvas.previewScale()
+        if adsorb or press:
+            x = min(max(int(self.canvas.prevMovePoint.x() * previewScale), 0), w)
+            y = min(max(int(self.canvas.prevMovePoint.y() * previewScale), 0), h)
+        else:
+            x = int(focus_x * previewScale)
+            y = int(focus_y * previewScale)
+
+        b, g, r = image[max(min(y, h - 1), 1), max(min(x, w - 1), 1), :].tolist()
+        Y = ((r * 299) + (g * 587) + (b * 114)) / 1000
+        color = (0, 0, 0, 255) if Y > 125 else (255, 255, 255, 255)
+
+        side = MAGNIFIER_SIZE // 2
+        buf = self._magnifierBuffer
+        x1, y1 = max(x - side, 0), max(y - side, 0)
+        x2, y2 = min(x + side, w), min(y + side, h)
+        # 超出图片的部分显示为黑色
+        if x2 - x1 < side * 2 or y2 - y1 < side * 2:
+            buf[..., :3] = 0
+        if x2 > x1 and y2 > y1:
+            dx, dy = x1 - (x - side), y1 - (y - side)
+            buf[dy:dy + y2 - y1, dx:dx + x2 - x1, :3] = image[y1:y2, x1:x2]
+        cv2.circle(buf, (side, side), 15, color, 1)
+        cv2.circle(buf, (side, side), 3, color, 1)
+        self.expand_widget.setPixmap(
+            QtGui.QPixmap.fromImage(self._magnifierImage))
 
     def saveFileByWeb(self, _value=False):
         assert not self.image.isNull(), "无法保存空图片"
@@ -1925,7 +2062,7 @@ class MainWindow(QtWidgets.QMainWindow):
         def format_shape(s):
             return [s.label.encode('utf-8') if PY2 else s.label,
                     [(p.x(), p.y()) for p in s.points],
-                    s.visibles,
+                    list(s.visibles),
                     s.line_color.getRgb(),
                     s.fill_color.getRgb(),
                     s.shape_type]
@@ -1934,7 +2071,11 @@ class MainWindow(QtWidgets.QMainWindow):
         # ignoreImageButton.setEnabled(True)
         shapes = [format_shape(shape) for shape in self.labelList.shapes]
         if not self.labelFile.fuzzy:
-            res = post("set_fuzzy_by_path", data={"image_path": self.labelFile.filename, "fuzzy": 1})
+            try:
+                res = post("set_fuzzy_by_path", data={"image_path": self.labelFile.filename, "fuzzy": 1})
+            except NetworkError:
+                res = {"state": 0}
+            LabelFile.invalidate(self.labelFile.filename)
             if res["state"] == 1:
                 image = self.labelFile.image_numpy
                 if image is None:
@@ -1943,7 +2084,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 image = cv2.imencode('.jpg', image)
                 image = image[1].tobytes()
                 image = QtGui.QImage.fromData(image)
-                self.canvas.loadPixmap(QtGui.QPixmap.fromImage(image))
+                self.canvas.loadPixmap(QtGui.QPixmap.fromImage(image), self.canvas.imageSize)
                 self.labelList.clear()
                 self.loadLabels(shapes)
                 ignoreImageButton.setIconText("恢复")
@@ -1952,11 +2093,15 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.errorMessage("修改提示", "修改失败")
 
         else:
-            res = post("set_fuzzy_by_path", data={"image_path": self.labelFile.filename, "fuzzy": 0})
+            try:
+                res = post("set_fuzzy_by_path", data={"image_path": self.labelFile.filename, "fuzzy": 0})
+            except NetworkError:
+                res = {"state": 0}
+            LabelFile.invalidate(self.labelFile.filename)
             if res["state"] == 1:
                 image = self.labelFile.imageData
                 image = QtGui.QImage.fromData(image)
-                self.canvas.loadPixmap(QtGui.QPixmap.fromImage(image))
+                self.canvas.loadPixmap(QtGui.QPixmap.fromImage(image), self.canvas.imageSize)
                 self.labelList.clear()
                 self.loadLabels(shapes)
                 ignoreImageButton.setIconText("忽略")
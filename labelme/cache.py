@@ -0,0 +1,218 @@
+import collections
+import hashlib
+import json
+import os
+import os.path as osp
+import threading
+import time
+
+
+class LRUCache(object):
+    """线程安全的 LRU 缓存, 按字节数限制容量.
+
+    `invalidate` 会使 key 的代数加一, 在失效前开始的加载可以通过
+    `put(..., generation=...)` 带上旧代数, 其结果将被丢弃而不会写回缓存.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data = collections.OrderedDict()
+        self._bytes = 0
+        self._generations = {}
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def generation(self, key):
+        with self._lock:
+            return self._generations.get(key, 0)
+
+    def put(self, key, value, nbytes, generation=None):
+        with self._lock:
+            if generation is not None and \
+                    generation != self._generations.get(key, 0):
+                return
+            self._discard(key)
+            if nbytes > self.max_bytes:
+                return
+            self._data[key] = (value, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, size) = self._data.popitem(last=False)
+                self._bytes -= size
+
+    def _discard(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._bytes -= item[1]
+
+    def invalidate(self, key):
+        with self._lock:
+            self._discard(key)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return 'cache hits: {}, misses: {}, hit rate: {:.0%}, size: {:.1f}/{:.0f} MB'.format(
+            self.hits, self.misses, self.hits / total if total else 0,
+            self._bytes / 1048576.0, self.max_bytes / 1048576.0)
+
+
+class DiskCache(object):
+    """内容寻址的磁盘缓存, 按字节数限制容量, 超出时淘汰最久未访问的.
+
+    内容保存在 objects/<sha1[:2]>/<sha1>, index.json 记录 key 对应的
+    sha1、大小、访问时间以及服务器返回的 ETag/Last-Modified, 用于条件请求.
+    内容相同的多个 key 只保存一份.
+    """
+
+    INDEX = 'index.json'
+    # 只更新访问时间时, 累计这么多次再写一次索引
+    FLUSH_EVERY = 50
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._index = None
+        self._dirty = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _load_index(self):
+        if self._index is None:
+            try:
+                with open(osp.join(self.root, self.INDEX)) as f:
+                    self._index = json.load(f)
+            except (IOError, OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _save_index(self):
+        if self._index is None:
+            return
+        if not osp.exists(self.root):
+            os.makedirs(self.root)
+        index_file = osp.join(self.root, self.INDEX)
+        with open(index_file + '.tmp', 'w') as f:
+            json.dump(self._index, f)
+        os.replace(index_file + '.tmp', index_file)
+        self._dirty = 0
+
+    def _object_path(self, digest):
+        return osp.join(self.root, 'objects', digest[:2], digest)
+
+    def _unlink(self, digest):
+        if any(e['sha1'] == digest for e in self._index.values()):
+            return
+        try:
+            os.remove(self._object_path(digest))
+        except OSError:
+            pass
+
+    def _remove(self, key):
+        entry = self._load_index().pop(key, None)
+        if entry is not None:
+            self._unlink(entry['sha1'])
+
+    def lookup(self, key):
+        """返回 key 的缓存记录(含 etag、last_modified 及 store 时的其他字段), 没有则返回 None"""
+        with self._lock:
+            entry = self._load_index().get(key)
+            return dict(entry) if entry is not None else None
+
+    def read(self, key):
+        with self._lock:
+            entry = self._load_index().get(key)
+            if entry is None:
+                return None
+            try:
+                with open(self._object_path(entry['sha1']), 'rb') as f:
+                    data = f.read()
+            except (IOError, OSError):
+                data = None
+            if data is None or len(data) != entry['size']:
+                self._remove(key)
+                self._save_index()
+                return None
+            entry['atime'] = time.time()
+            self._dirty += 1
+            if self._dirty >= self.FLUSH_EVERY:
+                self._save_index()
+            return data
+
+    def store(self, key, data, etag=None, last_modified=None, **meta):
+        if len(data) > self.max_bytes:
+            return
+        digest = hashlib.sha1(data).hexdigest()
+        path = self._object_path(digest)
+        with self._lock:
+            index = self._load_index()
+            if not osp.exists(path):
+                if not osp.exists(osp.dirname(path)):
+                    os.makedirs(osp.dirname(path))
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(data)
+                os.replace(path + '.tmp', path)
+            old = index.get(key)
+            index[key] = dict(
+                sha1=digest,
+                size=len(data),
+                etag=etag,
+                last_modified=last_modified,
+                atime=time.time(),
+                **meta
+            )
+            if old is not None and old['sha1'] != digest:
+                self._unlink(old['sha1'])
+            self._evict()
+            self._save_index()
+
+    def _evict(self):
+        index = self._index
+        sizes = {e['sha1']: e['size'] for e in index.values()}
+        total = sum(sizes.values())
+        if total <= self.max_bytes:
+            return
+        refs = collections.Counter(e['sha1'] for e in index.values())
+        for key in sorted(index, key=lambda k: index[k]['atime']):
+            if total <= self.max_bytes:
+                break
+            entry = index.pop(key)
+            refs[entry['sha1']] -= 1
+            if refs[entry['sha1']] == 0:
+                total -= entry['size']
+                self._unlink(entry['sha1'])
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+
+# 已解码的图片和已解析的标签, 以 ('image', path) / ('label', path) 为 key
+frame_cache = LRUCache(512 * 1024 * 1024)
+# 从服务器下载的原始图片, 以图片路径为 key
+disk_cache = DiskCache(
+    osp.join(osp.expanduser('~'), '.labelme', 'cache'), 4096 * 1024 * 1024)
@@ -35,7 +35,14 @@ def get_default_config():
     except:
         config = {'auto_save': False, 'display_label_popup': True, 'store_data': False, 'keep_prev': False,
                         'logger_level': 'info', 'flags': None, 'labels': 'labelme/config/labels.txt', 'aa': None,
-                        'file_search': None, 'sort_labels': True, 'validate_label': None,
+                        'file_search': None, 'file_list_page_size': 500,
+                        'prefetch': {'ahead': 3, 'behind': 1, 'workers': 2},
+                        'cache': {'memory_mb': 512, 'disk_mb': 4096, 'disk_dir': None},
+                        'save_queue': {'enabled': True, 'delay': 1.0, 'batch_size': 50, 'journal': None,
+                                       'close_timeout': 5.0},
+                        'preview': {'enabled': True, 'max_side': 1920},
+                        'undo': {'memory_mb': 32},
+                        'sort_labels': True, 'validate_label': None,
                         'flag_dock': {'show': True, 'closable': True, 'movable': True, 'floatable': True},
                         'label_dock': {'show': True, 'closable': True, 'movable': True, 'floatable': True},
                         'shape_dock': {'show': True, 'closable': True, 'movable': True, 'floatable': True},
@@ -52,6 +59,7 @@ def get_default_config():
                                       'create_rectangle': 'Ctrl+R', 'create_circle': 'Ctrl+Q', 'create_line': None,
                                       'create_point': None, 'create_linestrip': None, 'edit_polygon': 'Ctrl+J',
                                       'delete_polygon': 'Delete', 'duplicate_polygon': 'Ctrl+D', 'undo': 'Ctrl+Z',
+                                      'redo': ['Ctrl+Y', 'Ctrl+Shift+Z'],
                                       'undo_last_point': ['Ctrl+Z', 'Backspace'], 'edit_label': 'Ctrl+E',
                                       'edit_line_color': 'Ctrl+L', 'edit_fill_color': 'Ctrl+Shift+L',
                                       'toggle_keep_prev_mode': 'Ctrl+P'}}
@@ -6,6 +6,7 @@ import os.path as osp
 import PIL.Image
 import cv2
 import numpy as np
+from qtpy import QtGui
 from qtpy import QtWidgets
 
 from labelme._version import __version__
@@ -13,7 +14,10 @@ from labelme.logger import logger
 from labelme import PY2
 from labelme import QT4
 from labelme import utils
+from labelme.cache import frame_cache
+from labelme.network import get_image
 from labelme.network import post
+from labelme.network import submit
 
 
 class LabelFileError(Exception):
@@ -22,12 +26,20 @@ class LabelFileError(Exception):
 
 class LabelFile(object):
     suffix = '.json'
+    # 设置后保存到服务器的标签先进入写回队列(labelme.save_queue.SaveQueue)
+    save_queue = None
+    # 设置后先从服务器获取长边不超过此值的预览图, 放大时再通过 fetch_full_image/set_full_image 换成原图
+    preview_max_side = None
 
     def __init__(self, filename=None):
         self.shapes = ()
         self.imagePath = None
         self.imageData = None
         self.image_numpy = None
+        self.qimage = None
+        # 原图的 (宽, 高), 标注坐标都以原图为准
+        self.imageSize = None
+        self.isPreview = False
         self.fuzzy = False
 
         if isinstance(filename, list):
@@ -90,7 +102,7 @@ class LabelFile(object):
                 flags = data.get('flags')
                 imagePath = data['imagePath']
                 self._check_image_height_and_width(
-                    base64.b64encode(imageData).decode('utf-8'),
+                    self._image_data_size(imageData),
                     data.get('imageHeight'),
                     data.get('imageWidth'),
                 )
@@ -112,37 +124,46 @@ class LabelFile(object):
                         otherData[key] = value
             elif isinstance(filename, list):
                 # data = filename[1]
-                datas = post("get_lable_by_path", data={"image_path": filename[0]})
                 try:
-                    data = json.loads(datas["label"])
-                    fuzzy = datas["fuzzy"]
-
+                    max_side = self.preview_max_side \
+                        if ('image', filename[0]) not in frame_cache else None
+                    # 标签不在缓存中时和图片同时获取; 标签中带有图片数据时
+                    # 改用标签中的图片, 服务器图片的结果和错误都不再需要
+                    future = None
+                    if ('label', filename[0]) not in frame_cache:
+                        future = submit(self._load_web_image, filename[0],
+                                        {'imageData': None}, max_side)
+                    data, fuzzy = self._load_web_label(filename[0])
                     if data['imageData'] is not None:
-                        imageData = base64.b64decode(data['imageData'])
-                        if PY2 and QT4:
-                            imageData = utils.img_data_to_png_data(imageData)
+                        if future is not None:
+                            future.cancel()
+                        image = self._load_web_image(filename[0], data)
+                    elif future is not None:
+                        image = future.result()
                     else:
-                        result = post("get_image_by_path", data={"image_path": filename[0]})
-                        image = result["image"]
-                        imageData = base64.b64decode(image)
-                    image_numpy = np.asarray(bytearray(imageData), dtype="uint8")
-                    self.image_numpy = cv2.imdecode(image_numpy, cv2.IMREAD_COLOR)
-                    height, width = self.image_numpy.shape[:2]
+                        image = self._load_web_image(
+                            filename[0], data, max_side)
+                    imageData, self.image_numpy, self.qimage, \
+                        self.imageSize = image
+                    self.isPreview = \
+                        self.qimage.width() != self.imageSize[0]
 
                     flags = data.get('flags')
                     imagePath = data['imagePath']
-                    self._check_image_height_and_width(
-                        base64.b64encode(imageData).decode('utf-8'),
-                        data.get('imageHeight'),
-                        data.get('imageWidth'),
-                    )
+                    if not self.isPreview:
+                        self._check_image_height_and_width(
+                            self.imageSize,
+                            data.get('imageHeight'),
+                            data.get('imageWidth'),
+                        )
                     lineColor = data['lineColor']
                     fillColor = data['fillColor']
                     for s in data['shapes']:
                         label = s['label']
                         points = s['points']
                         if "visible" in s.keys():
-                            visibles = s['visible']
+                            # 复制一份, 缓存中的标签不能被画布修改
+                            visibles = list(s['visible'])
                         else:
                             visibles = [1] * len(points)
                         line_color = s['line_color']
@@ -174,20 +195,114 @@ class LabelFile(object):
 
 
     @staticmethod
-    def _check_image_height_and_width(imageData, imageHeight, imageWidth):
-        img_arr = utils.img_b64_to_arr(imageData)
-        if imageHeight is not None and img_arr.shape[0] != imageHeight:
+    def _load_web_label(image_path):
+        key = ('label', image_path)
+        cached = frame_cache.get(key)
+        if cached is not None:
+            return cached
+        generation = frame_cache.generation(key)
+        datas = post("get_lable_by_path", data={"image_path": image_path},
+                     binary=True)
+        data = datas["label"]
+        if isinstance(data, dict):
+            # MessagePack 格式, points 已是数组
+            nbytes = sum(s['points'].nbytes + 512 for s in data['shapes']) + 1024
+        else:
+            nbytes = 2 * len(data)
+            data = json.loads(data)
+        fuzzy = datas["fuzzy"]
+        if LabelFile.save_queue is not None:
+            # 写回队列中还没提交的标签比服务器上的新
+            pending = LabelFile.save_queue.pending(image_path)
+            if pending is not None:
+                data = pending
+        frame_cache.put(key, (data, fuzzy), nbytes,
+                        generation=generation)
+        return data, fuzzy
+
+    @staticmethod
+    def _load_web_image(image_path, data, max_side=None):
+        """
+        获取并解码图片, max_side 不为空时获取预览图
+        :return: (imageData, image_numpy, qimage, (原图宽, 原图高))
+        """
+        key = ('preview' if max_side else 'image', image_path)
+        cached = frame_cache.get(key)
+        if cached is not None:
+            return cached
+        image_size = None
+        if data['imageData'] is not None:
+            imageData = base64.b64decode(data['imageData'])
+            if PY2 and QT4:
+                imageData = utils.img_data_to_png_data(imageData)
+        else:
+            imageData, image_size = get_image(image_path, max_side)
+            if imageData is None:
+                raise LabelFileError(
+                    'Failed fetching image: {}'.format(image_path))
+        image_numpy = cv2.imdecode(
+            np.frombuffer(imageData, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image_numpy is None:
+            raise LabelFileError('Failed decoding image: {}'.format(image_path))
+        # QImage 可以在非 GUI 线程中创建, 便于后台预取时一并解码
+        qimage = QtGui.QImage.fromData(imageData)
+        if image_size is None:
+            image_size = (qimage.width(), qimage.height())
+        image = (imageData, image_numpy, qimage, image_size)
+        nbytes = len(imageData) + image_numpy.nbytes + qimage.byteCount()
+        frame_cache.put(key, image, nbytes)
+        return image
+
+    @staticmethod
+    def fetch_full_image(image_path):
+        """获取并解码原图, 可以在工作线程中调用, 结果交给 set_full_image"""
+        return LabelFile._load_web_image(image_path, {'imageData': None})
+
+    def set_full_image(self, image):
+        """把预览图换成 fetch_full_image 获取的原图"""
+        imageData, self.image_numpy, self.qimage, self.imageSize = image
+        self.imageData = imageData
+        self.isPreview = False
+
+    @staticmethod
+    def is_cached(image_path):
+        if ('label', image_path) not in frame_cache:
+            return False
+        return ('image', image_path) in frame_cache or (
+            LabelFile.preview_max_side is not None and
+            ('preview', image_path) in frame_cache)
+
+    @staticmethod
+    def invalidate(image_path):
+        """标签或模糊标记在服务器上被修改后, 丢弃缓存中的旧标签"""
+        frame_cache.invalidate(('label', image_path))
+
+    @staticmethod
+    def _image_data_size(imageData):
+        """从图片文件头读取 (宽, 高), 不解码像素"""
+        return PIL.Image.open(io.BytesIO(imageData)).size
+
+    @staticmethod
+    def _check_image_height_and_width(imageSize, imageHeight, imageWidth):
+        """
+        :param imageSize: 图片实际的 (宽, 高)
+        :param imageHeight: 标签中记录的高
+        :param imageWidth: 标签中记录的宽
+        :return: (高, 宽)
+        """
+        width, height = imageSize
+        if imageHeight is not None and height != imageHeight:
             logger.error(
                 'imageHeight does not match with imageData or imagePath, '
                 'so getting imageHeight from actual image.'
             )
-            imageHeight = img_arr.shape[0]
-        if imageWidth is not None and img_arr.shape[1] != imageWidth:
+            imageHeight = height
+        if imageWidth is not None and width != imageWidth:
             logger.error(
                 'imageWidth does not match with imageData or imagePath, '
                 'so getting imageWidth from actual image.'
             )
-            imageWidth = img_arr.shape[1]
+            imageWidth = width
         return imageHeight, imageWidth
 
     def save(
@@ -204,10 +319,10 @@ class LabelFile(object):
             flags=None,
     ):
         if imageData is not None:
-            imageData = base64.b64encode(imageData).decode('utf-8')
             imageHeight, imageWidth = self._check_image_height_and_width(
-                imageData, imageHeight, imageWidth
+                self._image_data_size(imageData), imageHeight, imageWidth
             )
+            imageData = base64.b64encode(imageData).decode('utf-8')
         if otherData is None:
             otherData = {}
         if flags is None:
@@ -247,10 +362,10 @@ class LabelFile(object):
             callback=None,
     ):
         if imageData is not None:
-            imageData = base64.b64encode(imageData).decode('utf-8')
             imageHeight, imageWidth = self._check_image_height_and_width(
-                imageData, imageHeight, imageWidth
+                self._image_data_size(imageData), imageHeight, imageWidth
             )
+            imageData = base64.b64encode(imageData).decode('utf-8')
         if otherData is None:
             otherData = {}
         if flags is None:
@@ -271,12 +386,21 @@ class LabelFile(object):
         try:
             image_path = filename
             data = {"image_path": image_path, "image_label": image_label}
-            res = post("save_lable_by_path", data)
-            if res["state"] == 1:
-                callback[1]("标签保存成功！")
-            else:
+            if self.save_queue is not None:
+                # 提交结果通过 save_queue 的 saved/failed/rejected 信号通知
+                self.save_queue.put(image_path, image_label)
+                self.invalidate(image_path)
+                callback[1]("标签已加入提交队列, 正在后台提交")
+                self.filename = filename
+                return True
+            res = post("save_lable_by_path", data, compress=True, binary=True)
+            self.invalidate(image_path)
+            if res["state"] != 1:
                 callback[0]("保存提示!", "标签保存失败！")
+                return False
+            callback[1]("标签保存成功！")
             self.filename = filename
+            return True
         except Exception as e:
             print(e)
             print(data, type(data))
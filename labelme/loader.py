@@ -0,0 +1,81 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from qtpy import QtCore
+
+from labelme.logger import logger
+
+
+class ImageLoader(QtCore.QObject):
+    """在后台线程中加载当前图片.
+
+    `load` 接收文件名, 在工作线程中完成下载和解码; 结果通过 loaded 信号
+    送回 GUI 线程. 每次 request 都会使之前的请求失效: 还没开始的直接取消,
+    已经在运行的结果被丢弃, 只有最后一次请求的图片会被显示.
+    QPixmap 只能在 GUI 线程中创建, 由 loaded 的接收方负责.
+    默认使用自己的单线程, 不与预取共用线程池, 用户跳转到的图片不必排在预取后面.
+    """
+
+    # (请求序号, 文件名, load 的返回值)
+    loaded = QtCore.Signal(int, str, object)
+    # (请求序号, 文件名, 错误信息)
+    failed = QtCore.Signal(int, str, str)
+
+    def __init__(self, load, submit=None):
+        """
+        :param load: 在工作线程中调用的加载函数
+        :param submit: submit(func, *args) -> Future, 为空时使用自己的线程
+        """
+        super(ImageLoader, self).__init__()
+        self._load = load
+        self._executor = None
+        if submit is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            submit = self._executor.submit
+        self._submit = submit
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._future = None
+
+    def request(self, filename):
+        """
+        开始加载 filename, 并取消之前的请求
+        :param filename:
+        :return: 请求序号
+        """
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            if self._future is not None:
+                self._future.cancel()
+            self._future = self._submit(self._run, seq, filename)
+        return seq
+
+    def cancel(self):
+        with self._lock:
+            self._seq += 1
+            if self._future is not None:
+                self._future.cancel()
+                self._future = None
+
+    def shutdown(self):
+        self.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def isCurrent(self, seq):
+        """seq 是否仍是最后一次请求, 信号到达 GUI 线程前用户可能已经翻页"""
+        return seq == self._seq
+
+    def _run(self, seq, filename):
+        if not self.isCurrent(seq):
+            return
+        try:
+            result = self._load(filename)
+        except Exception as e:
+            logger.debug('Load failed: {}: {}'.format(filename, e))
+            if self.isCurrent(seq):
+                self.failed.emit(seq, filename, str(e))
+            return
+        if self.isCurrent(seq):
+            self.loaded.emit(seq, filename, result)
@@ -1,28 +1,260 @@
+import gzip
 import json
+import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+
+from labelme.cache import disk_cache
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 # URL = 'http://192.168.160.69:12345/xiaoi/{}'
 URL = 'http://222.85.230.14:12345/xiaoi/{}'
 # URL = 'http://222.85.230.14:12346/xiaoi/{}'
 index = 0
+# 每个请求最多尝试的次数
 count = 5
+# (连接超时, 读取超时) 秒
+TIMEOUT = (3.05, 30)
+# 一个请求包括重试在内最多花费的时间(秒)
+DEADLINE = 60
+# 重试间隔从 BACKOFF_BASE 开始每次翻倍, 不超过 BACKOFF_MAX, 实际等待时间在 [0, 间隔] 内随机
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8
+# 连接池大小, 不小于同时发请求的线程数(预取、写回队列、GUI)
+POOL_SIZE = 16
+# 请求体不小于此大小(字节)且服务器支持时用 gzip 压缩; 响应由服务器按 Accept-Encoding 压缩, requests 自动解压
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+# 标签接口的二进制格式, 形状的 points 打包为 float64 小端数组 (扩展类型 POINTS_EXT)
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+POINTS_EXT = 1
+# 服务器返回过 MessagePack 后, 请求体也改用 MessagePack; 旧服务器只会收到 JSON
+_server_msgpack = False
+# 服务器的响应带有 Accept-Encoding: gzip 后才压缩请求体; 旧服务器或不解压的代理只会收到原始请求体
+_server_gzip = False
+
+
+class NetworkError(Exception):
+    """重试后请求仍然失败"""
+    pass
+
+
+def _make_session():
+    s = requests.Session()
+    # 重试由 _request 负责
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE,
+                          max_retries=0)
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+    return s
+
+
+# 所有请求共用一个 Session, 复用 keep-alive 连接, 不必每次都重新握手
+session = _make_session()
+_executor = ThreadPoolExecutor(max_workers=4)
 
 
-def post(request_url, data=None):
-    global index, URL, count
+def _backoff(attempt):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _request(method, request_url, check, timeout=None, deadline=None, **kwargs):
+    """
+    发送请求, 网络错误或 check 抛出异常时按指数退避重试
+    :param method: 'GET' 或 'POST'
+    :param request_url:
+    :param check: check(response), 返回结果, 需要重试时抛出异常
+    :param timeout: (连接超时, 读取超时), 默认 TIMEOUT
+    :param deadline: 包括重试在内的总时间, 默认 DEADLINE
+    :return: check 的返回值
+    """
     url = URL.format(request_url)
-    data_json = json.dumps(data)
+    timeout = timeout or TIMEOUT
+    end = time.time() + (deadline or DEADLINE)
+    error = None
     for i in range(count):
         try:
-            r = requests.post(url, data=data_json)
-            result_json = r.json()
-            if "state" in result_json.keys():
-                if result_json["state"] == 0:
-                    raise Exception("服务器内部错误 code:500", 1)
-            return result_json
+            r = session.request(method, url, timeout=timeout, **kwargs)
+            _learn_server(r)
+            return check(r)
         except Exception as e:
-            time.sleep(1)
-            print("服务器忙！正在重试 [{}/{}]".format(i+1, count))
-            continue
+            error = e
+        delay = _backoff(i)
+        if i + 1 == count or time.time() + delay >= end:
+            break
+        print("服务器忙！正在重试 [{}/{}]: {}".format(i + 1, count, error))
+        time.sleep(delay)
+    raise NetworkError("{} 请求失败: {}".format(request_url, error))
+
+
+def _learn_server(r):
+    """从响应头得知服务器是否接受 gzip 压缩的请求体"""
+    global _server_gzip
+    if 'gzip' in r.headers.get('Accept-Encoding', '').lower():
+        _server_gzip = True
+
+
+def _ext_hook(code, data):
+    if code == POINTS_EXT:
+        return np.frombuffer(data, dtype='<f8').reshape(-1, 2)
+    return msgpack.ExtType(code, data)
+
+
+def _pack_points(obj):
+    """
+    把标签中形状的 points 转为类型化数组, 其余内容不变
+    只遍历 dict 和 dict 列表, 不逐个访问顶点坐标等普通列表
+    """
+    if isinstance(obj, dict):
+        if 'points' in obj and 'shape_type' in obj:
+            obj = dict(obj)
+            obj['points'] = msgpack.ExtType(
+                POINTS_EXT, np.asarray(obj['points'], dtype='<f8').tobytes())
+            return obj
+        return {key: _pack_points(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)) and obj and isinstance(obj[0], dict):
+        return [_pack_points(value) for value in obj]
+    return obj
+
+
+def _check_json(r):
+    global _server_msgpack
+    if msgpack is not None and \
+            r.headers.get('Content-Type', '').startswith(MSGPACK_MIMETYPE):
+        _server_msgpack = True
+        result_json = msgpack.unpackb(r.content, raw=False, ext_hook=_ext_hook)
+    else:
+        result_json = r.json()
+    if "state" in result_json.keys():
+        if result_json["state"] == 0:
+            raise Exception("服务器内部错误 code:500", 1)
+    return result_json
+
+
+def _check_status(r):
+    if r.status_code >= 500:
+        raise Exception("服务器内部错误 code:{}".format(r.status_code), 1)
+    return r
+
+
+def post(request_url, data=None, timeout=None, deadline=None, compress=False,
+         binary=False):
+    """
+    POST JSON 请求
+    :param request_url:
+    :param data:
+    :param timeout: (连接超时, 读取超时)
+    :param deadline: 包括重试在内的总时间
+    :param compress: 请求体较大且服务器支持时 gzip 压缩, 用于保存标签等上传较多数据的接口
+    :param binary: 安装了 msgpack 时与服务器协商使用 MessagePack, 用于标签接口;
+        此时返回的标签中 points 为 (N, 2) 数组
+    :return: 服务器返回的 JSON, 失败时抛出 NetworkError
+    """
+    headers = {}
+    if binary and msgpack is not None:
+        headers['Accept'] = '{}, application/json'.format(MSGPACK_MIMETYPE)
+    if binary and msgpack is not None and _server_msgpack:
+        body = msgpack.packb(_pack_points(data), use_bin_type=True)
+        headers['Content-Type'] = MSGPACK_MIMETYPE
+    else:
+        body = json.dumps(data).encode('utf-8')
+    if compress and _server_gzip and len(body) >= COMPRESS_MIN_SIZE:
+        body = gzip.compress(body, COMPRESS_LEVEL)
+        headers['Content-Encoding'] = 'gzip'
+    return _request('POST', request_url, _check_json, timeout=timeout,
+                    deadline=deadline, data=body, headers=headers)
+
+
+def get(request_url, params=None, headers=None, timeout=None, deadline=None):
+    """
+    GET 请求, 返回原始的 Response (用于二进制数据)
+    :param request_url:
+    :param params:
+    :param headers:
+    :param timeout: (连接超时, 读取超时)
+    :param deadline: 包括重试在内的总时间
+    :return: Response, 失败时抛出 NetworkError
+    """
+    return _request('GET', request_url, _check_status, timeout=timeout,
+                    deadline=deadline, params=params, headers=headers)
+
+
+def submit(func, *args):
+    """
+    在请求线程池中执行 func, 不等待结果
+    :return: Future
+    """
+    return _executor.submit(func, *args)
+
+
+def parallel(*calls):
+    """
+    同时执行多个请求, 如同时获取标签和图片
+    :param calls: (func, arg1, arg2, ...)
+    :return: 各请求的返回值, 顺序与 calls 相同; 有请求失败时抛出其异常
+    """
+    futures = [submit(*call) for call in calls]
+    return [future.result() for future in futures]
+
+
+def get_image(image_path, max_side=None):
+    """
+    获取图片文件的原始字节, 可直接交给 QtGui.QImage.fromData
+    本地磁盘缓存中已有时带上 ETag/Last-Modified 做条件请求,
+    服务器返回 304 则直接使用缓存
+    :param image_path:
+    :param max_side: 指定时获取长边不超过 max_side 的缩略图
+    :return: (bytes, (原图宽, 原图高)), 失败返回 (None, None); 服务器没有返回原图尺寸时尺寸为 None
+    """
+    params = {"image_path": image_path}
+    key = image_path
+    if max_side:
+        params["max_side"] = max_side
+        key = "{}@{}".format(image_path, max_side)
+    entry = disk_cache.lookup(key) if disk_cache.enabled else None
+    headers = {}
+    if entry is not None:
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+    try:
+        r = get("get_image_raw", params=params, headers=headers)
+    except NetworkError:
+        r = None
+    if entry is not None and (r is None or r.status_code == 304):
+        # 服务器不可用时也先使用缓存
+        data = disk_cache.read(key)
+        if data is not None:
+            image_size = entry.get('image_size')
+            return data, tuple(image_size) if image_size else None
+        if r is not None:
+            try:
+                r = get("get_image_raw", params=params)
+            except NetworkError:
+                r = None
+    if r is None or r.status_code != 200:
+        return None, None
+    image_size = _parse_image_size(r.headers.get('X-Image-Size'))
+    if disk_cache.enabled:
+        disk_cache.store(key, r.content,
+                         etag=r.headers.get('ETag'),
+                         last_modified=r.headers.get('Last-Modified'),
+                         image_size=image_size)
+    return r.content, image_size
+
+
+def _parse_image_size(value):
+    try:
+        width, height = value.split('x')
+        return int(width), int(height)
+    except (AttributeError, ValueError):
+        return None
@@ -0,0 +1,72 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from labelme.logger import logger
+
+
+class Prefetcher(object):
+    """在后台线程池中预取当前图片前后的图片和标签.
+
+    `load` 接收文件名并完成下载和解码, 结果由其自身写入缓存;
+    `is_cached` 用于跳过已在缓存中的文件. 内存上限由缓存负责.
+    """
+
+    def __init__(self, load, is_cached, ahead=3, behind=1, max_workers=2):
+        self._load = load
+        self._is_cached = is_cached
+        self.ahead = ahead
+        self.behind = behind
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def schedule(self, filenames, index):
+        """预取 filenames[index] 之后 ahead 张和之前 behind 张."""
+        keys = filenames[index + 1:index + 1 + self.ahead]
+        keys += filenames[max(0, index - self.behind):index][::-1]
+        wanted = set(keys)
+        wanted.add(filenames[index])
+        with self._lock:
+            # 用户已经翻到别处, 取消还没开始的预取
+            for key, future in list(self._futures.items()):
+                if key not in wanted and future.cancel():
+                    del self._futures[key]
+            for key in keys:
+                if key in self._futures or self._is_cached(key):
+                    continue
+                self._futures[key] = self._executor.submit(self._run, key)
+
+    def _run(self, key):
+        try:
+            return self._load(key)
+        except Exception as e:
+            logger.debug('Prefetch failed: {}: {}'.format(key, e))
+            raise
+        finally:
+            with self._lock:
+                self._futures.pop(key, None)
+
+    def take(self, key):
+        """key 正在预取时等待并返回其结果, 否则返回 None."""
+        with self._lock:
+            future = self._futures.get(key)
+            # 还没开始的预取直接取消, 由调用方自己加载, 不必等它排队
+            if future is not None and future.cancel():
+                del self._futures[key]
+                return None
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except Exception:
+            return None
+
+    def clear(self):
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+
+    def shutdown(self):
+        self.clear()
+        self._executor.shutdown(wait=False)
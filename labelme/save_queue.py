@@ -0,0 +1,176 @@
+import collections
+import json
+import os
+import os.path as osp
+import threading
+import time
+
+from qtpy import QtCore
+
+from labelme.logger import logger
+from labelme.network import NetworkError
+from labelme.network import post
+
+
+class SaveQueue(QtCore.QObject):
+    """标签写回队列.
+
+    保存时先追加到本地日志(journal)再返回, 后台线程等待 `delay` 秒,
+    把这段时间内同一图片的多次保存合并为一次, 通过 save_labels 批量提交.
+    提交成功后从日志中移除; 程序崩溃后重启时会从日志中恢复未提交的标签.
+    服务器上没有的图片不会重试, 从日志中移除并通过 rejected 通知.
+    """
+
+    # 已提交的图片路径
+    saved = QtCore.Signal(list)
+    # 提交失败的提示, 稍后重试
+    failed = QtCore.Signal(str)
+    # 服务器上没有、不会再重试的图片路径
+    rejected = QtCore.Signal(list)
+
+    def __init__(self, journal_file, delay=1.0, batch_size=50,
+                 retry_delay=5.0, close_timeout=5.0):
+        super(SaveQueue, self).__init__()
+        self.journal_file = journal_file
+        self.delay = delay
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        # close 在 GUI 线程中调用, 最多等待这么久(秒), 没提交完的留在日志中
+        self.close_timeout = close_timeout
+        self._lock = threading.Lock()
+        self._flushing = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._pending = collections.OrderedDict()
+        self._replay_journal()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _replay_journal(self):
+        if not osp.exists(self.journal_file):
+            return
+        with open(self.journal_file) as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    # 崩溃时最后一行可能没有写完整
+                    continue
+                self._pending.pop(item['image_path'], None)
+                self._pending[item['image_path']] = item['image_label']
+        if self._pending:
+            logger.info('Recovered {} unsaved labels from {}'.format(
+                len(self._pending), self.journal_file))
+            self._wakeup.set()
+
+    def _append_journal(self, image_path, image_label):
+        if not osp.exists(osp.dirname(self.journal_file)):
+            os.makedirs(osp.dirname(self.journal_file))
+        with open(self.journal_file, 'a') as f:
+            f.write(json.dumps({'image_path': image_path,
+                                'image_label': image_label}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite_journal(self):
+        if not self._pending:
+            if osp.exists(self.journal_file):
+                os.remove(self.journal_file)
+            return
+        with open(self.journal_file + '.tmp', 'w') as f:
+            for image_path, image_label in self._pending.items():
+                f.write(json.dumps({'image_path': image_path,
+                                    'image_label': image_label}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.journal_file + '.tmp', self.journal_file)
+
+    def put(self, image_path, image_label):
+        with self._lock:
+            self._append_journal(image_path, image_label)
+            self._pending.pop(image_path, None)
+            self._pending[image_path] = image_label
+        self._wakeup.set()
+
+    def pending(self, image_path):
+        """返回还没提交到服务器的标签, 没有则返回 None"""
+        with self._lock:
+            return self._pending.get(image_path)
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait()
+            # 合并短时间内对同一图片的多次保存
+            time.sleep(self.delay)
+            self._wakeup.clear()
+            if not self._flush() and not self._stopping:
+                time.sleep(self.retry_delay)
+                self._wakeup.set()
+
+    def _flush(self, deadline=None):
+        """
+        提交一批标签
+        :param deadline: 最晚的结束时间(time.time()), 为空时按 post 的默认超时
+        :return: 是否成功
+        """
+        # 后台线程可能正在提交, close 时不能无限等待它
+        if deadline is None:
+            self._flushing.acquire()
+        elif not self._flushing.acquire(
+                timeout=max(0, deadline - time.time())):
+            return False
+        try:
+            with self._lock:
+                batch = list(self._pending.items())[:self.batch_size]
+            if not batch:
+                return True
+            kwargs = {}
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                kwargs = dict(deadline=remaining,
+                              timeout=(min(3.05, remaining), remaining))
+            try:
+                res = post("save_labels", data={"labels": [
+                    {"image_path": image_path, "image_label": image_label}
+                    for image_path, image_label in batch
+                ]}, compress=True, binary=True, **kwargs)
+            except NetworkError:
+                res = None
+            if res is None or res.get("state") != 1:
+                self.failed.emit("标签提交失败, 稍后重试 ({} 个待提交)".format(
+                    len(self._pending)))
+                return False
+            missing = set(res.get("missing") or [])
+            with self._lock:
+                for image_path, image_label in batch:
+                    # 提交期间又被保存过的保留下来, 下次再提交
+                    if self._pending.get(image_path) is image_label:
+                        del self._pending[image_path]
+                self._rewrite_journal()
+                left = len(self._pending)
+            saved = [image_path for image_path, _ in batch
+                     if image_path not in missing]
+            if saved:
+                self.saved.emit(saved)
+            if missing:
+                self.rejected.emit(sorted(missing))
+            if left:
+                self._wakeup.set()
+            return True
+        finally:
+            self._flushing.release()
+
+    def close(self):
+        """
+        停止后台线程并提交剩余标签, 最多等待 close_timeout 秒;
+        失败或没来得及提交的仍保留在日志中, 下次启动时恢复
+        """
+        self._stopping = True
+        self._wakeup.set()
+        deadline = time.time() + self.close_timeout
+        while self._pending:
+            if not self._flush(deadline):
+                break
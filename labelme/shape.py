@@ -1,14 +1,10 @@
-import copy
 import math
+
+import numpy as np
 from qtpy.QtCore import Qt
 from qtpy import QtCore
 from qtpy import QtGui
 
-import labelme.utils
-
-# TODO(unknown):
-# - [opt] Store paths instead of creating new ones at each paint.
-
 
 DEFAULT_LINE_COLOR = QtGui.QColor(0, 255, 0, 128)
 DEFAULT_FILL_COLOR = QtGui.QColor(255, 0, 0, 128)
@@ -21,13 +17,30 @@ DEFAULT_HVERTEX_FILL_COLOR = QtGui.QColor(255, 0, 0)  # 鼠标触碰顶点填充
 
 
 class Shape(object):
+    """标注形状.
+
+    顶点保存在 (N, 2) 的 float64 数组中, 可见性保存在 bytearray 中;
+    points / [] 访问时才转换为 QPointF, 绘制时直接使用数组中的坐标.
+    颜色为 None 时使用类属性 default_line_color / default_fill_color.
+    """
+
+    __slots__ = ('label', 'fill', 'selected', '_xy', '_visibles',
+                 '_shape_type', '_closed', '_highlightIndex', '_highlightMode',
+                 '_line_color', '_fill_color', '_linePath', '_path',
+                 '_boundingRect', '_changeListener')
+
     P_SQUARE, P_ROUND = 0, 1
 
     MOVE_VERTEX, NEAR_VERTEX = 0, 1
 
+    HIGHLIGHT_SETTINGS = {
+        NEAR_VERTEX: (4, P_ROUND),
+        MOVE_VERTEX: (1.5, P_SQUARE),
+    }
+
     # The following class variables influence the drawing of all shape objects.
-    line_color = DEFAULT_LINE_COLOR
-    fill_color = DEFAULT_FILL_COLOR
+    default_line_color = DEFAULT_LINE_COLOR
+    default_fill_color = DEFAULT_FILL_COLOR
     select_line_color = DEFAULT_SELECT_LINE_COLOR
     select_fill_color = DEFAULT_SELECT_FILL_COLOR
     vertex_fill_color = DEFAULT_VERTEX_FILL_COLOR
@@ -40,26 +53,27 @@ class Shape(object):
 
     def __init__(self, label=None, line_color=None, shape_type=None):
         self.label = label
-        self.points = []
-        self.visibles = []
+        # 缓存的轮廓路径、填充/命中测试路径和外接矩形, 修改顶点时清空
+        self._linePath = None
+        self._path = None
+        self._boundingRect = None
+        # 顶点修改后的回调, 由 SpatialIndex 设置
+        self._changeListener = None
+        self._xy = np.empty((0, 2), dtype=np.float64)
+        self._visibles = bytearray()
         self.fill = False
         self.selected = False
-        self.shape_type = shape_type
 
         self._highlightIndex = None
         self._highlightMode = self.NEAR_VERTEX
-        self._highlightSettings = {
-            self.NEAR_VERTEX: (4, self.P_ROUND),
-            self.MOVE_VERTEX: (1.5, self.P_SQUARE),
-        }
 
         self._closed = False
 
-        if line_color is not None:
-            # Override the class line_color attribute
-            # with an object attribute. Currently this
-            # is used for drawing the pending line a different color.
-            self.line_color = line_color
+        # Override the class line_color attribute
+        # with an object attribute. Currently this
+        # is used for drawing the pending line a different color.
+        self._line_color = line_color
+        self._fill_color = None
 
         self.shape_type = shape_type
 
@@ -75,36 +89,100 @@ class Shape(object):
                          'line', 'circle', 'linestrip']:
             raise ValueError('Unexpected shape_type: {}'.format(value))
         self._shape_type = value
+        self._invalidate()
+
+    @property
+    def line_color(self):
+        if self._line_color is None:
+            return Shape.default_line_color
+        return self._line_color
+
+    @line_color.setter
+    def line_color(self, value):
+        self._line_color = value
+
+    @property
+    def fill_color(self):
+        if self._fill_color is None:
+            return Shape.default_fill_color
+        return self._fill_color
+
+    @fill_color.setter
+    def fill_color(self, value):
+        self._fill_color = value
+
+    @property
+    def points(self):
+        """顶点的 QPointF 列表, 每次访问都重新生成, 修改列表不会影响形状"""
+        return [QtCore.QPointF(x, y) for x, y in self._xy.tolist()]
+
+    @points.setter
+    def points(self, value):
+        """可以是 QPoint/QPointF 列表、(x, y) 列表或 (N, 2) 数组"""
+        if isinstance(value, np.ndarray):
+            xy = np.array(value, dtype=np.float64)
+        else:
+            xy = np.array([(p.x(), p.y()) if hasattr(p, 'x') else p
+                           for p in value], dtype=np.float64)
+        self._xy = xy.reshape(-1, 2)
+        self._invalidate()
+
+    @property
+    def visibles(self):
+        return self._visibles
+
+    @visibles.setter
+    def visibles(self, value):
+        self._visibles = bytearray(value)
+
+    def pointsArray(self):
+        """顶点坐标, (N, 2) 的 float64 数组, 不要直接修改"""
+        return self._xy
+
+    def _invalidate(self):
+        self._linePath = None
+        self._path = None
+        self._boundingRect = None
+        if self._changeListener is not None:
+            self._changeListener(self)
+
+    def setChangeListener(self, listener):
+        self._changeListener = listener
 
     def close(self):
         self._closed = True
+        self._invalidate()
 
     def addPoint(self, point):
-        if self.points and point == self.points[0]:
+        x, y = point.x(), point.y()
+        if len(self._xy) and x == self._xy[0, 0] and y == self._xy[0, 1]:
             self.close()
         else:
-            self.points.append(point)
+            self._xy = np.append(self._xy, [[x, y]], axis=0)
+            self._invalidate()
 
     def popPoint(self):
-        if self.points:
-            self.visibles.pop()
-            return self.points.pop()
-        return None
+        return self.popPointByIndex(-1)
 
     def popPointByIndex(self, index):
-        if self.points:
-            self.visibles.pop(index)
-            return self.points.pop(index)
+        if len(self._xy):
+            point = self[index]
+            self._visibles.pop(index)
+            self._xy = np.delete(self._xy, index % len(self._xy), axis=0)
+            self._invalidate()
+            return point
         return None
 
     def insertPoint(self, i, point):
-        self.points.insert(i, point)
+        self._xy = np.insert(self._xy, i, [point.x(), point.y()], axis=0)
+        self._invalidate()
 
     def isClosed(self):
         return self._closed
 
     def setOpen(self):
         self._closed = False
+        self._invalidate()
 
     def getRectFromLine(self, pt1, pt2):
         x1, y1 = pt1.x(), pt1.y()
@@ -112,7 +190,7 @@ class Shape(object):
         return QtCore.QRectF(x1, y1, x2 - x1, y2 - y1)
 
     def paint(self, painter):
-        if self.points:
+        if len(self._xy):
             color = self.select_line_color \
                 if self.selected else self.line_color
             pen = QtGui.QPen(color)
@@ -120,42 +198,12 @@ class Shape(object):
             pen.setWidth(max(1, int(round(2.0 / self.scale))))
             painter.setPen(pen)
 
-            line_path = QtGui.QPainterPath()
-            vrtx_path = QtGui.QPainterPath()
-
-            if self.shape_type == 'rectangle':
-                assert len(self.points) in [1, 2]
-                if len(self.points) == 2:
-                    rectangle = self.getRectFromLine(*self.points)
-                    line_path.addRect(rectangle)
-                for i in range(len(self.points)):
-                    self.drawVertex(painter, i)
-            elif self.shape_type == "circle":
-                assert len(self.points) in [1, 2]
-                if len(self.points) == 2:
-                    rectangle = self.getCircleRectFromLine(self.points)
-                    line_path.addEllipse(rectangle)
-                for i in range(len(self.points)):
-                    self.drawVertex(painter, i)
-            elif self.shape_type == "linestrip":
-                line_path.moveTo(self.points[0])
-                for i, p in enumerate(self.points):
-                    line_path.lineTo(p)
-                    self.drawVertex(painter, i)
-            else:
-                line_path.moveTo(self.points[0])
-                # Uncommenting the following line will draw 2 paths
-                # for the 1st vertex, and make it non-filled, which
-                # may be desirable.
-                # self.drawVertex(vrtx_path, 0)
-
-                for i, p in enumerate(self.points):
-                    line_path.lineTo(p)
-                    self.drawVertex(painter, i)
-                if self.isClosed():
-                    line_path.lineTo(self.points[0])
+            line_path = self.makeLinePath()
+            if self.shape_type in ['rectangle', 'circle']:
+                assert len(self._xy) in [1, 2]
+            for i in range(len(self._xy)):
+                self.drawVertex(painter, i)
             painter.drawPath(line_path)
-            painter.drawPath(vrtx_path)
             # painter.fillPath(vrtx_path, self.vertex_fill_color)
             # painter.fillPath(vrtx_path, DEFAULT_SELECT_LINE_COLOR)
             if self.fill:
@@ -167,64 +215,139 @@ class Shape(object):
         path = QtGui.QPainterPath()
         d = self.point_size / self.scale
         shape = self.point_type
-        point = self.points[i]
-        if len(self.visibles) == 0:
+        x, y = self._xy[i]
+        if len(self._visibles) == 0:
             visible = 1
         else:
-            visible = self.visibles[i]
+            visible = self._visibles[i]
         if i == self._highlightIndex:
-            size, shape = self._highlightSettings[self._highlightMode]
+            size, shape = self.HIGHLIGHT_SETTINGS[self._highlightMode]
             d *= size
         if self._highlightIndex is not None:
-            self.vertex_fill_color = self.hvertex_fill_color
+            vertex_fill_color = self.hvertex_fill_color
         else:
-            # self.vertex_fill_color = Shape.vertex_fill_color
             if visible:
-                self.vertex_fill_color = Shape.visible_vertex_fill_color
+                vertex_fill_color = Shape.visible_vertex_fill_color
             else:
-                self.vertex_fill_color = Shape.disvisible_vertex_fill_color
+                vertex_fill_color = Shape.disvisible_vertex_fill_color
         if shape == self.P_SQUARE:
-            path.addRect(point.x() - d / 2, point.y() - d / 2, d, d)
+            path.addRect(x - d / 2, y - d / 2, d, d)
         elif shape == self.P_ROUND:
-            if i == 1:
-                path.addEllipse(point, d / 1.0, d / 1.0)
-            else:
-                path.addEllipse(point, d / 2.0, d / 2.0)
+            r = d if i == 1 else d / 2.0
+            path.addEllipse(x - r, y - r, 2 * r, 2 * r)
         else:
             assert False, "unsupported vertex shape"
         root.drawPath(path)
-        root.fillPath(path, self.vertex_fill_color)
+        root.fillPath(path, vertex_fill_color)
+
+    @staticmethod
+    def _vertexDistances(points, xy):
+        return np.hypot(points[:, 0] - xy[0], points[:, 1] - xy[1])
+
+    @staticmethod
+    def _edgeDistances(starts, ends, xy):
+        """
+        点到各线段 starts[i]-ends[i] 的距离, 长度为 0 的线段距离为 inf
+        """
+        d = ends - starts
+        length2 = (d * d).sum(axis=1)
+        v = xy - starts
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.clip((v * d).sum(axis=1) / length2, 0.0, 1.0)
+        dist = np.hypot(v[:, 0] - t * d[:, 0], v[:, 1] - t * d[:, 1])
+        dist[length2 == 0] = np.inf
+        return dist
+
+    @staticmethod
+    def _nearest(dist, epsilon):
+        if not len(dist):
+            return None
+        i = int(dist.argmin())
+        return i if dist[i] <= epsilon else None
 
     def nearestVertex(self, point, epsilon):
         """
         确定是否移动到某点范围
         :param point:
         :param epsilon:
-        :return:
+        :return: 距离不超过 epsilon 的最近顶点序号, 没有则返回 None
         """
-        min_distance = float('inf')
-        min_i = None
-        for i, p in enumerate(self.points):
-            dist = labelme.utils.distance(p - point)
-            if dist <= epsilon and dist < min_distance:
-                min_distance = dist
-                min_i = i
-        return min_i
+        points = self.pointsArray()
+        return self._nearest(
+            self._vertexDistances(points, (point.x(), point.y())), epsilon)
 
     def nearestEdge(self, point, epsilon):
-        min_distance = float('inf')
-        post_i = None
-        for i in range(len(self.points)):
-            line = [self.points[i - 1], self.points[i]]
-            dist = labelme.utils.distancetoline(point, line)
-            if dist <= epsilon and dist < min_distance:
-                min_distance = dist
-                post_i = i
-        return post_i
+        """
+        :return: 距离不超过 epsilon 的最近边 (points[i - 1], points[i]) 的序号 i, 没有则返回 None
+        """
+        points = self.pointsArray()
+        xy = np.array([point.x(), point.y()])
+        return self._nearest(self._edgeDistances(
+            np.roll(points, 1, axis=0), points, xy), epsilon)
+
+    @staticmethod
+    def nearestVertexBatch(shapes, point, epsilon):
+        """
+        一次计算多个形状的 nearestVertex
+        :return: 与 shapes 一一对应的顶点序号或 None
+        """
+        if not shapes:
+            return []
+        arrays = [shape.pointsArray() for shape in shapes]
+        dist = Shape._vertexDistances(
+            np.concatenate(arrays), (point.x(), point.y()))
+        return Shape._splitNearest(dist, arrays, epsilon)
+
+    @staticmethod
+    def nearestEdgeBatch(shapes, point, epsilon):
+        """
+        一次计算多个形状的 nearestEdge
+        :return: 与 shapes 一一对应的边序号或 None
+        """
+        if not shapes:
+            return []
+        arrays = [shape.pointsArray() for shape in shapes]
+        ends = np.concatenate(arrays)
+        starts = np.concatenate([np.roll(a, 1, axis=0) for a in arrays])
+        dist = Shape._edgeDistances(
+            starts, ends, np.array([point.x(), point.y()]))
+        return Shape._splitNearest(dist, arrays, epsilon)
+
+    @staticmethod
+    def _splitNearest(dist, arrays, epsilon):
+        result = []
+        start = 0
+        for a in arrays:
+            result.append(Shape._nearest(dist[start:start + len(a)], epsilon))
+            start += len(a)
+        return result
 
     def containsPoint(self, point):
         return self.makePath().contains(point)
 
+    def makeLinePath(self):
+        """绘制用的轮廓路径, 闭合的多边形包含最后一条边"""
+        if self._linePath is not None:
+            return self._linePath
+        line_path = QtGui.QPainterPath()
+        if self.shape_type == 'rectangle':
+            if len(self._xy) == 2:
+                rectangle = self.getRectFromLine(self[0], self[1])
+                line_path.addRect(rectangle)
+        elif self.shape_type == "circle":
+            if len(self._xy) == 2:
+                rectangle = self.getCircleRectFromLine((self[0], self[1]))
+                line_path.addEllipse(rectangle)
+        else:
+            xy = self._xy.tolist()
+            line_path.moveTo(*xy[0])
+            for x, y in xy:
+                line_path.lineTo(x, y)
+            if self.shape_type != "linestrip" and self.isClosed():
+                line_path.lineTo(*xy[0])
+        self._linePath = line_path
+        return line_path
+
     def getCircleRectFromLine(self, line):
         """Computes parameters to draw with `QPainterPath::addEllipse`"""
         if len(line) != 2:
@@ -236,30 +359,38 @@ class Shape(object):
         return rectangle
 
     def makePath(self):
+        if self._path is not None:
+            return self._path
         if self.shape_type == 'rectangle':
             path = QtGui.QPainterPath()
-            if len(self.points) == 2:
-                rectangle = self.getRectFromLine(*self.points)
+            if len(self._xy) == 2:
+                rectangle = self.getRectFromLine(self[0], self[1])
                 path.addRect(rectangle)
         elif self.shape_type == "circle":
             path = QtGui.QPainterPath()
-            if len(self.points) == 2:
-                rectangle = self.getCircleRectFromLine(self.points)
+            if len(self._xy) == 2:
+                rectangle = self.getCircleRectFromLine((self[0], self[1]))
                 path.addEllipse(rectangle)
         else:
-            path = QtGui.QPainterPath(self.points[0])
-            for p in self.points[1:]:
-                path.lineTo(p)
+            xy = self._xy.tolist()
+            path = QtGui.QPainterPath(QtCore.QPointF(*xy[0]))
+            for x, y in xy[1:]:
+                path.lineTo(x, y)
+        self._path = path
         return path
 
     def boundingRect(self):
-        return self.makePath().boundingRect()
+        if self._boundingRect is None:
+            self._boundingRect = self.makePath().boundingRect()
+        return QtCore.QRectF(self._boundingRect)
 
     def moveBy(self, offset):
-        self.points = [p + offset for p in self.points]
+        self._xy = self._xy + (offset.x(), offset.y())
+        self._invalidate()
 
     def moveVertexBy(self, i, offset):
-        self.points[i] = self.points[i] + offset
+        self._xy[i] += (offset.x(), offset.y())
+        self._invalidate()
 
     def highlightVertex(self, i, action):
         self._highlightIndex = i
@@ -270,20 +401,27 @@ class Shape(object):
 
     def copy(self):
         shape = Shape(label=self.label, shape_type=self.shape_type)
-        shape.points = [copy.deepcopy(p) for p in self.points]
-        shape.visibles = copy.deepcopy(self.visibles)
+        shape._xy = self._xy.copy()
+        shape._visibles = bytearray(self._visibles)
         shape.fill = self.fill
         shape.selected = self.selected
         shape._closed = self._closed
-        shape.line_color = copy.deepcopy(self.line_color)
-        shape.fill_color = copy.deepcopy(self.fill_color)
+        # 只复制单独设置过的颜色, 默认颜色仍然共用
+        if self._line_color is not None:
+            shape._line_color = QtGui.QColor(self._line_color)
+        if self._fill_color is not None:
+            shape._fill_color = QtGui.QColor(self._fill_color)
         return shape
 
     def __len__(self):
-        return len(self.points)
+        return len(self._xy)
 
     def __getitem__(self, key):
-        return self.points[key]
+        if isinstance(key, slice):
+            return [QtCore.QPointF(x, y) for x, y in self._xy[key].tolist()]
+        x, y = self._xy[key]
+        return QtCore.QPointF(x, y)
 
     def __setitem__(self, key, value):
-        self.points[key] = value
+        self._xy[key] = (value.x(), value.y())
+        self._invalidate()
@@ -0,0 +1,115 @@
+import collections
+import math
+
+
+class SpatialIndex(object):
+    """形状的均匀网格空间索引, 用于鼠标悬停和点选时的命中测试.
+
+    每个形状按外接矩形(含顶点, 向外扩展 margin)登记到覆盖的网格中,
+    查询时只返回点所在网格内的形状, 按 z 序从上到下排列.
+    形状修改后通过 Shape 的修改回调标记为脏, 在下一次查询时重新登记;
+    增删单个形状用 insert/remove, 只有整体替换形状列表时才需要 reset.
+    """
+
+    def __init__(self, cell_size=128, margin=0):
+        self.cell_size = float(cell_size)
+        self.margin = margin
+        self._cells = collections.defaultdict(set)
+        self._shapeCells = {}
+        self._order = {}
+        self._dirty = set()
+
+    def reset(self, shapes):
+        """形状列表增删或调整顺序后重建索引"""
+        for shape in self._order:
+            shape.setChangeListener(None)
+        self._cells.clear()
+        self._shapeCells.clear()
+        self._order = {}
+        self._dirty.clear()
+        for z, shape in enumerate(shapes):
+            self._order[shape] = z
+            shape.setChangeListener(self.markDirty)
+            self._insert(shape)
+
+    def insert(self, shape, z):
+        """
+        登记新增的形状
+        :param shape:
+        :param z: 形状在列表中的位置, 之后的形状 z 序依次后移
+        :return:
+        """
+        for other, order in self._order.items():
+            if order >= z:
+                self._order[other] = order + 1
+        self._order[shape] = z
+        shape.setChangeListener(self.markDirty)
+        self._insert(shape)
+
+    def remove(self, shape):
+        """移除形状, 之后的形状 z 序依次前移"""
+        z = self._order.pop(shape, None)
+        if z is None:
+            return
+        for other, order in self._order.items():
+            if order > z:
+                self._order[other] = order - 1
+        shape.setChangeListener(None)
+        self._dirty.discard(shape)
+        self._remove(shape)
+
+    def markDirty(self, shape):
+        self._dirty.add(shape)
+
+    def _cellRange(self, shape):
+        points = shape.pointsArray()
+        if not len(points):
+            return None
+        (x1, y1), (x2, y2) = points.min(axis=0), points.max(axis=0)
+        if len(points) > 1:
+            # 圆等形状的轮廓会超出顶点范围
+            rect = shape.boundingRect()
+            x1, y1 = min(x1, rect.left()), min(y1, rect.top())
+            x2, y2 = max(x2, rect.right()), max(y2, rect.bottom())
+        m, size = self.margin, self.cell_size
+        return (int(math.floor((x1 - m) / size)), int(math.floor((y1 - m) / size)),
+                int(math.floor((x2 + m) / size)), int(math.floor((y2 + m) / size)))
+
+    def _insert(self, shape):
+        cell_range = self._cellRange(shape)
+        if cell_range is None:
+            self._shapeCells[shape] = ()
+            return
+        cx1, cy1, cx2, cy2 = cell_range
+        keys = [(cx, cy) for cx in range(cx1, cx2 + 1) for cy in range(cy1, cy2 + 1)]
+        for key in keys:
+            self._cells[key].add(shape)
+        self._shapeCells[shape] = keys
+
+    def _remove(self, shape):
+        for key in self._shapeCells.pop(shape, ()):
+            cell = self._cells[key]
+            cell.discard(shape)
+            if not cell:
+                del self._cells[key]
+
+    def _flush(self):
+        for shape in self._dirty:
+            if shape in self._order:
+                self._remove(shape)
+                self._insert(shape)
+        self._dirty.clear()
+
+    def query(self, point):
+        """
+        可能命中 point 的形状
+        :param point: 图片坐标
+        :return: 按 z 序从上(后添加)到下排列的形状列表
+        """
+        self._flush()
+        key = (int(math.floor(point.x() / self.cell_size)),
+               int(math.floor(point.y() / self.cell_size)))
+        candidates = self._cells.get(key)
+        if not candidates:
+            return []
+        return sorted(candidates, key=self._order.get, reverse=True)
@@ -0,0 +1,163 @@
+import collections
+
+# 每条命令除顶点数据外的大致开销(字节), 用于估算撤销历史占用的内存
+COMMAND_OVERHEAD = 256
+
+
+def shape_state(shape):
+    """形状的顶点和可见性快照"""
+    return shape.pointsArray().copy(), bytes(shape.visibles)
+
+
+def shape_nbytes(shape):
+    return shape.pointsArray().nbytes + len(shape.visibles) + COMMAND_OVERHEAD
+
+
+class UndoCommand(object):
+    """一次可撤销的修改, 只记录被修改的形状."""
+
+    nbytes = COMMAND_OVERHEAD
+
+    def undo(self, canvas):
+        raise NotImplementedError
+
+    def redo(self, canvas):
+        raise NotImplementedError
+
+
+class EditShapeCommand(UndoCommand):
+    """移动顶点、移动形状、增加或删除顶点"""
+
+    def __init__(self, shape, before, after):
+        self.shape = shape
+        self.before = before
+        self.after = after
+        self.nbytes = before[0].nbytes + after[0].nbytes + \
+            len(before[1]) + len(after[1]) + COMMAND_OVERHEAD
+
+    def _apply(self, state):
+        self.shape.points, self.shape.visibles = state
+
+    def undo(self, canvas):
+        self._apply(self.before)
+
+    def redo(self, canvas):
+        self._apply(self.after)
+
+
+class AddShapeCommand(UndoCommand):
+
+    def __init__(self, shape, index):
+        self.shape = shape
+        self.index = index
+        self.nbytes = shape_nbytes(shape)
+
+    def undo(self, canvas):
+        canvas.removeShape(self.shape)
+
+    def redo(self, canvas):
+        canvas.insertShape(self.index, self.shape)
+
+
+class DeleteShapeCommand(AddShapeCommand):
+
+    def undo(self, canvas):
+        AddShapeCommand.redo(self, canvas)
+
+    def redo(self, canvas):
+        AddShapeCommand.undo(self, canvas)
+
+
+class RelabelCommand(UndoCommand):
+
+    def __init__(self, shape, old_label, new_label):
+        self.shape = shape
+        self.old_label = old_label
+        self.new_label = new_label
+
+    def undo(self, canvas):
+        self.shape.label = self.old_label
+
+    def redo(self, canvas):
+        self.shape.label = self.new_label
+
+
+class ReorderShapesCommand(UndoCommand):
+    """在标签列表中拖动调整形状的顺序"""
+
+    def __init__(self, before, after):
+        self.before = list(before)
+        self.after = list(after)
+        self.nbytes = 16 * len(self.before) + COMMAND_OVERHEAD
+
+    def undo(self, canvas):
+        canvas.shapes = list(self.before)
+
+    def redo(self, canvas):
+        canvas.shapes = list(self.after)
+
+
+class MacroCommand(UndoCommand):
+    """作为一步撤销的多条命令"""
+
+    def __init__(self, commands):
+        self.commands = list(commands)
+        self.nbytes = sum(c.nbytes for c in self.commands)
+
+    def undo(self, canvas):
+        for command in reversed(self.commands):
+            command.undo(canvas)
+
+    def redo(self, canvas):
+        for command in self.commands:
+            command.redo(canvas)
+
+
+class UndoStack(object):
+    """撤销/重做历史, 按估算的内存占用限制容量, 超出时丢弃最早的记录."""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._undo = collections.deque()
+        self._redo = []
+        self._bytes = 0
+
+    def push(self, command):
+        """记录已经完成的修改, 并清空重做记录"""
+        self._undo.append(command)
+        self._bytes += command.nbytes
+        for c in self._redo:
+            self._bytes -= c.nbytes
+        self._redo = []
+        while self._bytes > self.max_bytes and len(self._undo) > 1:
+            self._bytes -= self._undo.popleft().nbytes
+
+    def canUndo(self):
+        return bool(self._undo)
+
+    def canRedo(self):
+        return bool(self._redo)
+
+    def undo(self, canvas):
+        if not self._undo:
+            return None
+        command = self._undo.pop()
+        command.undo(canvas)
+        self._redo.append(command)
+        return command
+
+    def redo(self, canvas):
+        if not self._redo:
+            return None
+        command = self._redo.pop()
+        command.redo(canvas)
+        self._undo.append(command)
+        return command
+
+    def clear(self):
+        self._undo.clear()
+        self._redo = []
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._undo)
@@ -6,6 +6,8 @@ from .color_dialog import ColorDialog
 
 from .escapable_qlist_widget import EscapableQListWidget
 
+from .file_list_model import FileListModel
+
 from .label_dialog import LabelDialog
 from .label_dialog import LabelQLineEdit
 
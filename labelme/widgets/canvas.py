@@ -6,6 +6,15 @@ from qtpy import QtWidgets
 import labelme.utils
 from labelme import QT5
 from labelme.shape import Shape
+from labelme.spatial_index import SpatialIndex
+from labelme.undo import AddShapeCommand
+from labelme.undo import DeleteShapeCommand
+from labelme.undo import EditShapeCommand
+from labelme.undo import MacroCommand
+from labelme.undo import ReorderShapesCommand
+from labelme.undo import UndoStack
+from labelme.undo import shape_state
+from labelme.widgets.tiled_pixmap import TiledPixmap
 
 # TODO(unknown):
 # - [maybe] Find optimal epsilon value.
@@ -26,6 +35,7 @@ class Canvas(QtWidgets.QWidget):
     shapeMoved = QtCore.Signal()
     drawingPolygon = QtCore.Signal(bool)
     edgeSelected = QtCore.Signal(bool)
+    undoStackChanged = QtCore.Signal()
 
     CREATE, EDIT = 0, 1
 
@@ -37,6 +47,8 @@ class Canvas(QtWidgets.QWidget):
     def __init__(self, callback=None, *args, **kwargs):
         self.callback = callback
         self.epsilon = kwargs.pop('epsilon', 11.0)
+        self.spatialIndex = SpatialIndex(margin=self.epsilon)
+        self.undoStack = UndoStack(kwargs.pop('undo_max_bytes', 32 * 1024 * 1024))
         super(Canvas, self).__init__(*args, **kwargs)
         self.adsorb = True  # 用于判断是否第一次进入某点附近
         self.press = False  # 用于判断是否在某点附近按下
@@ -45,7 +57,8 @@ class Canvas(QtWidgets.QWidget):
         # Initialise local state.
         self.mode = self.EDIT
         self.shapes = []
-        self.shapesBackups = []
+        # 鼠标按下时被拖动的形状及其顶点, 松开时生成撤销记录
+        self._editStart = None
         self.current = None
         self.selectedShape = None  # save the selected shape here
         self.selectedShapeCopy = None
@@ -61,6 +74,9 @@ class Canvas(QtWidgets.QWidget):
         self.offsets = QtCore.QPoint(), QtCore.QPoint()
         self.scale = 1.0
         self.pixmap = QtGui.QPixmap()
+        # 原图尺寸, 显示预览图时 pixmap 比原图小, 坐标仍以原图为准
+        self.imageSize = QtCore.QSize()
+        self.tiledPixmap = None
         self.visible = {}
         self.PRESS_KEY_ALT = True # 是否按下alt
         self._hideBackround = False
@@ -94,28 +110,121 @@ class Canvas(QtWidgets.QWidget):
             raise ValueError('Unsupported createMode: %s' % value)
         self._createMode = value
 
-    def storeShapes(self):
-        shapesBackup = []
-        for shape in self.shapes:
-            shapesBackup.append(shape.copy())
-        if len(self.shapesBackups) >= 10:
-            self.shapesBackups = self.shapesBackups[-9:]
-        self.shapesBackups.append(shapesBackup)
-
     @property
-    def isShapeRestorable(self):
-        if len(self.shapesBackups) < 2:
-            return False
-        return True
+    def shapes(self):
+        return self._shapes
 
-    def restoreShape(self):
-        if not self.isShapeRestorable:
-            return
-        self.shapesBackups.pop()  # latest
-        shapesBackup = self.shapesBackups.pop()
-        self.shapes = shapesBackup
-        self.storeShapes()
-        self.repaint()
+    @shapes.setter
+    def shapes(self, value):
+        self._shapes = value
+        self.shapesChanged()
+
+    def shapesChanged(self):
+        """整体替换形状列表后调用, 重建空间索引; 增删单个形状用 insertShape/removeShape"""
+        self.spatialIndex.reset(self._shapes)
+
+    def shapeRect(self, shape):
+        """
+        形状绘制时覆盖的区域(控件坐标), 包括顶点和线宽
+        :param shape:
+        :return: QRect, 没有顶点时返回空的 QRect
+        """
+        if shape is None or not len(shape.pointsArray()):
+            return QtCore.QRect()
+        points = shape.pointsArray()
+        (x1, y1), (x2, y2) = points.min(axis=0), points.max(axis=0)
+        rect = QtCore.QRectF(x1, y1, x2 - x1, y2 - y1)
+        if len(points) > 1:
+            rect = rect.united(shape.boundingRect())
+        offset = self.offsetToCenter()
+        rect = QtCore.QRectF((rect.x() + offset.x()) * self.scale,
+                             (rect.y() + offset.y()) * self.scale,
+                             rect.width() * self.scale,
+                             rect.height() * self.scale)
+        margin = self.shapeMargin()
+        return rect.toAlignedRect().adjusted(-margin, -margin, margin, margin)
+
+    def shapeMargin(self):
+        """顶点和线条超出形状外接矩形的最大距离(控件像素)"""
+        # 高亮的顶点最大为 point_size * 4(圆点的半径), 线宽最少 2 个像素
+        highlight = max(size for size, _ in Shape.HIGHLIGHT_SETTINGS.values())
+        return int(Shape.point_size * highlight + max(2.0, self.scale)) + 2
+
+    def updateShapes(self, *shapes, **kwargs):
+        """
+        只重绘 shapes 覆盖的区域, 由 Qt 合并后异步绘制
+        :param shapes: 需要重绘的形状
+        :param rect: 额外需要重绘的区域, 一般是形状修改前的位置
+        :return:
+        """
+        rect = kwargs.get('rect') or QtCore.QRect()
+        for shape in shapes:
+            rect = rect.united(self.shapeRect(shape))
+        if not rect.isEmpty():
+            self.update(rect)
+
+    def insertShape(self, index, shape):
+        self.shapes.insert(index, shape)
+        self.spatialIndex.insert(shape, index)
+
+    def appendShape(self, shape):
+        self.insertShape(len(self.shapes), shape)
+
+    def removeShape(self, shape):
+        index = self.shapes.index(shape)
+        self.shapes.pop(index)
+        self.spatialIndex.remove(shape)
+        return index
+
+    def reorderShapes(self, shapes):
+        """
+        按 shapes 的顺序重排形状, 可以撤销
+        :param shapes: 与当前相同的形状, 顺序不同
+        :return:
+        """
+        command = ReorderShapesCommand(self.shapes, shapes)
+        self.shapes = list(shapes)
+        self.pushUndo(command)
+        self.update()
+
+    def pushUndo(self, command):
+        """记录一次已完成的修改"""
+        self.undoStack.push(command)
+        self.undoStackChanged.emit()
+
+    def canUndo(self):
+        return self.undoStack.canUndo()
+
+    def canRedo(self):
+        return self.undoStack.canRedo()
+
+    def _clearEditState(self):
+        self.deSelectShape()
+        self.selectedShapeCopy = None
+        self.hShape, self.hVertex, self.hEdge = None, None, None
+        self._editStart = None
+
+    def undo(self):
+        """
+        撤销上一次修改
+        :return: 撤销的命令, 没有可撤销的修改时返回 None
+        """
+        self._clearEditState()
+        command = self.undoStack.undo(self)
+        self.undoStackChanged.emit()
+        self.update()
+        return command
+
+    def redo(self):
+        """
+        重做上一次撤销的修改
+        :return: 重做的命令, 没有可重做的修改时返回 None
+        """
+        self._clearEditState()
+        command = self.undoStack.redo(self)
+        self.undoStackChanged.emit()
+        self.update()
+        return command
 
     def enterEvent(self, ev):
         self.overrideCursor(self._cursor)
@@ -176,6 +285,9 @@ class Canvas(QtWidgets.QWidget):
             if not self.current:
                 return
 
+            # 修改前辅助线和正在绘制的形状的位置
+            dirty = self.shapeRect(self.line).united(
+                self.shapeRect(self.current))
             color = self.lineColor
             if self.outOfPixmap(pos):
                 # Don't allow the user to draw outside the pixmap.
@@ -205,7 +317,7 @@ class Canvas(QtWidgets.QWidget):
                 self.line.points = [self.current[0]]
                 self.line.close()
             self.line.line_color = color
-            self.repaint()
+            self.updateShapes(self.line, self.current, rect=dirty)
             self.current.highlightClear()
             return
 
@@ -213,24 +325,27 @@ class Canvas(QtWidgets.QWidget):
         if QtCore.Qt.RightButton & ev.buttons():
             if self.selectedShapeCopy and self.prevPoint:
                 self.overrideCursor(CURSOR_MOVE)
+                dirty = self.shapeRect(self.selectedShapeCopy)
                 self.boundedMoveShape(self.selectedShapeCopy, pos)
-                self.repaint()
+                self.updateShapes(self.selectedShapeCopy, rect=dirty)
             elif self.selectedShape:
                 self.selectedShapeCopy = self.selectedShape.copy()
-                self.repaint()
+                self.updateShapes(self.selectedShapeCopy)
             return
 
         # Polygon/Vertex moving.
         self.movingShape = False
         if QtCore.Qt.LeftButton & ev.buttons():
             if self.selectedVertex():
+                dirty = self.shapeRect(self.hShape)
                 self.boundedMoveVertex(pos)
-                self.repaint()
+                self.updateShapes(self.hShape, rect=dirty)
                 self.movingShape = True
             elif self.selectedShape and self.prevPoint:
                 self.overrideCursor(CURSOR_MOVE)
+                dirty = self.shapeRect(self.selectedShape)
                 self.boundedMoveShape(self.selectedShape, pos)
-                self.repaint()
+                self.updateShapes(self.selectedShape, rect=dirty)
                 self.movingShape = True
             return
 
@@ -240,11 +355,15 @@ class Canvas(QtWidgets.QWidget):
         # Update shape/vertex fill and tooltip value accordingly.
         self.setToolTip("Image")
         flag = True
-        for shape in reversed([s for s in self.shapes if self.isVisible(s)]):
+        # 高亮变化前的形状, 取消高亮时也需要重绘
+        prevShape = self.hShape
+        # 只检查鼠标附近的形状, 仍按从上到下的顺序
+        candidates = [s for s in self.spatialIndex.query(pos) if self.isVisible(s)]
+        vertices = Shape.nearestVertexBatch(candidates, pos, self.epsilon)
+        edges = Shape.nearestEdgeBatch(candidates, pos, self.epsilon)
+        for shape, index, index_edge in zip(candidates, vertices, edges):
             # Look for a nearby vertex to highlight. If that fails,
             # check if we happen to be inside a shape.
-            index = shape.nearestVertex(pos, self.epsilon)
-            index_edge = shape.nearestEdge(pos, self.epsilon)
             if index is not None:
                 flag = False
                 if self.selectedVertex():
@@ -255,7 +374,7 @@ class Canvas(QtWidgets.QWidget):
                 shape.highlightVertex(index, shape.MOVE_VERTEX)
                 self.overrideCursor(CURSOR_POINT)
 
-                self.focus_x, self.focus_y = shape.points[index].x(), shape.points[index].y()
+                self.focus_x, self.focus_y = shape.pointsArray()[index].tolist()
                 x, y = self.focus_x - pos.x(), self.focus_y - pos.y()
                 x, y = int(x * self.scale + 0.5), int(y * self.scale + 0.5)
                 # if self.adsorb: pyautogui.moveRel(x, y, duration=0.1)
@@ -264,7 +383,7 @@ class Canvas(QtWidgets.QWidget):
 
                 self.setToolTip("单击并拖动可移动点")
                 self.setStatusTip(self.toolTip())
-                self.update()
+                self.updateShapes(prevShape, shape)
                 break
             elif shape.containsPoint(pos):
                 if self.selectedVertex():
@@ -276,12 +395,12 @@ class Canvas(QtWidgets.QWidget):
                     "单击并拖动可移动形状 '%s'" % shape.label)
                 self.setStatusTip(self.toolTip())
                 self.overrideCursor(CURSOR_GRAB)
-                self.update()
+                self.updateShapes(prevShape, shape)
                 break
         else:  # Nothing found, clear highlights, reset state.
             if self.hShape:
                 self.hShape.highlightClear()
-                self.update()
+                self.updateShapes(self.hShape)
             self.hVertex, self.hShape, self.hEdge = None, None, None
 
         if flag:
@@ -300,7 +419,9 @@ class Canvas(QtWidgets.QWidget):
         shape = self.hShape
         index = self.hVertex
         # print("index={}, points={}, visibles={}".format(index, len(shape.points), len(shape.visibles)))
+        before = shape_state(shape)
         shape.popPointByIndex(index)
+        self.pushUndo(EditShapeCommand(shape, before, shape_state(shape)))
         shape.highlightVertex(index, shape.MOVE_VERTEX)
         self.hShape = shape
         self.hVertex = index
@@ -324,8 +445,10 @@ class Canvas(QtWidgets.QWidget):
         shape = self.hShape
         index = self.hEdge
         point = self.prevMovePoint
+        before = shape_state(shape)
         shape.insertPoint(index, point)
         shape.visibles.insert(index, visible)
+        self.pushUndo(EditShapeCommand(shape, before, shape_state(shape)))
         shape.highlightVertex(index, shape.MOVE_VERTEX)
         self.hShape = shape
         self.hVertex = index
@@ -359,13 +482,13 @@ class Canvas(QtWidgets.QWidget):
                         else:
                             self.current.visibles.append(visible)
                     elif self.createMode in ['rectangle', 'circle']:
-                        assert len(self.current.points) == 1
-                        self.current.points = self.line.points
+                        assert len(self.current) == 1
+                        self.current.points = self.line.pointsArray()
                         self.current.visibles = [1, 1]
                         self.finalise()
                     elif self.createMode in ['line']:
-                        assert len(self.current.points) == 1
-                        self.current.points = self.line.points
+                        assert len(self.current) == 1
+                        self.current.points = self.line.pointsArray()
                         self.current.visibles.append(visible)
                         self.finalise()
                     elif self.createMode == 'linestrip':
@@ -397,11 +520,15 @@ class Canvas(QtWidgets.QWidget):
             else:
                 self.selectShapePoint(pos)
                 self.prevPoint = pos
-                self.repaint()
+                shape = self.hShape if self.selectedVertex() \
+                    else self.selectedShape
+                self._editStart = (shape, shape_state(shape)) \
+                    if shape else None
+                self.update()
         elif ev.button() == QtCore.Qt.RightButton and self.editing():
             self.selectShapePoint(pos)
             self.prevPoint = pos
-            self.repaint()
+            self.update()
 
     def mouseReleaseEvent(self, ev):
         """
@@ -417,12 +544,16 @@ class Canvas(QtWidgets.QWidget):
                     and self.selectedShapeCopy:
                 # Cancel the move by deleting the shadow copy.
                 self.selectedShapeCopy = None
-                self.repaint()
+                self.update()
         elif ev.button() == QtCore.Qt.LeftButton and self.selectedShape:
             self.overrideCursor(CURSOR_GRAB)
         if self.movingShape:
-            self.storeShapes()
+            if self._editStart:
+                shape, before = self._editStart
+                self.pushUndo(EditShapeCommand(
+                    shape, before, shape_state(shape)))
             self.shapeMoved.emit()
+        self._editStart = None
 
     def endMove(self, copy=False):
         assert self.selectedShape and self.selectedShapeCopy
@@ -430,15 +561,21 @@ class Canvas(QtWidgets.QWidget):
         # del shape.fill_color
         # del shape.line_color
         if copy:
-            self.shapes.append(shape)
+            self.appendShape(shape)
+            self.pushUndo(AddShapeCommand(shape, len(self.shapes) - 1))
             self.selectedShape.selected = False
             self.selectedShape = shape
-            self.repaint()
+            self.update()
         else:
             shape.label = self.selectedShape.label
-            self.deleteSelected()
-            self.shapes.append(shape)
-        self.storeShapes()
+            old = self.selectedShape
+            index = self.removeShape(old)
+            self.selectedShape = None
+            self.appendShape(shape)
+            self.pushUndo(MacroCommand([
+                DeleteShapeCommand(old, index),
+                AddShapeCommand(shape, len(self.shapes) - 1)]))
+            self.update()
         self.selectedShapeCopy = None
 
     def hideBackroundShapes(self, value):
@@ -447,7 +584,7 @@ class Canvas(QtWidgets.QWidget):
             # Only hide other shapes if there is a current selection.
             # Otherwise the user will not be able to select a shape.
             self.setHiding(True)
-            self.repaint()
+            self.update()
 
     def setHiding(self, enable=True):
         self._hideBackround = self.hideBackround if enable else False
@@ -477,7 +614,7 @@ class Canvas(QtWidgets.QWidget):
             index, shape = self.hVertex, self.hShape
             shape.highlightVertex(index, shape.MOVE_VERTEX)
             return
-        for shape in reversed(self.shapes):
+        for shape in self.spatialIndex.query(point):
             if self.isVisible(shape) and shape.containsPoint(point):
                 shape.selected = True
                 self.selectedShape = shape
@@ -509,8 +646,8 @@ class Canvas(QtWidgets.QWidget):
             pos -= QtCore.QPoint(min(0, o1.x()), min(0, o1.y()))
         o2 = pos + self.offsets[1]
         if self.outOfPixmap(o2):
-            pos += QtCore.QPoint(min(0, self.pixmap.width() - o2.x()),
-                                 min(0, self.pixmap.height() - o2.y()))
+            pos += QtCore.QPoint(min(0, self.imageSize.width() - o2.x()),
+                                 min(0, self.imageSize.height() - o2.y()))
         # XXX: The next line tracks the new position of the cursor
         # relative to the shape, but also results in making it
         # a bit "shaky" when nearing the border and allows it to
@@ -534,8 +671,8 @@ class Canvas(QtWidgets.QWidget):
     def deleteSelected(self):
         if self.selectedShape:
             shape = self.selectedShape
-            self.shapes.remove(self.selectedShape)
-            self.storeShapes()
+            index = self.removeShape(shape)
+            self.pushUndo(DeleteShapeCommand(shape, index))
             self.selectedShape = None
             self.update()
             return shape
@@ -544,8 +681,8 @@ class Canvas(QtWidgets.QWidget):
         if self.selectedShape:
             shape = self.selectedShape.copy()
             self.deSelectShape()
-            self.shapes.append(shape)
-            self.storeShapes()
+            self.appendShape(shape)
+            self.pushUndo(AddShapeCommand(shape, len(self.shapes) - 1))
             shape.selected = True
             self.selectedShape = shape
             self.boundedShiftShape(shape)
@@ -574,9 +711,19 @@ class Canvas(QtWidgets.QWidget):
         p.scale(self.scale, self.scale)
         p.translate(self.offsetToCenter())
 
-        p.drawPixmap(0, 0, self.pixmap)
+        # 只绘制需要重绘区域内的图块
+        rect = QtCore.QRectF(event.rect())
+        exposed = QtCore.QRectF(rect.topLeft() / self.scale - QtCore.QPointF(self.offsetToCenter()),
+                                rect.size() / self.scale)
+        self.tiledPixmap.paint(p, self.scale, exposed)
         Shape.scale = self.scale
+        # 跳过不在重绘区域内的形状, 外接矩形加上顶点和线宽的边距
+        # (点形状的外接矩形宽高为 0, 不加边距时不会与任何区域相交)
+        margin = self.shapeMargin() / self.scale
         for shape in self.shapes:
+            if not exposed.intersects(shape.boundingRect().adjusted(
+                    -margin, -margin, margin, margin)):
+                continue
             if (shape.selected or not self._hideBackround) and \
                     self.isVisible(shape):
                 shape.fill = shape.selected or shape == self.hShape
@@ -588,11 +735,13 @@ class Canvas(QtWidgets.QWidget):
             self.selectedShapeCopy.paint(p)
 
         if (self.fillDrawing() and self.createMode == 'polygon' and
-                self.current is not None and len(self.current.points) >= 2):
+                self.current is not None and len(self.current) >= 2):
             drawing_shape = self.current.copy()
             drawing_shape.addPoint(self.line[1], 1)
             drawing_shape.fill = True
-            drawing_shape.fill_color.setAlpha(64)
+            fill_color = QtGui.QColor(drawing_shape.fill_color)
+            fill_color.setAlpha(64)
+            drawing_shape.fill_color = fill_color
             drawing_shape.paint(p)
 
         p.end()
@@ -604,7 +753,7 @@ class Canvas(QtWidgets.QWidget):
     def offsetToCenter(self):
         s = self.scale
         area = super(Canvas, self).size()
-        w, h = self.pixmap.width() * s, self.pixmap.height() * s
+        w, h = self.imageSize.width() * s, self.imageSize.height() * s
         aw, ah = area.width(), area.height()
         x = (aw - w) / (2 * s) if aw > w else 0
         y = (ah - h) / (2 * s) if ah > h else 0
@@ -616,14 +765,13 @@ class Canvas(QtWidgets.QWidget):
         :param p:
         :return:
         """
-        w, h = self.pixmap.width(), self.pixmap.height()
+        w, h = self.imageSize.width(), self.imageSize.height()
         return not (0 <= p.x() < w and 0 <= p.y() < h)
 
     def finalise(self):
         assert self.current
         self.current.close()
-        self.shapes.append(self.current)
-        self.storeShapes()
+        self.appendShape(self.current)
         self.current = None
         self.setHiding(False)
         self.newShape.emit()
@@ -646,7 +794,7 @@ class Canvas(QtWidgets.QWidget):
         # Cycle through each image edge in clockwise fashion,
         # and find the one intersecting the current line segment.
         # http://paulbourke.net/geometry/lineline2d/
-        size = self.pixmap.size()
+        size = self.imageSize
         points = [(0, 0),
                   (size.width() - 1, 0),
                   (size.width() - 1, size.height() - 1),
@@ -700,7 +848,7 @@ class Canvas(QtWidgets.QWidget):
 
     def minimumSizeHint(self):
         if self.pixmap:
-            return self.scale * self.pixmap.size()
+            return self.scale * self.imageSize
         return super(Canvas, self).minimumSizeHint()
 
     def wheelEvent(self, ev):
@@ -753,18 +901,19 @@ class Canvas(QtWidgets.QWidget):
     def setLastLabel(self, text):
         assert text
         self.shapes[-1].label = text
-        self.shapesBackups.pop()
-        self.storeShapes()
+        # 形状在确定标签后才算添加完成, 取消时由 undoLastLine 撤回
+        self.pushUndo(AddShapeCommand(self.shapes[-1], len(self.shapes) - 1))
         return self.shapes[-1]
 
     def undoLastLine(self):
         assert self.shapes
         self.current = self.shapes.pop()
+        self.spatialIndex.remove(self.current)
         self.current.setOpen()
         if self.createMode in ['polygon', 'linestrip']:
             self.line.points = [self.current[-1], self.current[0]]
         elif self.createMode in ['rectangle', 'line', 'circle']:
-            self.current.points = self.current.points[0:1]
+            self.current.points = self.current.pointsArray()[:1]
         elif self.createMode == 'point':
             self.current = None
         self.drawingPolygon.emit(True)
@@ -778,22 +927,42 @@ class Canvas(QtWidgets.QWidget):
         else:
             self.current = None
             self.drawingPolygon.emit(False)
-        self.repaint()
+        self.update()
 
-    def loadPixmap(self, pixmap):
+    def loadPixmap(self, pixmap, size=None):
+        """
+        :param pixmap:
+        :param size: 原图尺寸, pixmap 为预览图时传入
+        :return:
+        """
         self.pixmap = pixmap
+        self.imageSize = size if size is not None else pixmap.size()
+        self.tiledPixmap = TiledPixmap(pixmap, self.imageSize)
         self.shapes = []
-        self.repaint()
+        self.update()
+
+    def replacePixmap(self, pixmap):
+        """更换显示的图片(如预览图换成原图), 保留原图尺寸和已有标注"""
+        self.pixmap = pixmap
+        self.tiledPixmap = TiledPixmap(pixmap, self.imageSize)
+        self.update()
+
+    def previewScale(self):
+        """显示的图片与原图的比例, 显示原图时为 1"""
+        if not self.pixmap or not self.imageSize.width():
+            return 1.0
+        return self.pixmap.width() / self.imageSize.width()
 
     def loadShapes(self, shapes):
         self.shapes = list(shapes)
-        self.storeShapes()
+        self.undoStack.clear()
+        self.undoStackChanged.emit()
         self.current = None
-        self.repaint()
+        self.update()
 
     def setShapeVisible(self, shape, value):
         self.visible[shape] = value
-        self.repaint()
+        self.update()
 
     def overrideCursor(self, cursor):
         self.restoreCursor()
@@ -806,5 +975,7 @@ class Canvas(QtWidgets.QWidget):
     def resetState(self):
         self.restoreCursor()
         self.pixmap = None
-        self.shapesBackups = []
+        self.tiledPixmap = None
+        self.undoStack.clear()
+        self.undoStackChanged.emit()
         self.update()
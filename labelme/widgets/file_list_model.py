@@ -0,0 +1,98 @@
+from qtpy import QtCore
+from qtpy.QtCore import Qt
+
+
+class FileListModel(QtCore.QAbstractListModel):
+    """文件列表的数据模型.
+
+    只保存路径和标注数量, 不为每张图片创建列表项; 路径到行号的字典使翻页和
+    定位当前图片都是 O(1). 配合 setUniformItemSizes(True) 的 QListView,
+    只有可见的行会被绘制. 滚动到底部时视图调用 fetchMore, 由 fetch_page
+    从服务器获取下一页.
+    """
+
+    def __init__(self, fetch_page=None, parent=None):
+        super(FileListModel, self).__init__(parent)
+        self.fetch_page = fetch_page
+        self.hasMore = False
+        self._paths = []
+        self._shapeCounts = []
+        self._rows = {}
+
+    @property
+    def paths(self):
+        """按行排列的路径, 不要直接修改"""
+        return self._paths
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __contains__(self, path):
+        return path in self._rows
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        if role == Qt.DisplayRole or role == Qt.ToolTipRole:
+            return self._paths[row]
+        if role == Qt.CheckStateRole:
+            # 如果有标注，则勾选
+            return Qt.Checked if self._shapeCounts[row] else Qt.Unchecked
+        return None
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        return not parent.isValid() and self.hasMore and \
+            self.fetch_page is not None
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        if self.canFetchMore(parent):
+            self.fetch_page()
+
+    def clear(self):
+        self.beginResetModel()
+        self._paths = []
+        self._shapeCounts = []
+        self._rows = {}
+        self.hasMore = False
+        self.endResetModel()
+
+    def append(self, files):
+        """
+        在末尾追加一页文件
+        :param files: (路径, 标注数量) 列表
+        :return:
+        """
+        if not files:
+            return
+        first = len(self._paths)
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(files) - 1)
+        for row, (path, shape_count) in enumerate(files, first):
+            self._paths.append(path)
+            self._shapeCounts.append(shape_count)
+            self._rows.setdefault(path, row)
+        self.endInsertRows()
+
+    def row(self, path):
+        """路径所在的行, 不在列表中时返回 -1"""
+        return self._rows.get(path, -1)
+
+    def path(self, row):
+        return self._paths[row]
+
+    def setLabeled(self, path, labeled):
+        """保存或删除标注后更新勾选状态"""
+        row = self.row(path)
+        if row < 0:
+            return
+        self._shapeCounts[row] = int(bool(labeled))
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
@@ -6,21 +6,47 @@ class LabelQListWidget(QtWidgets.QListWidget):
     def __init__(self, *args, **kwargs):
         super(LabelQListWidget, self).__init__(*args, **kwargs)
         self.canvas = None
-        self.itemsToShapes = []
+        # 列表项与形状的双向映射, 形状和列表项都按对象本身(而不是值)作为键
+        self._itemToShape = {}
+        self._shapeToItem = {}
+
+    def addShapeItem(self, item, shape):
+        """在列表末尾添加形状对应的列表项"""
+        self._itemToShape[item] = shape
+        self._shapeToItem[shape] = item
+        self.addItem(item)
+
+    def removeShapeItem(self, shape):
+        """
+        移除形状对应的列表项
+        :param shape:
+        :return: 被移除的列表项, 没有时返回 None
+        """
+        item = self._shapeToItem.pop(shape, None)
+        if item is None:
+            return None
+        del self._itemToShape[item]
+        self.takeItem(self.row(item))
+        return item
 
     def get_shape_from_item(self, item):
-        for index, (item_, shape) in enumerate(self.itemsToShapes):
-            if item_ is item:
-                return shape
+        return self._itemToShape.get(item)
 
     def get_item_from_shape(self, shape):
-        for index, (item, shape_) in enumerate(self.itemsToShapes):
-            if shape_ is shape:
-                return item
+        return self._shapeToItem.get(shape)
+
+    @property
+    def itemsToShapes(self):
+        """按列表顺序排列的 (列表项, 形状)"""
+        return [(item, self._itemToShape[item]) for item in self._items()]
+
+    def _items(self):
+        return [self.item(i) for i in range(self.count())]
 
     def clear(self):
         super(LabelQListWidget, self).clear()
-        self.itemsToShapes = []
+        self._itemToShape = {}
+        self._shapeToItem = {}
 
     def setParent(self, parent):
         self.parent = parent
@@ -33,13 +59,8 @@ class LabelQListWidget(QtWidgets.QListWidget):
         if self.canvas is None:
             raise RuntimeError('self.canvas must be set beforehand.')
         self.parent.setDirty()
-        self.canvas.loadShapes(self.shapes)
+        self.canvas.reorderShapes(self.shapes)
 
     @property
     def shapes(self):
-        shapes = []
-        for i in range(self.count()):
-            item = self.item(i)
-            shape = self.get_shape_from_item(item)
-            shapes.append(shape)
-        return shapes
+        return [self._itemToShape[item] for item in self._items()]
@@ -0,0 +1,102 @@
+import math
+
+from qtpy import QtCore
+
+
+class TiledPixmap(object):
+    """按缩放级别分块绘制的大图.
+
+    第 0 级为原始 pixmap, 之后每级宽高减半, 绘制时选择分辨率刚好不低于
+    屏幕显示所需的一级, 只绘制与可见区域相交的块. 各级图片和块都在第一次
+    用到时生成并缓存.
+    坐标以原图为准: pixmap 可以是比原图小的预览图, 由 image_size 给出原图尺寸.
+    """
+
+    TILE_SIZE = 512
+    # 最小一级的长边不小于此值
+    MIN_SIDE = 256
+
+    def __init__(self, pixmap, image_size=None):
+        self.image_size = image_size if image_size is not None \
+            else pixmap.size()
+        self._levels = [pixmap]
+        self._tiles = {}
+        # 各级的宽高, 用于选择级别而不必先生成图片
+        self._sizes = [(pixmap.width(), pixmap.height())]
+        w, h = self._sizes[0]
+        while max(w, h) // 2 >= self.MIN_SIDE:
+            w, h = max(1, w // 2), max(1, h // 2)
+            self._sizes.append((w, h))
+        self.num_levels = len(self._sizes)
+
+    def _level_pixmap(self, level):
+        while len(self._levels) <= level:
+            w, h = self._sizes[len(self._levels)]
+            self._levels.append(self._levels[-1].scaled(
+                w, h, QtCore.Qt.IgnoreAspectRatio,
+                QtCore.Qt.SmoothTransformation))
+        return self._levels[level]
+
+    def _density(self, level):
+        """第 level 级每个原图像素对应的图片像素数"""
+        return self._sizes[level][0] / float(self.image_size.width())
+
+    def choose_level(self, scale):
+        """
+        选择缩放比例 scale 下使用的级别: 分辨率不低于 scale 的最小一级
+        :param scale: 屏幕像素 / 原图像素
+        :return:
+        """
+        level = 0
+        while level + 1 < self.num_levels and \
+                self._density(level + 1) >= scale:
+            level += 1
+        return level
+
+    def _tile(self, level, col, row):
+        key = (level, col, row)
+        tile = self._tiles.get(key)
+        if tile is None:
+            pixmap = self._level_pixmap(level)
+            tile = pixmap.copy(QtCore.QRect(
+                col * self.TILE_SIZE, row * self.TILE_SIZE,
+                self.TILE_SIZE, self.TILE_SIZE).intersected(pixmap.rect()))
+            self._tiles[key] = tile
+        return tile
+
+    def paint(self, painter, scale, exposed=None):
+        """
+        :param painter: 已按 scale 缩放、坐标为原图坐标的 QPainter
+        :param scale: 当前缩放比例
+        :param exposed: 需要重绘的区域(原图坐标), 为 None 时绘制全图
+        :return: 绘制的块数
+        """
+        level = self.choose_level(scale)
+        pixmap = self._level_pixmap(level)
+        density = self._density(level)
+        bounds = QtCore.QRectF(QtCore.QPointF(0, 0),
+                               QtCore.QSizeF(self.image_size))
+        exposed = bounds if exposed is None else exposed.intersected(bounds)
+        if exposed.isEmpty():
+            return 0
+        size = self.TILE_SIZE
+        col0 = max(0, int(exposed.left() * density) // size)
+        row0 = max(0, int(exposed.top() * density) // size)
+        col1 = min((pixmap.width() - 1) // size,
+                   int(math.ceil(exposed.right() * density)) // size)
+        row1 = min((pixmap.height() - 1) // size,
+                   int(math.ceil(exposed.bottom() * density)) // size)
+        count = 0
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                tile = self._tile(level, col, row)
+                target = QtCore.QRectF(
+                    col * size / density, row * size / density,
+                    tile.width() / density, tile.height() / density)
+                painter.drawPixmap(target, tile, QtCore.QRectF(tile.rect()))
+                count += 1
+        return count
+
+    def clear(self):
+        self._levels = self._levels[:1]
+        self._tiles.clear()
@@ -0,0 +1,106 @@
+"""
+拖动顶点时每帧的耗时: 每次鼠标移动都同步重绘整个画布 (repaint) 与只重绘修改区域 (update(rect)) 的对比
+用法: python test/bench_canvas_drag.py [--width 6000 --height 4000 --shapes 300 --steps 200]
+无显示器时: QT_QPA_PLATFORM=offscreen python test/bench_canvas_drag.py
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qtpy import QtCore, QtGui, QtWidgets
+
+from labelme.shape import Shape
+from labelme.widgets.canvas import Canvas
+
+VIEWPORT = QtCore.QSize(1600, 900)
+
+
+def make_pixmap(width, height):
+    image = QtGui.QImage(width, height, QtGui.QImage.Format_RGB32)
+    painter = QtGui.QPainter(image)
+    gradient = QtGui.QLinearGradient(0, 0, width, height)
+    gradient.setColorAt(0, QtGui.QColor(30, 60, 90))
+    gradient.setColorAt(1, QtGui.QColor(220, 180, 40))
+    painter.fillRect(image.rect(), gradient)
+    painter.end()
+    return QtGui.QPixmap.fromImage(image)
+
+
+def make_shapes(count, seed=0):
+    """在视口范围内随机生成多边形"""
+    rng = random.Random(seed)
+    shapes = []
+    for i in range(count):
+        cx = rng.uniform(50, VIEWPORT.width() - 50)
+        cy = rng.uniform(50, VIEWPORT.height() - 50)
+        shape = Shape(label='shape%d' % i)
+        shape.points = [(cx + rng.uniform(-40, 40), cy + rng.uniform(-40, 40))
+                        for _ in range(rng.randint(4, 12))]
+        shape.visibles = [1] * len(shape.pointsArray())
+        shape.close()
+        shapes.append(shape)
+    return shapes
+
+
+def mouse_move(canvas, pos):
+    event = QtGui.QMouseEvent(QtCore.QEvent.MouseMove, pos, QtCore.Qt.NoButton,
+                              QtCore.Qt.LeftButton, QtCore.Qt.NoModifier)
+    canvas.mouseMoveEvent(event)
+
+
+def drag(app, canvas, shape, steps, full):
+    """
+    拖动 shape 的第一个顶点, 返回每帧的平均耗时和最大耗时
+    :param full: True 时每次移动后同步重绘整个画布, 相当于原来的 repaint()
+    :return:
+    """
+    canvas.hShape, canvas.hVertex = shape, 0
+    start_point = shape[0]
+    times = []
+    for i in range(steps):
+        pos = QtCore.QPoint(int(start_point.x()) + (i % 40) - 20,
+                            int(start_point.y()) + (i // 40 % 2) * 10)
+        start = time.perf_counter()
+        mouse_move(canvas, pos)
+        if full:
+            canvas.repaint()
+        app.processEvents()
+        times.append(time.perf_counter() - start)
+    return sum(times) / len(times), max(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=6000)
+    parser.add_argument('--height', type=int, default=4000)
+    parser.add_argument('--shapes', type=int, default=300)
+    parser.add_argument('--steps', type=int, default=200)
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication(sys.argv)
+    canvas = Canvas()
+    canvas.resize(VIEWPORT)
+    canvas.show()
+    canvas.loadPixmap(make_pixmap(args.width, args.height))
+    canvas.loadShapes(make_shapes(args.shapes))
+    app.processEvents()
+
+    shape = canvas.shapes[len(canvas.shapes) // 2]
+    # 预热, 生成图块缓存
+    drag(app, canvas, shape, 10, True)
+    results = {}
+    for name, full in (('repaint', True), ('update(rect)', False)):
+        results[name] = drag(app, canvas, shape, args.steps, full)
+        avg, worst = results[name]
+        print('{:<14} avg {:7.2f} ms  max {:7.2f} ms'.format(
+            name, avg * 1000, worst * 1000))
+    print('speedup x{:.1f}'.format(
+        results['repaint'][0] / results['update(rect)'][0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+标签相关请求/响应压缩前后的字节数和压缩耗时
+数据为模拟的 10 万张图片的文件列表 (get_file_list) 和一个 500 个形状的标签 (save_lable_by_path 请求体)
+用法: python test/bench_compression.py [--images 100000 --shapes 500]
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+
+LABELS = ['person', 'car', 'bicycle', 'dog', 'traffic_light', 'bus']
+
+
+def make_shape(rng, width=1920, height=1080):
+    cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+    n = rng.randint(4, 24)
+    points = [[round(cx + rng.uniform(-80, 80), 2), round(cy + rng.uniform(-80, 80), 2)]
+              for _ in range(n)]
+    return {'label': rng.choice(LABELS), 'line_color': None, 'fill_color': None,
+            'points': points, 'visible': [1] * n, 'shape_type': 'polygon'}
+
+
+def make_label(rng, shapes):
+    return {'version': '3.6.10', 'flags': {}, 'shapes': [make_shape(rng) for _ in range(shapes)],
+            'lineColor': [0, 255, 0, 128], 'fillColor': [255, 0, 0, 128],
+            'imagePath': 'images/%08d.jpg' % rng.randint(0, 10 ** 8), 'imageData': None,
+            'imageHeight': 1080, 'imageWidth': 1920}
+
+
+def make_file_list(rng, images, labeled_ratio=0.3):
+    """get_file_list 的响应: 每张图片的 id、路径和标签字符串"""
+    image_list = []
+    for i in range(images):
+        shapes = rng.randint(1, 8) if rng.random() < labeled_ratio else 0
+        label = json.dumps(make_label(rng, shapes))
+        image_list.append([i + 1, 'images/%08d.jpg' % i, label])
+    return json.dumps({'image_num': images, 'image_list': image_list}, ensure_ascii=False)
+
+
+def report(name, text):
+    raw = text.encode('utf-8')
+    print('{}: {:,} bytes'.format(name, len(raw)))
+    for level in (1, 6, 9):
+        start = time.perf_counter()
+        packed = gzip.compress(raw, level)
+        elapsed = time.perf_counter() - start
+        print('  gzip -{}  {:>12,} bytes  x{:5.1f}  {:8.1f} ms'.format(
+            level, len(packed), len(raw) / len(packed), elapsed * 1000))
+    try:
+        import zstandard
+    except ImportError:
+        return
+    for level in (3, 10):
+        start = time.perf_counter()
+        packed = zstandard.ZstdCompressor(level=level).compress(raw)
+        elapsed = time.perf_counter() - start
+        print('  zstd -{:<2} {:>12,} bytes  x{:5.1f}  {:8.1f} ms'.format(
+            level, len(packed), len(raw) / len(packed), elapsed * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=100000)
+    parser.add_argument('--shapes', type=int, default=500)
+    args = parser.parse_args()
+    rng = random.Random(0)
+    report('get_file_list response, {} images'.format(args.images),
+           make_file_list(rng, args.images))
+    body = json.dumps({'image_path': 'images/00000001.jpg',
+                       'image_label': make_label(rng, args.shapes)})
+    report('save_lable_by_path request, {} shapes'.format(args.shapes), body)
+
+
+if __name__ == '__main__':
+    main()
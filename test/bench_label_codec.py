@@ -0,0 +1,119 @@
+"""
+标签编解码耗时和大小: 现在的 JSON (标签 JSON 字符串再套一层 JSON) 与 MessagePack + 类型化数组 points 的对比
+分别模拟 get_lable_by_path 响应 (服务器编码, 客户端解码) 和 save_lable_by_path 请求 (客户端编码, 服务器解码)
+MessagePack 的响应直接拼接保存时生成的 label_pack, 其打包耗时计入保存时服务器的解码
+用法: python test/bench_label_codec.py [--points 1000 5000 20000 --repeat 20]
+需要 pip install msgpack
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import msgpack
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'web'))
+
+from labelme import network
+import label_pack
+
+LABELS = ['person', 'car', 'bicycle', 'dog', 'traffic_light', 'bus']
+
+
+def make_label(rng, total_points, points_per_shape=40):
+    shapes = []
+    while total_points > 0:
+        n = min(points_per_shape, total_points)
+        total_points -= n
+        cx, cy = rng.uniform(0, 1920), rng.uniform(0, 1080)
+        shapes.append({'label': rng.choice(LABELS), 'line_color': None, 'fill_color': None,
+                       'points': [[round(cx + rng.uniform(-80, 80), 2),
+                                   round(cy + rng.uniform(-80, 80), 2)] for _ in range(n)],
+                       'visible': [1] * n, 'shape_type': 'polygon'})
+    return {'version': '3.6.10', 'flags': {}, 'shapes': shapes,
+            'lineColor': [0, 255, 0, 128], 'fillColor': [255, 0, 0, 128],
+            'imagePath': 'images/00000001.jpg', 'imageData': None,
+            'imageHeight': 1080, 'imageWidth': 1920}
+
+
+def response_json(label_text):
+    return json.dumps({'label': label_text, 'fuzzy': 0}, ensure_ascii=False).encode('utf-8')
+
+
+def response_msgpack(packed):
+    return label_pack.pack_map({'fuzzy': 0}, {'label': packed})
+
+
+def read_json(body):
+    data = json.loads(json.loads(body)['label'])
+    return [np.array(s['points'], dtype=np.float64) for s in data['shapes']]
+
+
+def read_msgpack(body):
+    data = msgpack.unpackb(body, raw=False, ext_hook=network._ext_hook)['label']
+    return [np.array(s['points'], dtype=np.float64) for s in data['shapes']]
+
+
+def request_json(label):
+    return json.dumps({'image_path': 'a.jpg', 'image_label': label}).encode('utf-8')
+
+
+def request_msgpack(label):
+    return msgpack.packb(network._pack_points({'image_path': 'a.jpg', 'image_label': label}),
+                         use_bin_type=True)
+
+
+def store_json(body):
+    return json.dumps(json.loads(body)['image_label'])
+
+
+def store_msgpack(body):
+    """服务器保存时同时生成 label_pack"""
+    label = msgpack.unpackb(body, raw=False, ext_hook=label_pack.ext_hook)['image_label']
+    return json.dumps(label), label_pack.label_bytes(label)
+
+
+def timeit(func, arg, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def compare(name, args, encoders, decoders, repeat):
+    print(name)
+    for fmt, arg, encode, decode in zip(('json', 'msgpack'), args, encoders, decoders):
+        t_enc, body = timeit(encode, arg, repeat)
+        t_dec, _ = timeit(decode, body, repeat)
+        print('  {:<8} {:>10,} bytes  encode {:7.2f} ms  decode {:7.2f} ms'.format(
+            fmt, len(body), t_enc * 1000, t_dec * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    rng = random.Random(0)
+    for points in args.points:
+        label = make_label(rng, points)
+        label_text = json.dumps(label)
+        packed = label_pack.label_bytes(label)
+        print('=== {} points, {} shapes'.format(points, len(label['shapes'])))
+        compare('get_lable_by_path (server encode, client decode)', (label_text, packed),
+                (response_json, response_msgpack), (read_json, read_msgpack), args.repeat)
+        compare('save_lable_by_path (client encode, server decode)', (label, label),
+                (request_json, request_msgpack), (store_json, store_msgpack), args.repeat)
+        # 往返后数值不变
+        assert read_msgpack(response_msgpack(packed))[0].tolist() == label['shapes'][0]['points']
+        assert json.loads(store_msgpack(request_msgpack(label))[0]) == label
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+标签列表的列表项与形状互查耗时: 原来按列表线性查找与按对象建立字典的对比
+用法: python test/bench_label_list.py [--shapes 2000 --repeat 5]
+无显示器时: QT_QPA_PLATFORM=offscreen python test/bench_label_list.py
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qtpy import QtWidgets
+
+from labelme.widgets.label_qlist_widget import LabelQListWidget
+
+
+class LinearLabelList(QtWidgets.QListWidget):
+    """原来的实现: itemsToShapes 列表, 线性查找"""
+
+    def __init__(self, *args, **kwargs):
+        super(LinearLabelList, self).__init__(*args, **kwargs)
+        self.itemsToShapes = []
+
+    def addShapeItem(self, item, shape):
+        self.itemsToShapes.append((item, shape))
+        self.addItem(item)
+
+    def get_shape_from_item(self, item):
+        for index, (item_, shape) in enumerate(self.itemsToShapes):
+            if item_ is item:
+                return shape
+
+    def get_item_from_shape(self, shape):
+        for index, (item, shape_) in enumerate(self.itemsToShapes):
+            if shape_ is shape:
+                return item
+
+    def clear(self):
+        super(LinearLabelList, self).clear()
+        self.itemsToShapes = []
+
+    @property
+    def shapes(self):
+        shapes = []
+        for i in range(self.count()):
+            item = self.item(i)
+            shape = self.get_shape_from_item(item)
+            shapes.append(shape)
+        return shapes
+
+
+class FakeShape(object):
+    def __init__(self, label):
+        self.label = label
+
+
+def timeit(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench(cls, shapes, repeat):
+    widget = cls()
+
+    def build():
+        widget.clear()
+        for shape in shapes:
+            widget.addShapeItem(QtWidgets.QListWidgetItem(shape.label), shape)
+
+    results = [('build', timeit(build, repeat))]
+    # 保存时取全部形状
+    results.append(('shapes', timeit(lambda: widget.shapes, repeat)))
+    # 选中每个形状时查找对应的列表项
+    results.append(('item lookup', timeit(
+        lambda: [widget.get_item_from_shape(s) for s in shapes], repeat)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shapes', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    app = QtWidgets.QApplication(sys.argv)
+    shapes = [FakeShape('shape%d' % i) for i in range(args.shapes)]
+    linear = bench(LinearLabelList, shapes, args.repeat)
+    mapped = bench(LabelQListWidget, shapes, args.repeat)
+    print('{} shapes'.format(args.shapes))
+    for (name, old), (_, new) in zip(linear, mapped):
+        print('{:<12} linear: {:9.2f} ms  dict: {:9.2f} ms  x{:.1f}'.format(
+            name, old * 1000, new * 1000, old / new if new else 0))
+
+
+if __name__ == '__main__':
+    main()
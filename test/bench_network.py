@@ -0,0 +1,118 @@
+"""
+每帧获取标签和图片的网络耗时: 每次新建连接并依次请求 与 共用 keep-alive 连接并同时请求 的对比
+本地启动一个模拟服务器, 新连接和每个请求各增加 --rtt 毫秒延迟, 模拟远程链路
+用法: python test/bench_network.py [--rtt 50 --frames 50 --image-kb 500]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from labelme import network
+
+LABEL = json.dumps({
+    'imageData': None, 'imagePath': 'a.jpg', 'lineColor': None, 'fillColor': None,
+    'flags': {}, 'shapes': [{'label': 'person', 'points': [[i, i] for i in range(20)],
+                             'line_color': None, 'fill_color': None}] * 10,
+})
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_handler(rtt, image):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            # 新连接的 TCP 握手
+            time.sleep(rtt)
+            BaseHTTPRequestHandler.setup(self)
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, body, content_type):
+            time.sleep(rtt)
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self._reply(json.dumps({'label': LABEL, 'fuzzy': 0}).encode('utf-8'),
+                        'application/json')
+
+        def do_GET(self):
+            self._reply(image, 'image/jpeg')
+
+    return Handler
+
+
+def frame_before(base_url, image_path):
+    """原来的做法: 每个请求新建连接, 先取标签再取图片"""
+    r = requests.post(base_url + 'get_lable_by_path',
+                      data=json.dumps({'image_path': image_path}))
+    json.loads(r.json()['label'])
+    requests.get(base_url + 'get_image_raw', params={'image_path': image_path}).content
+
+
+def frame_after(base_url, image_path):
+    """共用 keep-alive 连接, 同时取标签和图片"""
+    label, image = network.parallel(
+        (network.post, 'get_lable_by_path', {'image_path': image_path}),
+        (network.get, 'get_image_raw', {'image_path': image_path}))
+    json.loads(label['label'])
+    image.content
+
+
+def measure(func, base_url, frames):
+    times = []
+    for i in range(frames):
+        start = time.perf_counter()
+        func(base_url, 'images/%d.jpg' % i)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rtt', type=float, default=50, help='模拟的往返延迟(毫秒)')
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--image-kb', type=int, default=500)
+    args = parser.parse_args()
+
+    server = ThreadingServer(('127.0.0.1', 0), make_handler(
+        args.rtt / 1000.0, os.urandom(args.image_kb * 1024)))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    base_url = 'http://127.0.0.1:{}/xiaoi/'.format(server.server_address[1])
+    network.URL = base_url + '{}'
+
+    print('rtt {} ms, image {} KB, {} frames'.format(args.rtt, args.image_kb, args.frames))
+    results = {}
+    for name, func in (('before', frame_before), ('after', frame_after)):
+        times = measure(func, base_url, args.frames)
+        results[name] = statistics.mean(times)
+        print('{:<7} mean {:7.1f} ms  p50 {:7.1f} ms  max {:7.1f} ms'.format(
+            name, results[name] * 1000, statistics.median(times) * 1000,
+            max(times) * 1000))
+    print('speedup x{:.1f}'.format(results['before'] / results['after']))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+画布绘制耗时: 整图 drawPixmap 与分块绘制 (TiledPixmap) 在不同缩放比例下的对比
+用法: python test/bench_paint.py [--width 3840 --height 2160 --repeat 20]
+无显示器时: QT_QPA_PLATFORM=offscreen python test/bench_paint.py
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qtpy import QtCore, QtGui, QtWidgets
+
+from labelme.widgets.tiled_pixmap import TiledPixmap
+
+VIEWPORT = QtCore.QSize(1600, 900)
+SCALES = [0.25, 0.5, 1.0, 2.0, 4.0]
+
+
+def make_pixmap(width, height):
+    image = QtGui.QImage(width, height, QtGui.QImage.Format_RGB32)
+    painter = QtGui.QPainter(image)
+    gradient = QtGui.QLinearGradient(0, 0, width, height)
+    gradient.setColorAt(0, QtGui.QColor(30, 60, 90))
+    gradient.setColorAt(1, QtGui.QColor(220, 180, 40))
+    painter.fillRect(image.rect(), gradient)
+    for i in range(0, width, 64):
+        painter.drawLine(i, 0, i, height)
+    painter.end()
+    return QtGui.QPixmap.fromImage(image)
+
+
+def paint(target, scale, draw):
+    """
+    以 scale 缩放绘制视口大小的区域, 视口位于图片中心
+    :param target:
+    :param scale:
+    :param draw: draw(painter, exposed)
+    :return:
+    """
+    p = QtGui.QPainter(target)
+    p.setRenderHint(QtGui.QPainter.Antialiasing)
+    p.setRenderHint(QtGui.QPainter.SmoothPixmapTransform)
+    p.scale(scale, scale)
+    exposed = QtCore.QRectF(0, 0, VIEWPORT.width() / scale, VIEWPORT.height() / scale)
+    exposed.moveCenter(QtCore.QPointF(draw.center))
+    p.translate(-exposed.topLeft())
+    draw(p, exposed)
+    p.end()
+
+
+def bench(pixmap, repeat):
+    tiled = TiledPixmap(pixmap)
+    target = QtGui.QImage(VIEWPORT, QtGui.QImage.Format_RGB32)
+    center = QtCore.QPointF(pixmap.width() / 2.0, pixmap.height() / 2.0)
+
+    def full(p, exposed):
+        p.drawPixmap(0, 0, pixmap)
+
+    for scale in SCALES:
+        def tiles(p, exposed, scale=scale):
+            tiled.paint(p, scale, exposed)
+
+        results = []
+        for draw in (full, tiles):
+            draw.center = center
+            # 第一次绘制会生成缩小图和图块, 单独计时
+            start = time.perf_counter()
+            paint(target, scale, draw)
+            first = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(repeat):
+                paint(target, scale, draw)
+            results.append((first, (time.perf_counter() - start) / repeat))
+        (full_first, full_avg), (tile_first, tile_avg) = results
+        print('scale {:>5.2f}  full: {:7.2f} ms  tiled: {:7.2f} ms (first {:7.2f} ms, level {})  x{:.1f}'.format(
+            scale, full_avg * 1000, tile_avg * 1000, tile_first * 1000,
+            tiled.choose_level(scale), full_avg / tile_avg if tile_avg else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=3840)
+    parser.add_argument('--height', type=int, default=2160)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    app = QtWidgets.QApplication(sys.argv)
+    bench(make_pixmap(args.width, args.height), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
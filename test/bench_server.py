@@ -0,0 +1,105 @@
+"""
+对比开发服务器(app_v3.py)和生产模式(serve.py)的吞吐量
+先分别启动两个服务器, 例如:
+    cd web && python app_v3.py                  # 12346
+    cd web && python serve.py --port 12347
+再执行: python test/bench_server.py http://127.0.0.1:12346 http://127.0.0.1:12347 --clients 32
+"""
+import argparse
+import json
+import random
+import threading
+import time
+
+import requests
+
+
+def get_paths(base_url):
+    res = requests.post(base_url + '/xiaoi/get_file_page', data=json.dumps({'limit': 500}))
+    return [item[1] for item in json.loads(res.text)['image_list']]
+
+
+def make_requests(base_url, paths):
+    """
+    每个端点返回一个生成请求参数的函数
+    :param base_url:
+    :param paths:
+    :return:
+    """
+    labels = {}
+    for image_path in paths[:50]:
+        res = requests.post(base_url + '/xiaoi/get_lable_by_path', data=json.dumps({'image_path': image_path}))
+        label = json.loads(res.text).get('label')
+        if label:
+            labels[image_path] = json.loads(label)
+
+    def get_file_list():
+        return base_url + '/xiaoi/get_file_list', {}
+
+    def get_image_by_path():
+        return base_url + '/xiaoi/get_image_by_path', {'image_path': random.choice(paths)}
+
+    def save_lable_by_path():
+        image_path = random.choice(list(labels))
+        return base_url + '/xiaoi/save_lable_by_path', {'image_path': image_path, 'image_label': labels[image_path]}
+
+    return [get_file_list, get_image_by_path, save_lable_by_path]
+
+
+def run(make_request, clients, seconds):
+    counter = {'ok': 0, 'error': 0}
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+
+    def worker():
+        session = requests.Session()
+        ok = error = 0
+        while time.time() < deadline:
+            url, data = make_request()
+            try:
+                res = session.post(url, data=json.dumps(data), timeout=60)
+                if res.status_code == 200:
+                    ok += 1
+                else:
+                    error += 1
+            except requests.RequestException:
+                error += 1
+        with lock:
+            counter['ok'] += ok
+            counter['error'] += error
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return counter['ok'] / (time.time() - start), counter['error']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('urls', nargs='+', help='依次测试的服务器地址')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=15)
+    args = parser.parse_args()
+
+    paths = get_paths(args.urls[0])
+    results = {}
+    for base_url in args.urls:
+        for make_request in make_requests(base_url, paths):
+            rps, errors = run(make_request, args.clients, args.seconds)
+            results[(base_url, make_request.__name__)] = rps
+            print('{:<30} {:<20} {:8.1f} req/s  errors: {}'.format(base_url, make_request.__name__, rps, errors))
+
+    if len(args.urls) > 1:
+        base = args.urls[0]
+        for base_url in args.urls[1:]:
+            for name in ('get_file_list', 'get_image_by_path', 'save_lable_by_path'):
+                if results.get((base, name)):
+                    print('{:<20} {} vs {}: x{:.2f}'.format(
+                        name, base_url, base, results[(base_url, name)] / results[(base, name)]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Shape.nearestVertex / nearestEdge 每次鼠标事件的耗时: 逐点循环与向量化的对比
+用法: python test/bench_shape_distance.py [--repeat 200]
+"""
+import argparse
+import math
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qtpy import QtCore
+
+import labelme.utils
+from labelme.shape import Shape
+
+EPSILON = 11.0
+
+
+def loop_nearest_vertex(points, point, epsilon):
+    """修改前的实现"""
+    min_distance = float('inf')
+    min_i = None
+    for i, p in enumerate(points):
+        dist = labelme.utils.distance(p - point)
+        if dist <= epsilon and dist < min_distance:
+            min_distance = dist
+            min_i = i
+    return min_i
+
+
+def loop_nearest_edge(points, point, epsilon):
+    """修改前的实现"""
+    min_distance = float('inf')
+    post_i = None
+    for i in range(len(points)):
+        line = [points[i - 1], points[i]]
+        dist = labelme.utils.distancetoline(point, line)
+        if dist <= epsilon and dist < min_distance:
+            min_distance = dist
+            post_i = i
+    return post_i
+
+
+def make_polygon(n, radius=1000.0):
+    shape = Shape(shape_type='polygon')
+    shape.points = [QtCore.QPointF(radius + radius * math.cos(2 * math.pi * i / n),
+                                   radius + radius * math.sin(2 * math.pi * i / n)) for i in range(n)]
+    shape.close()
+    return shape
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    # 鼠标在第一条边中点附近
+    for n in (10, 100, 1000):
+        shape = make_polygon(n)
+        points = shape.points
+        p0, p1 = points[0], points[1]
+        point = (p0 + p1) / 2 + QtCore.QPointF(2, 2)
+        assert loop_nearest_vertex(points, point, EPSILON) == shape.nearestVertex(point, EPSILON)
+        assert loop_nearest_edge(points, point, EPSILON) == shape.nearestEdge(point, EPSILON)
+        timings = []
+        for func in (lambda: (loop_nearest_vertex(points, point, EPSILON),
+                              loop_nearest_edge(points, point, EPSILON)),
+                     lambda: (shape.nearestVertex(point, EPSILON),
+                              shape.nearestEdge(point, EPSILON))):
+            timings.append(timeit.timeit(func, number=args.repeat) / args.repeat)
+        # 顶点修改后第一次查询需要重新生成数组
+        def vectorized_after_move():
+            shape.moveVertexBy(0, QtCore.QPointF(0, 0))
+            shape.nearestVertex(point, EPSILON)
+            shape.nearestEdge(point, EPSILON)
+        after_move = timeit.timeit(vectorized_after_move, number=args.repeat) / args.repeat
+        print('{:>5} vertices  loop: {:9.1f} us  vectorized: {:7.1f} us  (after move {:7.1f} us)  x{:.0f}'.format(
+            n, timings[0] * 1e6, timings[1] * 1e6, after_move * 1e6, timings[0] / timings[1]))
+
+    shapes = [make_polygon(100, radius=50.0 + i) for i in range(20)]
+    point = shapes[0].points[0] + QtCore.QPointF(1, 1)
+    single = timeit.timeit(lambda: [(s.nearestVertex(point, EPSILON), s.nearestEdge(point, EPSILON))
+                                    for s in shapes], number=args.repeat) / args.repeat
+    batch = timeit.timeit(lambda: (Shape.nearestVertexBatch(shapes, point, EPSILON),
+                                   Shape.nearestEdgeBatch(shapes, point, EPSILON)), number=args.repeat) / args.repeat
+    print('20 x 100 vertices  per shape: {:7.1f} us  batch: {:7.1f} us'.format(single * 1e6, batch * 1e6))
+
+
+if __name__ == '__main__':
+    main()
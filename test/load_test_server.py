@@ -0,0 +1,88 @@
+"""
+标注服务器并发压测: 多个线程模拟同时标注的用户, 统计吞吐量和延迟
+用法: python test/load_test_server.py http://127.0.0.1:12345 --clients 32 --seconds 30
+"""
+import argparse
+import json
+import random
+import threading
+import time
+
+import requests
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def worker(base_url, paths, deadline, write_ratio, stats, lock):
+    session = requests.Session()
+    latencies = []
+    errors = 0
+    while time.time() < deadline:
+        image_path = random.choice(paths)
+        roll = random.random()
+        if roll < write_ratio:
+            url = base_url + '/xiaoi/get_lable_by_path'
+            res = session.post(url, data=json.dumps({'image_path': image_path}), timeout=30)
+            label = json.loads(res.text).get('label') if res.status_code == 200 else None
+            if label is None:
+                errors += 1
+                continue
+            start = time.time()
+            res = session.post(base_url + '/xiaoi/save_lable_by_path', timeout=30, data=json.dumps(
+                {'image_path': image_path, 'image_label': json.loads(label)}))
+        elif roll < 0.9:
+            start = time.time()
+            res = session.post(base_url + '/xiaoi/get_lable_by_path', timeout=30,
+                               data=json.dumps({'image_path': image_path}))
+        else:
+            start = time.time()
+            res = session.post(base_url + '/xiaoi/get_file_page', timeout=30,
+                               data=json.dumps({'after_id': random.randint(0, 1000), 'limit': 500}))
+        latencies.append(time.time() - start)
+        if res.status_code != 200 or json.loads(res.text).get('state') == 0:
+            errors += 1
+    with lock:
+        stats['latencies'].extend(latencies)
+        stats['errors'] += errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('url', nargs='?', default='http://127.0.0.1:12345')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--write-ratio', type=float, default=0.2, help='保存请求所占比例')
+    args = parser.parse_args()
+
+    res = requests.post(args.url + '/xiaoi/get_file_page', data=json.dumps({'limit': 1000}))
+    paths = [item[1] for item in json.loads(res.text)['image_list']]
+    if not paths:
+        raise SystemExit('服务器上没有图片')
+
+    stats = {'latencies': [], 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.time() + args.seconds
+    threads = [threading.Thread(target=worker, args=(args.url, paths, deadline, args.write_ratio, stats, lock))
+               for _ in range(args.clients)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    latencies = stats['latencies']
+    print('clients: {}, requests: {}, errors: {}, elapsed: {:.1f}s'.format(
+        args.clients, len(latencies), stats['errors'], elapsed))
+    print('throughput: {:.1f} req/s'.format(len(latencies) / elapsed))
+    print('latency p50: {:.1f} ms, p95: {:.1f} ms, p99: {:.1f} ms'.format(
+        percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000, percentile(latencies, 0.99) * 1000))
+
+
+if __name__ == '__main__':
+    main()
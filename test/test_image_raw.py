@@ -0,0 +1,84 @@
+"""
+get_image_raw: X-Image-Size 响应头、条件请求(304)和原图尺寸缓存
+在临时目录中生成一张图片作为 PATH_C, 不访问数据库; 需要服务器的依赖 (flask、PIL、cv2 等)
+用法: python -m pytest test/test_image_raw.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from PIL import Image
+
+WEB_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'web')
+sys.path.insert(0, WEB_DIR)
+
+import app_v3
+
+WIDTH, HEIGHT = 320, 200
+
+
+class ImageRawTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        Image.new('RGB', (WIDTH, HEIGHT), (255, 0, 0)).save(os.path.join(self.tmpdir, 'fixture.jpg'))
+        self._paths = app_v3.PATH_C, app_v3.PATH_D, app_v3.RENDITION_DIR
+        self.addCleanup(self.restore)
+        app_v3.PATH_C = app_v3.PATH_D = self.tmpdir
+        app_v3.RENDITION_DIR = os.path.join(self.tmpdir, 'renditions')
+        app_v3._image_sizes.clear()
+        self.client = app_v3.app.test_client()
+
+    def restore(self):
+        app_v3.PATH_C, app_v3.PATH_D, app_v3.RENDITION_DIR = self._paths
+
+    def get(self, headers=None, **params):
+        params['image_path'] = 'fixture.jpg'
+        return self.client.get('/xiaoi/get_image_raw', query_string=params, headers=headers or {})
+
+    def test_image_size_header(self):
+        r = self.get()
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.headers['X-Image-Size'], '{}x{}'.format(WIDTH, HEIGHT))
+        with open(os.path.join(self.tmpdir, 'fixture.jpg'), 'rb') as f:
+            self.assertEqual(r.data, f.read())
+        r.close()
+
+    def test_rendition_keeps_original_size_header(self):
+        r = self.get(max_side=64)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.headers['X-Image-Size'], '{}x{}'.format(WIDTH, HEIGHT))
+        r.close()
+
+    def test_conditional_request(self):
+        r = self.get()
+        etag = r.headers['ETag']
+        last_modified = r.headers['Last-Modified']
+        r.close()
+        r = self.get(headers={'If-None-Match': etag})
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.data, b'')
+        r.close()
+        r = self.get(headers={'If-Modified-Since': last_modified})
+        self.assertEqual(r.status_code, 304)
+        r.close()
+
+    def test_size_is_cached(self):
+        self.get().close()
+        self.assertEqual(list(app_v3._image_sizes.values()), [(WIDTH, HEIGHT)])
+        # 第二次请求不再打开文件
+        opened = []
+        original = app_v3.Image.open
+        app_v3.Image.open = lambda *args, **kwargs: opened.append(args) or original(*args, **kwargs)
+        try:
+            self.get().close()
+        finally:
+            app_v3.Image.open = original
+        self.assertEqual(opened, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
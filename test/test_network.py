@@ -0,0 +1,86 @@
+"""
+labelme.network 的请求体压缩协商: 服务器的响应带有 Accept-Encoding: gzip 后才压缩请求体
+本地启动一个记录请求的模拟服务器
+用法: python -m pytest test/test_network.py
+"""
+import gzip
+import json
+import os
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from labelme import network
+
+# 超过 COMPRESS_MIN_SIZE 的请求
+LARGE = {'image_path': 'a.jpg', 'image_label': {'shapes': [[i, i] for i in range(1000)]}}
+
+
+def make_handler(accept_gzip, requests):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            requests.append((dict(self.headers), body))
+            reply = json.dumps({'state': 1}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(reply)))
+            if accept_gzip:
+                self.send_header('Accept-Encoding', 'gzip')
+            self.end_headers()
+            self.wfile.write(reply)
+
+    return Handler
+
+
+class CompressNegotiationTest(unittest.TestCase):
+
+    def start_server(self, accept_gzip):
+        self.requests = []
+        self.server = HTTPServer(('127.0.0.1', 0), make_handler(accept_gzip, self.requests))
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def setUp(self):
+        self._url = network.URL
+        self.addCleanup(setattr, network, 'URL', self._url)
+        self.addCleanup(setattr, network, '_server_gzip', False)
+        network._server_gzip = False
+
+    def post(self):
+        network.URL = 'http://127.0.0.1:{}/xiaoi/{{}}'.format(self.server.server_address[1])
+        return network.post('save_lable_by_path', LARGE, compress=True)
+
+    def test_server_without_gzip_gets_plain_body(self):
+        self.start_server(accept_gzip=False)
+        self.assertEqual(self.post(), {'state': 1})
+        self.assertEqual(self.post(), {'state': 1})
+        for headers, body in self.requests:
+            self.assertNotIn('Content-Encoding', headers)
+            self.assertEqual(json.loads(body.decode('utf-8')), LARGE)
+
+    def test_compress_after_server_advertises_gzip(self):
+        self.start_server(accept_gzip=True)
+        self.post()
+        self.post()
+        (first_headers, first_body), (second_headers, second_body) = self.requests
+        # 第一次还不知道服务器是否支持
+        self.assertNotIn('Content-Encoding', first_headers)
+        self.assertEqual(json.loads(first_body.decode('utf-8')), LARGE)
+        self.assertEqual(second_headers.get('Content-Encoding'), 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(second_body).decode('utf-8')), LARGE)
+
+
+if __name__ == '__main__':
+    unittest.main()
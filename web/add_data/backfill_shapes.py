@@ -0,0 +1,62 @@
+"""
+把 visual_shanghai 中已有的标签拆分写入形状表 visual_shape, 并生成 MessagePack 格式的 label_pack, 可重复执行
+按 id 游标分批处理, 每批先删除这些图片已有的形状再写入, 中断后重新执行即可 (--after-id 从指定 id 继续)
+需要先执行 add_data/migrate.py 创建形状表
+在 web 目录下执行: python -m add_data.backfill_shapes [--batch-size 500] [--after-id 0]
+"""
+import argparse
+import time
+
+from sqlalchemy import func
+
+from add_data.dao import session, VisualShanghai, VisualShape, label_bytes, parse_label, shape_rows
+
+
+def backfill(batch_size, after_id=0):
+    total = session.query(func.count(VisualShanghai.id)).filter(VisualShanghai.id > after_id).scalar()
+    last_id = after_id
+    done = 0
+    shapes = 0
+    broken = []
+    start = time.time()
+    while True:
+        rows = session.query(VisualShanghai.id, VisualShanghai.image_label).filter(
+            VisualShanghai.id > last_id).order_by(VisualShanghai.id).limit(batch_size).all()
+        if not rows:
+            break
+        mappings = []
+        packs = []
+        for row in rows:
+            label = parse_label(row.image_label)
+            if label is None and row.image_label:
+                # 旧的 VARCHAR(2000) 列中被截断的标签
+                broken.append(row.id)
+            packs.append({'id': row.id, 'label_pack': label_bytes(label)})
+            for mapping in shape_rows(label):
+                mapping['image_id'] = row.id
+                mappings.append(mapping)
+        ids = [row.id for row in rows]
+        session.query(VisualShape).filter(VisualShape.image_id.in_(ids)).delete(synchronize_session=False)
+        session.bulk_insert_mappings(VisualShape, mappings)
+        session.bulk_update_mappings(VisualShanghai, packs)
+        session.commit()
+        last_id = rows[-1].id
+        done += len(rows)
+        shapes += len(mappings)
+        print('backfill [{}/{}] {} shapes, last id {}, {:.1f}s'.format(
+            done, total, shapes, last_id, time.time() - start))
+    session.remove()
+    if broken:
+        print('{} labels could not be parsed, ids: {}'.format(len(broken), broken[:100]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--after-id', type=int, default=0, help='只处理 id 大于此值的图片')
+    args = parser.parse_args()
+    backfill(args.batch_size, args.after_id)
+
+
+if __name__ == '__main__':
+    main()
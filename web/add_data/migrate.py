@@ -0,0 +1,134 @@
+"""
+visual_shanghai 表结构迁移, 可重复执行, 已完成的步骤会跳过:
+1. 增加 shape_count、updated_at、label_pack 列
+2. 按 id 分批回填 shape_count
+3. 为 image_path 建唯一索引, 为 image_fuzzy、shape_count 建索引
+4. image_label 由 VARCHAR(2000) 改为 MEDIUMTEXT, 较大的标签不再被截断
+5. 创建形状表 visual_shape, 已有标签的形状由 add_data/backfill_shapes.py 回填
+在 web 目录下执行: python -m add_data.migrate [--batch-size 1000] [--dedupe]
+升级服务器前需要先执行本脚本, 否则查询 shape_count 会报错
+"""
+import argparse
+import datetime
+import time
+
+from sqlalchemy import func, inspect, text
+from sqlalchemy.dialects.mysql import LONGTEXT, MEDIUMTEXT
+
+from add_data.dao import engine, session, VisualShanghai, VisualShape, count_shapes
+
+TABLE = VisualShanghai.__tablename__
+COLUMNS = [
+    ('shape_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('updated_at', 'DATETIME NULL'),
+    ('label_pack', 'MEDIUMBLOB NULL'),
+]
+
+
+def add_columns():
+    exists = set(column['name'] for column in inspect(engine).get_columns(TABLE))
+    for name, ddl in COLUMNS:
+        if name in exists:
+            print('column {} exists, skip'.format(name))
+            continue
+        print('add column {}'.format(name))
+        with engine.begin() as conn:
+            conn.execute(text('ALTER TABLE {} ADD COLUMN {} {}'.format(TABLE, name, ddl)))
+
+
+def backfill(batch_size):
+    """
+    按 id 游标分批计算 shape_count, 每批一个事务, 中断后重新执行即可
+    :param batch_size:
+    :return:
+    """
+    total = session.query(func.count(VisualShanghai.id)).scalar()
+    now = datetime.datetime.now()
+    last_id = 0
+    done = 0
+    start = time.time()
+    while True:
+        rows = session.query(VisualShanghai.id, VisualShanghai.image_label, VisualShanghai.updated_at).filter(
+            VisualShanghai.id > last_id).order_by(VisualShanghai.id).limit(batch_size).all()
+        if not rows:
+            break
+        session.bulk_update_mappings(VisualShanghai, [
+            {'id': row.id, 'shape_count': count_shapes(row.image_label), 'updated_at': row.updated_at or now}
+            for row in rows])
+        session.commit()
+        last_id = rows[-1].id
+        done += len(rows)
+        print('backfill [{}/{}] {:.1f}s'.format(done, total, time.time() - start))
+    session.remove()
+
+
+def find_duplicates():
+    return session.query(VisualShanghai.image_path, func.count(VisualShanghai.id)).group_by(
+        VisualShanghai.image_path).having(func.count(VisualShanghai.id) > 1).all()
+
+
+def dedupe(duplicates):
+    """
+    同一路径有多条记录时保留 id 最大(最后写入)的一条
+    :param duplicates:
+    :return:
+    """
+    for image_path, _ in duplicates:
+        ids = [row.id for row in session.query(VisualShanghai.id).filter(
+            VisualShanghai.image_path == image_path).order_by(VisualShanghai.id).all()]
+        session.query(VisualShanghai).filter(VisualShanghai.id.in_(ids[:-1])).delete(synchronize_session=False)
+    session.commit()
+    session.remove()
+
+
+def create_indexes(allow_dedupe):
+    exists = set(index['name'] for index in inspect(engine).get_indexes(TABLE))
+    for index in VisualShanghai.__table__.indexes:
+        if index.name in exists:
+            print('index {} exists, skip'.format(index.name))
+            continue
+        if index.unique:
+            duplicates = find_duplicates()
+            if duplicates:
+                for image_path, count in duplicates[:20]:
+                    print('duplicate image_path: {} x{}'.format(image_path, count))
+                if not allow_dedupe:
+                    raise SystemExit('{} duplicate image_path, rerun with --dedupe to keep the newest row'.format(
+                        len(duplicates)))
+                dedupe(duplicates)
+        print('create index {}'.format(index.name))
+        index.create(bind=engine)
+
+
+def widen_label():
+    column = [column for column in inspect(engine).get_columns(TABLE) if column['name'] == 'image_label'][0]
+    if isinstance(column['type'], (MEDIUMTEXT, LONGTEXT)):
+        print('column image_label is {}, skip'.format(column['type']))
+        return
+    print('alter column image_label to MEDIUMTEXT')
+    with engine.begin() as conn:
+        conn.execute(text('ALTER TABLE {} MODIFY image_label MEDIUMTEXT'.format(TABLE)))
+
+
+def create_shape_table():
+    if VisualShape.__tablename__ in inspect(engine).get_table_names():
+        print('table {} exists, skip'.format(VisualShape.__tablename__))
+        return
+    print('create table {}'.format(VisualShape.__tablename__))
+    VisualShape.__table__.create(bind=engine)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--dedupe', action='store_true', help='删除重复的 image_path, 只保留 id 最大的一条')
+    args = parser.parse_args()
+    add_columns()
+    backfill(args.batch_size)
+    create_indexes(args.dedupe)
+    widen_label()
+    create_shape_table()
+
+
+if __name__ == '__main__':
+    main()
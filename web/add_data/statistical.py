@@ -1,15 +1,20 @@
-import glob
-import json
-import os
+"""
+标注统计: 图片总数、已标注图片数, 以及每个标签的形状数和图片数
+统计在数据库中完成, 不再逐条解析标签; 需要先执行 add_data/migrate.py 和 add_data/backfill_shapes.py
+在 web 目录下执行: python -m add_data.statistical
+"""
+from sqlalchemy import func
 
-from add_data.dao import session, myImage as MyImage, VisualShanghai
+from add_data.dao import session, VisualShanghai, VisualShape
 
 if __name__ == '__main__':
-    VisualShanghai = session.query(VisualShanghai.image_label).all()
-    count = 0
-    print(len(VisualShanghai))
-    for visual in VisualShanghai:
-        data = json.loads(visual[0])
-        if len(data["shapes"]) > 0:
-            count += 1
-    print(count)
+    total = session.query(func.count(VisualShanghai.id)).scalar()
+    labeled = session.query(func.count(VisualShanghai.id)).filter(VisualShanghai.shape_count > 0).scalar()
+    print(total)
+    print(labeled)
+    rows = session.query(VisualShape.label, func.count(VisualShape.id),
+                         func.count(func.distinct(VisualShape.image_id))).group_by(
+        VisualShape.label).order_by(func.count(VisualShape.id).desc()).all()
+    for label, shapes, images in rows:
+        print('{}\t{} shapes\t{} images'.format(label, shapes, images))
+    session.remove()
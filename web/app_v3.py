@@ -3,6 +3,8 @@
 api接口控制
 """
 import base64
+import collections
+import hashlib
 import os
 import platform
 import socket
@@ -13,9 +15,10 @@ import time
 import cv2
 import numpy as np
 from PIL import Image
-from flask import Flask, request, json, send_from_directory, render_template
+from flask import Flask, request, json, send_file, send_from_directory, render_template
 
-from dao.dao import session, VisualShanghai
+from codec import compress_response, label_response, request_json
+from dao.dao import session, save_shapes, VisualShanghai, VisualShape
 
 # from web.servce.detection import detection_pen
 from flask_bootstrap import Bootstrap
@@ -39,18 +42,37 @@ VERSION = 0.1
 IP_LIST = []
 
 
+app.after_request(compress_response)
+
+
+@app.teardown_appcontext
+def remove_session(exception=None):
+    """
+    每个请求结束时关闭本线程的 session 并把连接归还连接池,
+    没有提交的事务(包括出错的)会被回滚
+    """
+    session.remove()
+
+
+def resolve_image_path(image_path):
+    """
+    数据库中只保存文件名, 依次在 PATH_C、PATH_D 中查找图片
+    :param image_path:
+    :return:
+    """
+    filename = os.path.basename(image_path)
+    img_path = os.path.join(PATH_C, filename)
+    if not os.path.isfile(img_path):
+        img_path = os.path.join(PATH_D, filename)
+    return img_path
+
+
 @app.route('/xiaoi/get_image', methods=['POST'])
 def get_image():
     if request.data:
-        data = json.loads(request.data)
+        data = request_json()
         image_path = session.query(VisualShanghai.image_path).filter(VisualShanghai.id == data['image_id']).all()
-        img_path = image_path[0][0]
-        # img_path = 'D:\\baidu_img\\动物\\93.jpg'
-        # filepath, filename = os.path.split(img_path)
-        filename = os.path.basename(img_path)
-        img_path = os.path.join(PATH_C, filename)
-        if not os.path.isfile(img_path):
-            img_path = os.path.join(PATH_D, filename)
+        img_path = resolve_image_path(image_path[0][0])
         img = cv2.imdecode(np.fromfile(img_path, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
         if img is None:
             img = Image.open(img_path)
@@ -76,14 +98,8 @@ def get_image():
 @app.route('/xiaoi/get_image_by_path', methods=['POST'])
 def get_image_by_path():
     if request.data:
-        data = json.loads(request.data)
-        image_path = data['image_path']
-        # img_path = 'D:\\baidu_img\\动物\\93.jpg'
-        # filepath, filename = os.path.split(img_path)
-        filename = os.path.basename(image_path)
-        img_path = os.path.join(PATH_C, filename)
-        if not os.path.isfile(img_path):
-            img_path = os.path.join(PATH_D, filename)
+        data = request_json()
+        img_path = resolve_image_path(data['image_path'])
         img = cv2.imdecode(np.fromfile(img_path, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
         if img is None:
             img = Image.open(img_path)
@@ -106,6 +122,111 @@ def get_image_by_path():
         return json.dumps({"erorr": "参数有误"}, ensure_ascii=False)
 
 
+# 缩略图缓存目录, 文件名包含原图的修改时间, 原图更新后自动生成新的
+RENDITION_DIR = os.environ.get('LABELME_RENDITION_DIR',
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'renditions'))
+RENDITION_FORMATS = {'jpg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY), 'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY)}
+RENDITION_QUALITY = 85
+# 防止任意 max_side 参数生成大量缓存文件, 统一向上取整到此倍数
+RENDITION_STEP = 64
+# 原图尺寸缓存的条数, 键包含修改时间和大小, 原图更新后自动失效
+IMAGE_SIZE_CACHE = 100000
+_image_sizes = collections.OrderedDict()
+_image_sizes_lock = threading.Lock()
+
+
+def image_size(img_path):
+    """
+    原图的 (宽, 高), 只读取文件头; 结果按路径、修改时间和大小缓存, 重复请求不再打开文件
+    :param img_path:
+    :return:
+    """
+    stat = os.stat(img_path)
+    key = (img_path, stat.st_mtime, stat.st_size)
+    with _image_sizes_lock:
+        size = _image_sizes.get(key)
+        if size is not None:
+            _image_sizes.move_to_end(key)
+            return size
+    with Image.open(img_path) as im:
+        size = im.size
+    with _image_sizes_lock:
+        _image_sizes[key] = size
+        while len(_image_sizes) > IMAGE_SIZE_CACHE:
+            _image_sizes.popitem(last=False)
+    return size
+
+
+def get_rendition(img_path, max_side, fmt='jpg'):
+    """
+    获取长边不超过 max_side 的缩略图, 第一次请求时生成并缓存到磁盘
+    :param img_path: 原图路径
+    :param max_side:
+    :param fmt: jpg 或 webp
+    :return: 缩略图路径, 原图不需要缩小时返回原图路径
+    """
+    width, height = image_size(img_path)
+    if max(width, height) <= max_side:
+        return img_path
+    ext, quality_flag = RENDITION_FORMATS[fmt]
+    stat = os.stat(img_path)
+    key = '{}|{}|{}'.format(img_path, stat.st_mtime, stat.st_size)
+    name = '{}_{}{}'.format(hashlib.sha1(key.encode('utf-8')).hexdigest(), max_side, ext)
+    rendition_path = os.path.join(RENDITION_DIR, name[:2], name)
+    if os.path.isfile(rendition_path):
+        return rendition_path
+    img = cv2.imdecode(np.fromfile(img_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        with Image.open(img_path) as im:
+            img = np.array(im.convert('RGB'), dtype=np.uint8)[:, :, ::-1]
+    scale = max_side / max(width, height)
+    img = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))),
+                     interpolation=cv2.INTER_AREA)
+    ret, flow = cv2.imencode(ext, img, [quality_flag, RENDITION_QUALITY])
+    os.makedirs(os.path.dirname(rendition_path), exist_ok=True)
+    # 多个线程同时生成同一张时, 各自写临时文件再原子替换
+    tmp_path = '{}.{}.tmp'.format(rendition_path, threading.get_ident())
+    with open(tmp_path, 'wb') as f:
+        f.write(flow.tobytes())
+    os.replace(tmp_path, rendition_path)
+    return rendition_path
+
+
+@app.route('/xiaoi/get_image_raw', methods=['GET'])
+def get_image_raw():
+    """
+    直接返回图片文件的原始字节, 不再解码/重编码/base64,
+    带 Content-Type、ETag、Last-Modified, 支持条件请求(304)
+    参数: image_path, 可选 max_side 长边像素数或 scale 缩放比例(0~1) 返回缩略图, format 为 jpg(默认) 或 webp
+    响应头 X-Image-Size 为原图的 宽x高
+    :return:
+    """
+    image_path = request.args.get('image_path')
+    if not image_path:
+        return json.dumps({"erorr": "参数有误"}, ensure_ascii=False), 400
+    img_path = resolve_image_path(image_path)
+    if not os.path.isfile(img_path):
+        return json.dumps({"erorr": "图片不存在"}, ensure_ascii=False), 404
+    try:
+        width, height = image_size(img_path)
+        max_side = request.args.get('max_side', type=int)
+        scale = request.args.get('scale', type=float)
+        if max_side is None and scale is not None and 0 < scale < 1:
+            max_side = int(max(width, height) * scale)
+        fmt = request.args.get('format', 'jpg')
+        if fmt not in RENDITION_FORMATS:
+            return json.dumps({"erorr": "参数有误"}, ensure_ascii=False), 400
+        if max_side is not None and max_side > 0:
+            max_side = -(-max_side // RENDITION_STEP) * RENDITION_STEP
+            img_path = get_rendition(img_path, max_side, fmt)
+    except Exception as e:
+        print(e)
+        return json.dumps({"erorr": "图片读取失败"}, ensure_ascii=False), 500
+    response = send_file(img_path, conditional=True)
+    response.headers['X-Image-Size'] = '{}x{}'.format(width, height)
+    return response
+
+
 @app.route('/xiaoi/get_list', methods=['POST'])
 def get_list():
     try:
@@ -114,7 +235,6 @@ def get_list():
         result = json.dumps({'image_num': len(image_ids), 'image_list': image_ids}, ensure_ascii=False)
     except Exception as e:
         print(e)
-        session.rollback()
         result = json.dumps({'state': 0}, ensure_ascii=False)
     return result
 
@@ -127,7 +247,88 @@ def get_file_list():
         result = json.dumps({'image_num': len(image_ids_path), 'image_list': image_ids_path}, ensure_ascii=False)
     except Exception as e:
         print(e)
-        session.rollback()
+        result = json.dumps({'state': 0}, ensure_ascii=False)
+    return result
+
+
+FILE_PAGE_LIMIT = 500
+FILE_PAGE_LIMIT_MAX = 5000
+
+
+@app.route('/xiaoi/get_file_page', methods=['POST'])
+def get_file_page():
+    """
+    按 id 游标分页获取文件列表, 只返回 id、路径、标注数量、模糊标记
+    参数: after_id 上一页最后一个 id, limit 每页数量,
+         search 文件名包含的文本, labeled 是否已标注, fuzzy 模糊状态
+    :return: {'image_list': [[id, path, shape_count, fuzzy], ...], 'next_id': 下一页游标, 没有更多时为 None}
+    """
+    data = request_json() if request.data else {}
+    after_id = int(data.get('after_id') or 0)
+    limit = min(int(data.get('limit') or FILE_PAGE_LIMIT), FILE_PAGE_LIMIT_MAX)
+    search = data.get('search')
+    labeled = data.get('labeled')
+    fuzzy = data.get('fuzzy')
+    try:
+        query = session.query(VisualShanghai.id, VisualShanghai.image_path,
+                              VisualShanghai.shape_count, VisualShanghai.image_fuzzy)
+        query = query.filter(VisualShanghai.id > after_id)
+        if search:
+            # LIKE '%search%' 用不上 image_path 的索引, 只在 id 游标之后扫描到够一页为止
+            query = query.filter(VisualShanghai.image_path.contains(search, autoescape=True))
+        if labeled is not None:
+            query = query.filter(VisualShanghai.shape_count > 0 if labeled else VisualShanghai.shape_count == 0)
+        if fuzzy is not None:
+            query = query.filter(VisualShanghai.image_fuzzy == int(fuzzy))
+        visuals = query.order_by(VisualShanghai.id).limit(limit).all()
+        image_list = [[visual.id, visual.image_path, visual.shape_count, visual.image_fuzzy]
+                      for visual in visuals]
+        next_id = image_list[-1][0] if len(image_list) == limit else None
+        result = json.dumps({'image_list': image_list, 'next_id': next_id}, ensure_ascii=False)
+    except Exception as e:
+        print(e)
+        result = json.dumps({'state': 0}, ensure_ascii=False)
+    return result
+
+
+@app.route('/xiaoi/query_images', methods=['POST'])
+def query_images():
+    """
+    按形状查询图片, 条件走 visual_shape 和 shape_count 的索引, 不解析标签
+    参数: label 标签名或标签名列表(包含任意一个), shape_type 形状类型,
+         min_shapes/max_shapes 标注数量范围, after_id 上一页最后一个 id, limit 每页数量
+    :return: 与 get_file_page 相同, {'image_list': [[id, path, shape_count, fuzzy], ...], 'next_id': 下一页游标}
+    """
+    data = request_json() if request.data else {}
+    after_id = int(data.get('after_id') or 0)
+    limit = min(int(data.get('limit') or FILE_PAGE_LIMIT), FILE_PAGE_LIMIT_MAX)
+    label = data.get('label')
+    shape_type = data.get('shape_type')
+    min_shapes = data.get('min_shapes')
+    max_shapes = data.get('max_shapes')
+    try:
+        query = session.query(VisualShanghai.id, VisualShanghai.image_path,
+                              VisualShanghai.shape_count, VisualShanghai.image_fuzzy)
+        query = query.filter(VisualShanghai.id > after_id)
+        if label or shape_type:
+            shapes = session.query(VisualShape.image_id)
+            if label:
+                labels = label if isinstance(label, list) else [label]
+                shapes = shapes.filter(VisualShape.label.in_(labels))
+            if shape_type:
+                shapes = shapes.filter(VisualShape.shape_type == shape_type)
+            query = query.filter(VisualShanghai.id.in_(shapes))
+        if min_shapes is not None:
+            query = query.filter(VisualShanghai.shape_count >= int(min_shapes))
+        if max_shapes is not None:
+            query = query.filter(VisualShanghai.shape_count <= int(max_shapes))
+        visuals = query.order_by(VisualShanghai.id).limit(limit).all()
+        image_list = [[visual.id, visual.image_path, visual.shape_count, visual.image_fuzzy]
+                      for visual in visuals]
+        next_id = image_list[-1][0] if len(image_list) == limit else None
+        result = json.dumps({'image_list': image_list, 'next_id': next_id}, ensure_ascii=False)
+    except Exception as e:
+        print(e)
         result = json.dumps({'state': 0}, ensure_ascii=False)
     return result
 
@@ -135,12 +336,12 @@ def get_file_list():
 @app.route('/xiaoi/get_lable_by_id', methods=['POST'])
 def get_lable_by_id():
     if request.data:
-        data = json.loads(request.data)
+        data = request_json()
         try:
             tag = session.query(VisualShanghai.tag).filter(VisualShanghai.id == data['image_id']).all()
             result = json.dumps({'lable': tag[0][0]}, ensure_ascii=False)
-        except:
-            session.rollback()
+        except Exception as e:
+            print(e)
             result = json.dumps({'state': 0}, ensure_ascii=False)
         return result
 
@@ -148,15 +349,15 @@ def get_lable_by_id():
 @app.route('/xiaoi/get_lable_by_path', methods=['POST'])
 def get_lable_by_path():
     if request.data:
-        data = json.loads(request.data)
+        data = request_json()
         try:
-            visual = session.query(VisualShanghai.image_label, VisualShanghai.image_fuzzy).filter(
+            visual = session.query(VisualShanghai.image_label, VisualShanghai.label_pack,
+                                   VisualShanghai.image_fuzzy).filter(
                 VisualShanghai.image_path == data['image_path']).first()
-            result = json.dumps({'label': visual.image_label, "fuzzy": visual.image_fuzzy}, ensure_ascii=False)
+            result = label_response(visual.image_label, visual.label_pack, fuzzy=visual.image_fuzzy)
         except Exception as e:
             print(e)
             print(data)
-            session.rollback()
             result = json.dumps({'state': 0}, ensure_ascii=False)
         return result
 
@@ -164,21 +365,14 @@ def get_lable_by_path():
 @app.route('/xiaoi/save_lable', methods=['POST'])
 def save_lable():
     if request.data:
-        data = json.loads(request.data)
-        id = data['image_id']
-        lable = data['image_tag']
-        lable = json.dumps(lable)
-        try:
-            result = session.query(VisualShanghai).filter(VisualShanghai.id == id).first()
-        except:
-            session.rollback()
-        old_tag = result.tag
-        result.tag = lable
+        data = request_json()
         try:
+            result = session.query(VisualShanghai).filter(VisualShanghai.id == data['image_id']).first()
+            result.tag = json.dumps(data['image_tag'])
             session.commit()
             res = json.dumps({'state': 1}, ensure_ascii=False)
-        except:
-            session.rollback()
+        except Exception as e:
+            print("Exception", e)
             res = json.dumps({'state': 0}, ensure_ascii=False)
         return res
 
@@ -186,26 +380,46 @@ def save_lable():
 @app.route('/xiaoi/save_lable_by_path', methods=['POST'])
 def save_lable_by_path():
     if request.data:
-        data = json.loads(request.data)
+        data = request_json()
         image_path = data['image_path']
-        image_label = data['image_label']
-        image_label = json.dumps(image_label)
+        image_label = json.dumps(data['image_label'])
         try:
             result = session.query(VisualShanghai).filter(VisualShanghai.image_path == image_path).first()
-            result.image_label = image_label
+            result.set_label(image_label)
+            save_shapes([result])
+            session.commit()
+            res = json.dumps({'state': 1}, ensure_ascii=False)
         except Exception as e:
-            print("Exception1", e)
+            print("Exception", e)
             print("data", data)
-            session.rollback()
             res = json.dumps({'state': 0}, ensure_ascii=False)
-            return res
+        return res
+
+
+@app.route('/xiaoi/save_labels', methods=['POST'])
+def save_labels():
+    """
+    批量保存标签, 在一个事务中完成; 与 save_lable_by_path 一致, 数据库中没有的图片不保存, 在 missing 中返回
+    参数: labels [{'image_path': 图片路径, 'image_label': 标签}, ...], 同一图片以最后一条为准
+    :return: {'state': 1, 'saved': 保存数量, 'missing': [数据库中没有的图片路径, ...]}
+    """
+    if request.data:
+        data = request_json()
+        labels = dict()
+        for item in data['labels']:
+            labels[item['image_path']] = json.dumps(item['image_label'])
         try:
+            visuals = session.query(VisualShanghai).filter(
+                VisualShanghai.image_path.in_(list(labels.keys()))).all()
+            for visual in visuals:
+                visual.set_label(labels[visual.image_path])
+            exists = set(visual.image_path for visual in visuals)
+            missing = [image_path for image_path in labels if image_path not in exists]
+            save_shapes(visuals)
             session.commit()
-            res = json.dumps({'state': 1}, ensure_ascii=False)
+            res = json.dumps({'state': 1, 'saved': len(visuals), 'missing': missing}, ensure_ascii=False)
         except Exception as e:
-            print("Exception2", e)
-            print("data", data)
-            session.rollback()
+            print("Exception", e)
             res = json.dumps({'state': 0}, ensure_ascii=False)
         return res
 
@@ -213,20 +427,14 @@ def save_lable_by_path():
 @app.route('/xiaoi/set_fuzzy', methods=['POST'])
 def set_fuzzy():
     if request.data:
-        data = json.loads(request.data)
-        id = data['image_id']
-        fuzzy = data['fuzzy']
-        try:
-            result = session.query(VisualShanghai).filter(VisualShanghai.id == id).first()
-        except:
-            session.rollback()
-        old_fuzzy = VisualShanghai.image_fuzzy
-        result.image_fuzzy = fuzzy
+        data = request_json()
         try:
+            result = session.query(VisualShanghai).filter(VisualShanghai.id == data['image_id']).first()
+            result.set_fuzzy(data['fuzzy'])
             session.commit()
             res = json.dumps({'state': 1}, ensure_ascii=False)
-        except:
-            session.rollback()
+        except Exception as e:
+            print("Exception", e)
             res = json.dumps({'state': 0}, ensure_ascii=False)
         return res
 
@@ -234,23 +442,14 @@ def set_fuzzy():
 @app.route('/xiaoi/set_fuzzy_by_path', methods=['POST'])
 def set_fuzzy_by_path():
     if request.data:
-        data = json.loads(request.data)
-        image_path = data['image_path']
-        fuzzy = data['fuzzy']
-        try:
-            result = session.query(VisualShanghai).filter(VisualShanghai.image_path == image_path).first()
-        except:
-            session.rollback()
-            session.rollback()
-            res = json.dumps({'state': 0}, ensure_ascii=False)
-            return res
-        old_fuzzy = result.image_fuzzy
-        result.image_fuzzy = fuzzy
+        data = request_json()
         try:
+            result = session.query(VisualShanghai).filter(VisualShanghai.image_path == data['image_path']).first()
+            result.set_fuzzy(data['fuzzy'])
             session.commit()
             res = json.dumps({'state': 1}, ensure_ascii=False)
-        except:
-            session.rollback()
+        except Exception as e:
+            print("Exception", e)
             res = json.dumps({'state': 0}, ensure_ascii=False)
         return res
 
@@ -258,15 +457,9 @@ def set_fuzzy_by_path():
 @app.route('/xiaoi/inverse_color', methods=['POST'])
 def inverse_color():
     if request.data:
-        data = json.loads(request.data)
+        data = request_json()
         image_path = session.query(VisualShanghai.image_path).filter(VisualShanghai.id == data['image_id']).all()
-        img_path = image_path[0][0]
-        # img_path = 'D:\\baidu_img\\动物\\93.jpg'
-        # filepath, filename = os.path.split(img_path)
-        filename = os.path.basename(img_path)
-        img_path = os.path.join(PATH_C, filename)
-        if not os.path.isfile(img_path):
-            img_path = os.path.join(PATH_D, filename)
+        img_path = resolve_image_path(image_path[0][0])
         img = cv2.imdecode(np.fromfile(img_path, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
         if img is None:
             img = Image.open(img_path)
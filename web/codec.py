@@ -0,0 +1,74 @@
+# -*- coding=utf-8 -*-
+"""
+请求和响应的编码: 请求体按 Content-Encoding 解压, 较大的响应按 Accept-Encoding 压缩;
+标签接口在双方都安装了 msgpack 时使用 MessagePack, 否则仍使用 JSON
+"""
+import gzip
+
+from flask import Response, request, json
+
+from label_pack import MSGPACK_MIMETYPE, ext_hook, label_bytes, msgpack, pack_map
+
+# 小于此大小(字节)的响应不压缩, 压缩省下的字节抵不上额外的 CPU 开销
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+
+
+def accepts_msgpack():
+    return msgpack is not None and \
+        MSGPACK_MIMETYPE in request.headers.get('Accept', '')
+
+
+def request_json():
+    """
+    解析请求体, 客户端可以用 gzip 压缩请求体(Content-Encoding: gzip),
+    Content-Type 为 application/x-msgpack 时按 MessagePack 解析
+    :return:
+    """
+    body = request.get_data()
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        body = gzip.decompress(body)
+    if msgpack is not None and request.mimetype == MSGPACK_MIMETYPE:
+        return msgpack.unpackb(body, raw=False, ext_hook=ext_hook)
+    return json.loads(body)
+
+
+def label_response(label, packed=None, **fields):
+    """
+    返回标签, 客户端接受 MessagePack 时 label 为解析后的对象, 否则为 JSON 字符串
+    :param label: 数据库中保存的标签 JSON 字符串
+    :param packed: 数据库中保存的打包好的标签, 有则直接返回, 没有(旧数据)时临时解析打包
+    :param fields: 其他字段, 如 fuzzy
+    :return:
+    """
+    if accepts_msgpack():
+        if packed is None:
+            packed = label_bytes(json.loads(label)) if label else None
+        if packed is None:
+            packed = msgpack.packb(label, use_bin_type=True)
+        return Response(pack_map(fields, {'label': packed}), mimetype=MSGPACK_MIMETYPE)
+    fields['label'] = label
+    return json.dumps(fields, ensure_ascii=False)
+
+
+def compress_response(response):
+    """
+    after_request 钩子: 客户端接受 gzip 时压缩较大的响应, 图片等文件响应保持原样;
+    所有响应都带上 Accept-Encoding: gzip (RFC 7694), 客户端据此才压缩请求体
+    :param response:
+    :return:
+    """
+    response.headers['Accept-Encoding'] = 'gzip'
+    if response.direct_passthrough or response.status_code != 200 or \
+            'Content-Encoding' in response.headers or \
+            response.mimetype.startswith('image/') or \
+            'gzip' not in request.headers.get('Accept-Encoding', '').lower():
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(data, COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Content-Length'] = str(len(response.get_data()))
+    response.vary.add('Accept-Encoding')
+    return response
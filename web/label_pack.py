@@ -0,0 +1,73 @@
+# -*- coding=utf-8 -*-
+"""
+标签的 MessagePack 格式, 形状的 points 打包为 float64 小端数组 (扩展类型 POINTS_EXT)
+保存标签时打包一次存入数据库 (VisualShanghai.label_pack), 读取时直接返回, 不再解析 JSON
+没有安装 msgpack 时 msgpack 为 None, 标签接口只使用 JSON
+"""
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+# float64 保证与 JSON 中的数值完全一致
+POINTS_EXT = 1
+
+
+def ext_hook(code, data):
+    """解包时把 points 还原为列表, 便于再保存为 JSON"""
+    if code == POINTS_EXT:
+        return np.frombuffer(data, dtype='<f8').reshape(-1, 2).tolist()
+    return msgpack.ExtType(code, data)
+
+
+def pack_label(label):
+    """标签中每个形状的 points 转为类型化数组"""
+    shapes = []
+    for shape in label.get('shapes') or []:
+        shape = dict(shape)
+        shape['points'] = msgpack.ExtType(
+            POINTS_EXT, np.asarray(shape.get('points') or [], dtype='<f8').tobytes())
+        shapes.append(shape)
+    label = dict(label)
+    label['shapes'] = shapes
+    return label
+
+
+def label_bytes(label):
+    """
+    打包后的标签, 用于存入数据库
+    :param label: 解析后的标签
+    :return: bytes, 没有安装 msgpack 或标签为空时返回 None
+    """
+    if msgpack is None or not isinstance(label, dict):
+        return None
+    try:
+        return msgpack.packb(pack_label(label), use_bin_type=True)
+    except Exception:
+        return None
+
+
+def pack_map(fields, packed):
+    """
+    打包 dict, packed 中的值已经是 MessagePack 字节, 直接拼接而不再解包
+    :param fields: 普通字段
+    :param packed: {字段名: 打包好的字节}
+    :return: bytes
+    """
+    parts = [_map_header(len(fields) + len(packed))]
+    for key, value in fields.items():
+        parts.append(msgpack.packb(key, use_bin_type=True))
+        parts.append(msgpack.packb(value, use_bin_type=True))
+    for key, value in packed.items():
+        parts.append(msgpack.packb(key, use_bin_type=True))
+        parts.append(value)
+    return b''.join(parts)
+
+
+def _map_header(size):
+    if size < 16:
+        return bytes([0x80 | size])
+    return b'\xde' + size.to_bytes(2, 'big')
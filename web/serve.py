@@ -0,0 +1,79 @@
+# -*- coding=utf-8 -*-
+"""
+生产模式启动服务器, 参数见 server.yaml
+Linux 使用 gunicorn (多进程 + 多线程), Windows 使用 waitress (单进程多线程)
+在 web 目录下执行: python serve.py [--config server.yaml] [--workers 8] [--threads 4]
+平滑重启: kill -HUP <master pid>, 进行中的请求处理完后再换新进程
+主进程不导入 app_v3 和 dao, 由每个工作进程自己导入, 所以 HUP 后新进程使用修改后的代码
+每个进程有自己的数据库连接池 (dao.dao 中 POOL_SIZE + MAX_OVERFLOW 个连接),
+进程数 * (POOL_SIZE + MAX_OVERFLOW) 不能超过 MySQL 的 max_connections
+"""
+import argparse
+import multiprocessing
+import os
+import platform
+
+import yaml
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.yaml')
+
+
+def load_config(config_file):
+    with open(config_file, encoding='utf-8') as f:
+        config = yaml.safe_load(f) or {}
+    if not config.get('workers'):
+        config['workers'] = multiprocessing.cpu_count() * 2 + 1
+    return config
+
+
+def run_gunicorn(config):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+
+        def load_config(self):
+            self.cfg.set('bind', '{}:{}'.format(config['host'], config['port']))
+            self.cfg.set('worker_class', 'gthread')
+            for key in ('workers', 'threads', 'keepalive', 'timeout', 'graceful_timeout',
+                        'max_requests', 'max_requests_jitter', 'backlog'):
+                if config.get(key) is not None:
+                    self.cfg.set(key, config[key])
+
+        def load(self):
+            # 在工作进程中导入, 数据库连接池也在 fork 之后才创建
+            from app_v3 import app
+            return app
+
+    Application().run()
+
+
+def run_waitress(config):
+    from waitress import serve
+
+    from app_v3 import app
+
+    serve(app, host=config['host'], port=config['port'],
+          threads=config['workers'] * config['threads'],
+          channel_timeout=config['timeout'],
+          backlog=config['backlog'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default=CONFIG_FILE)
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--threads', type=int)
+    args = parser.parse_args()
+    config = load_config(args.config)
+    for key in ('port', 'workers', 'threads'):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    if platform.system() == 'Windows':
+        run_waitress(config)
+    else:
+        run_gunicorn(config)
+
+
+if __name__ == '__main__':
+    main()